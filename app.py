@@ -1,12 +1,35 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_file, send_from_directory, stream_with_context
 import base64
+import functools
+import hashlib
 import io
+import json
 import os
+import tempfile
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from PIL import Image
-import torch
-from diffusers import StableDiffusionXLPipeline
+import numpy as np
 import logging
+from utils.batching import BatchScheduler
+from utils.result_cache import ResultCache
+from utils.result_store import ResultStore, deliver_result as deliver_encoded, inline_result, result_delivery
+from utils.prompt_cache import PromptEmbeddingCache
+from utils.encoding import EncoderPool, request_output_overrides
+from utils.jobs import JobManager, TERMINAL_STATUSES
+from utils.admission import AdmissionController, CancelToken, Cancelled, DeadlineExceeded, Overloaded
+from utils.image_io import decode_image
+from utils.image_utils import preprocess_clothing_batch, preprocess_person_batch
+from utils.garment_catalog import GarmentCatalog
+from utils.metrics import MetricsRegistry, StageTimer
+from utils.latent_preview import LatentPreviewer
+from utils.quality_tiers import QualityTiers, SchedulerSwitcher
+from utils.cpu_inference import CpuInferenceOptions, configure_threads, prepare_pipeline, inference_autocast
+from utils.memory_budget import MB, MemoryManager
+from utils.backends import BackendRegistry, BlendBackend, DiffusionBackend, OverlayBackend
+from utils.profiling import Profiler, requested_profile
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,131 +38,966 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Global variables
-pipe = None
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# Global variables; torch and diffusers are imported by the model loader, not at startup
+device = None
+
+MODEL_ID = "Kwai-Kolors/Kolors"
+PERSON_SIZE = (512, 768)
+CLOTHING_SIZE = (512, 512)
+DEFAULT_PROMPT = "photorealistic, high quality, detailed clothing, perfect fit, natural lighting, professional photography"
+NEGATIVE_PROMPT = "blurry, low quality, distorted, deformed, ugly, bad anatomy, extra limbs, missing limbs, floating limbs, disconnected limbs, malformed hands, poorly drawn hands, mutated hands, extra fingers, fewer fingers, bad proportions, mutation, deformed, ugly, disgusting, amputation"
+
+# Uploads outside these bounds are rejected from the image header, before decoding
+IMAGE_MIN_SIDE = int(os.environ.get('IMAGE_MIN_SIDE', '64'))
+IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', '8192'))
+IMAGE_LIMITS = {
+    'min_size': (IMAGE_MIN_SIDE, IMAGE_MIN_SIDE),
+    'max_size': (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE)
+}
+
+# Generation is fully deterministic, so the seed and the tier's settings form part of the result cache key
+GENERATION_SEED = 42
+
+# Denoise and enhance each batch's person and garment images before the pipeline, as stacked arrays
+PREPROCESS_INPUTS = os.environ.get('PREPROCESS_INPUTS', '0').lower() in ('1', 'true', 'yes', 'on')
+
+# Named scheduler/steps/guidance presets that requests pick with a ``quality`` field
+quality_tiers = QualityTiers.from_env()
+
+# Precomputed catalog garments, requested by garment_id instead of an uploaded image
+garment_catalog = GarmentCatalog.from_env()
+
+# Cache of finished results keyed by input pixels, prompt and parameters
+result_cache = ResultCache.from_env()
+
+# Encoded results written to a content-addressed store and returned as URLs;
+# ``result_delivery: inline`` (or RESULT_DELIVERY=inline) returns base64 instead
+RESULT_DELIVERY = os.environ.get('RESULT_DELIVERY', 'url')
+result_store = ResultStore.from_env(default_dir=os.path.join(tempfile.gettempdir(), 'tryon-results'))
+
+# Requests profiled on demand (X-Profile header) or sampled; traces go to PROFILE_DIR
+# and responses carry only their paths
+profiler = Profiler.from_env()
+
+# Text embeddings for the default/negative prompts plus an LRU of custom prompts, per pipeline
+PROMPT_CACHE_SIZE = int(os.environ.get('PROMPT_CACHE_SIZE', '64'))
+
+# Diffusion variants requests can pick with a ``model`` field, as JSON of name ->
+# {"model_id", "components_from"}; variants with the same components_from share its
+# VAE and text encoders. Loaded pipelines are kept in an LRU capped at MODEL_CACHE_MB
+# (default: what the memory budget leaves after a full batch)
+MODEL_VARIANTS = {'kolors': {'model_id': MODEL_ID}, **json.loads(os.environ.get('MODEL_VARIANTS') or '{}')}
+DEFAULT_MODEL = os.environ.get('DEFAULT_MODEL', 'kolors')
+MODEL_CACHE_MB = float(os.environ.get('MODEL_CACHE_MB', '0'))
+
+# Output encoding runs in a bounded pool so it overlaps with the next inference
+encoder_pool = EncoderPool.from_env()
+
+# Low-resolution previews of intermediate latents for jobs submitted with ``preview``
+latent_previewer = LatentPreviewer.from_env()
+PREVIEW_OUTPUT_OPTIONS = encoder_pool.resolve({
+    'format': 'jpeg', 'quality': os.environ.get('PREVIEW_QUALITY', '70')
+})
+
+# Micro-batching of concurrent try-on requests
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '4'))
+BATCH_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', '50'))
+
+# Asynchronous jobs; enough workers by default to fill a batch
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', str(BATCH_MAX_SIZE)))
+JOB_HISTORY = int(os.environ.get('JOB_HISTORY', '256'))
+SSE_HEARTBEAT_SECONDS = 15
+
+# Default per-request deadline in seconds (0 for none); requests may set their own
+# with a ``timeout`` field or an X-Request-Timeout header
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', '0'))
+
+# Offload, attention slicing, VAE tiling and the batch limit are chosen to fit
+# MEMORY_BUDGET_MB (default: device or container memory less MEMORY_HEADROOM)
+memory_manager = MemoryManager.from_env(max_batch_size=BATCH_MAX_SIZE)
+
+# Requests whose estimated queue time exceeds their deadline, or beyond MAX_QUEUE
+# outstanding ones (0 for no limit), are rejected with a Retry-After hint
+MAX_QUEUE = int(os.environ.get('MAX_QUEUE', '0'))
+admission = AdmissionController(max_batch_size=BATCH_MAX_SIZE, max_queue=MAX_QUEUE)
+
+# In-process metrics, exposed in Prometheus format at /metrics
+metrics = MetricsRegistry()
+REQUEST_SECONDS = metrics.histogram(
+    'tryon_request_seconds', 'End-to-end latency of try-on requests', ('endpoint',)
+)
+STAGE_SECONDS = metrics.histogram(
+    'tryon_stage_seconds', 'Time spent in each processing stage', ('stage',)
+)
+BATCH_SIZE = metrics.histogram(
+    'tryon_batch_size', 'Number of requests per pipeline batch', buckets=(1, 2, 4, 8, 16, 32)
+)
+REQUESTS_TOTAL = metrics.counter(
+    'tryon_requests_total', 'Try-on requests by endpoint and status', ('endpoint', 'status')
+)
+ERRORS_TOTAL = metrics.counter(
+    'tryon_errors_total', 'Try-on requests that failed', ('endpoint',)
+)
+CACHE_LOOKUPS = metrics.counter(
+    'tryon_cache_lookups_total', 'Result and prompt cache lookups', ('cache', 'result')
+)
+QUEUE_DEPTH = metrics.gauge(
+    'tryon_queue_depth', 'Requests waiting to be processed', ('queue',)
+)
+ESTIMATED_WAIT = metrics.gauge(
+    'tryon_estimated_wait_seconds', 'Estimated queue time for newly admitted work'
+)
+PEAK_MEMORY = metrics.histogram(
+    'tryon_batch_peak_memory_bytes', 'Peak device (or process RSS) memory during each pipeline batch',
+    buckets=tuple(gb * 1024 ** 3 for gb in (0.5, 1, 2, 4, 8, 16, 24, 32, 48, 64, 96))
+)
+BATCH_LIMIT = metrics.gauge(
+    'tryon_batch_limit', 'Largest pipeline batch that fits the memory budget'
+)
+DENOISED_IMAGES = metrics.counter(
+    'tryon_denoise_images_total', 'Person images by the denoise tier chosen from their noise estimate', ('tier',)
+)
+DENOISE_SECONDS = metrics.histogram(
+    'tryon_denoise_seconds', 'Time spent denoising each person image', ('tier',)
+)
+NOISE_SIGMA = metrics.histogram(
+    'tryon_person_noise_sigma', 'Estimated noise level of person images, in 0-255 levels',
+    buckets=(0.5, 1, 2, 3, 4, 6, 8, 12, 16, 32)
+)
+
+# Stages timed once per pipeline batch; the rest are timed per request
+BATCH_STAGES = ('resize', 'preprocess', 'text_encode', 'denoise', 'preview', 'vae_decode')
+
+# CPU performance mode (CPU_MODE=fast), used when no GPU is available
+cpu_options = CpuInferenceOptions.from_env()
+
+# Denoising steps of the warmup inference run before the server reports ready; 0 disables it
+WARMUP_STEPS = int(os.environ.get('WARMUP_STEPS', '2'))
+
+# Seconds clients are asked to wait before retrying while the model is loading
+NOT_READY_RETRY_AFTER = 10
+
+# Model lifecycle: starting -> loading -> warming_up -> ready, or failed
+model_state = {
+    'status': 'starting',
+    'error': None,
+    'import_time': None,
+    'load_time': None,
+    'warmup_time': None
+}
+
+def encode_prompt(pipe, prompt):
+    """Run a prompt through a pipeline's text encoders, returning (prompt_embeds, pooled_prompt_embeds)"""
+    import torch
+    
+    with torch.no_grad():
+        prompt_embeds, _, pooled_prompt_embeds, _ = pipe.encode_prompt(
+            prompt=prompt,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=False
+        )
+    return prompt_embeds, pooled_prompt_embeds
 
 def load_model():
-    """Load the Kolors model"""
-    global pipe
+    """Load the default model"""
+    global device
     
     logger.info("Loading Kolors Virtual Try-On model...")
     try:
-        pipe = StableDiffusionXLPipeline.from_pretrained(
-            "Kwai-Kolors/Kolors",
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-            use_safetensors=True,
-            variant="fp16" if device == "cuda" else None
-        )
+        start_time = time.perf_counter()
+        import torch
+        import diffusers
+        model_state['import_time'] = time.perf_counter() - start_time
         
-        if device == "cuda":
-            pipe = pipe.to("cuda")
-            pipe.enable_model_cpu_offload()
-            pipe.enable_attention_slicing()
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        if device == "cpu":
+            threads, interop_threads = configure_threads(cpu_options)
+            logger.info(f"CPU inference with {threads} intra-op and {interop_threads} inter-op threads")
+        
+        start_time = time.perf_counter()
+        default_backend = backends.acquire()
+        
+        try:
+            latent_previewer.load(device, default_backend.pipe.vae.dtype)
+        except Exception as e:
+            logger.warning(f"Could not load the {latent_previewer.decoder} preview decoder, using linear previews: {str(e)}")
+            latent_previewer.decoder = 'linear'
+        model_state['load_time'] = time.perf_counter() - start_time
         
         logger.info(f"Model loaded successfully on {device}")
         return True
         
     except Exception as e:
+        model_state['error'] = str(e)
         logger.error(f"Error loading model: {str(e)}")
         return False
 
-def decode_base64_image(base64_string):
-    """Convert base64 string to PIL Image"""
+def load_pipeline(backend, shared):
+    """Load a diffusion variant's pipeline, reusing ``shared`` components, and place it
+    
+    The first pipeline loaded sets the memory plan; later ones are placed the
+    same way. A variant whose ``components_from`` model is not loaded yet
+    loads that model's shared components first.
+    """
+    import torch
+    from diffusers import StableDiffusionXLPipeline
+    
+    pretrained_options = {
+        'torch_dtype': torch.float16 if device == "cuda" else torch.float32,
+        'use_safetensors': True,
+        'variant': "fp16" if device == "cuda" else None
+    }
+    
+    if backends.share_components and not shared and backend.components_from != backend.model_id:
+        logger.info(f"Loading components shared from {backend.components_from}...")
+        base = StableDiffusionXLPipeline.from_pretrained(backend.components_from, unet=None, **pretrained_options)
+        shared = backends.shared.put(backend.components_from, base.components)
+    
+    logger.info(f"Loading {backend.name} ({backend.model_id})" + (f", sharing {', '.join(shared)}" if shared else ''))
+    pipe = StableDiffusionXLPipeline.from_pretrained(backend.model_id, **shared, **pretrained_options)
+    
+    if memory_manager.plan is None:
+        # Place the pipeline and size batches to fit the memory budget
+        activation_bytes = 2 if device == "cuda" or cpu_options.use_bf16() else 4
+        plan = memory_manager.plan_pipeline(pipe, device, PERSON_SIZE, dtype_bytes=activation_bytes)
+        apply_batch_limit(plan.max_batch_size)
+        
+        # CPU offload hooks are installed per pipeline, so offloaded pipelines keep their own components
+        backends.share_components = plan.offload == 'none'
+        model_capacity = memory_manager.model_capacity() if plan.offload == 'none' else None
+        backends.max_bytes = int(MODEL_CACHE_MB * MB or model_capacity or 0)
+    
+    applied = memory_manager.apply(pipe, device)
+    logger.info(
+        f"Memory plan: {', '.join(applied) or 'fully resident'}, batches of up to "
+        f"{memory_manager.plan.max_batch_size} ({memory_manager.report()['budget_mb']} MB budget)"
+    )
+    
+    if device == "cpu" and cpu_options.enabled:
+        applied = prepare_pipeline(pipe, cpu_options)
+        logger.info(f"CPU mode '{cpu_options.mode}': {', '.join(applied) or 'no optimizations'}")
+    
+    backend.pipe = pipe
+    
+    # Tiers swap schedulers built from the one the model was loaded with
+    backend.scheduler_switcher = SchedulerSwitcher(pipe)
+    
+    # Encode the fixed prompts once instead of on every request
+    backend.prompt_cache = PromptEmbeddingCache(functools.partial(encode_prompt, pipe), max_entries=PROMPT_CACHE_SIZE)
+    backend.prompt_cache.pin(DEFAULT_PROMPT)
+    backend.prompt_cache.pin(NEGATIVE_PROMPT)
+
+def apply_batch_limit(limit):
+    """Cap pipeline batches, and the admission estimate, at what fits the memory budget"""
+    batch_scheduler.max_batch_size = limit
+    admission.max_batch_size = limit
+    BATCH_LIMIT.set(limit)
+
+def warmup_model():
+    """Run a short inference so the first real request doesn't pay one-off kernel and allocator costs"""
+    if WARMUP_STEPS <= 0:
+        return
+    
+    logger.info(f"Running {WARMUP_STEPS}-step warmup inference...")
+    start_time = time.perf_counter()
+    process_virtual_tryon_batch([{
+        'person_image': Image.new('RGB', PERSON_SIZE, (128, 128, 128)),
+        'clothing_image': Image.new('RGB', CLOTHING_SIZE, (128, 128, 128)),
+        'prompt': DEFAULT_PROMPT
+    }], num_inference_steps=WARMUP_STEPS, record_metrics=False)
+    model_state['warmup_time'] = time.perf_counter() - start_time
+
+def initialize_model():
+    """Load and warm up the model, then mark the server ready; runs on a background thread"""
+    model_state['status'] = 'loading'
+    if not load_model():
+        model_state['status'] = 'failed'
+        return
+    
+    model_state['status'] = 'warming_up'
+    try:
+        warmup_model()
+    except Exception as e:
+        # The model itself loaded, so serve anyway and let real requests surface errors
+        logger.warning(f"Warmup inference failed: {str(e)}")
+    
+    model_state['status'] = 'ready'
+    logger.info("Model ready. Startup timings: " + ', '.join(
+        f"{name} {model_state[name + '_time']:.2f}s"
+        for name in ('import', 'load', 'warmup')
+        if model_state[name + '_time'] is not None
+    ))
+
+def start_model_loading():
+    """Start loading the model in the background and return the loader thread"""
+    thread = threading.Thread(target=initialize_model, name='model-loader', daemon=True)
+    thread.start()
+    return thread
+
+def startup_report():
+    """Model lifecycle status and startup timings for health endpoints"""
+    report = {'model_status': model_state['status']}
+    for name in ('import_time', 'load_time', 'warmup_time'):
+        if model_state[name] is not None:
+            report[name] = round(model_state[name], 2)
+    if model_state['error']:
+        report['error'] = model_state['error']
+    return report
+
+def require_ready(view):
+    """Reject requests with 503 and Retry-After until the model is loaded and warmed up"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if model_state['status'] != 'ready':
+            response = jsonify({
+                'error': 'Model is not ready',
+                'model_status': model_state['status'],
+                'status': 'error'
+            })
+            response.status_code = 503
+            if model_state['status'] != 'failed':
+                response.headers['Retry-After'] = str(NOT_READY_RETRY_AFTER)
+            return response
+        return view(*args, **kwargs)
+    return wrapper
+
+def decode_base64_image(base64_string, target_size=None):
+    """Convert base64 string to PIL Image, decoding straight to target_size if given"""
     try:
         if base64_string.startswith('data:image'):
-            base64_string = base64_string.split(',')[1]
+            base64_string = base64_string.partition(',')[2]
         
         image_data = base64.b64decode(base64_string)
-        image = Image.open(io.BytesIO(image_data))
-        return image.convert('RGB')
+        return decode_image(io.BytesIO(image_data), target_size=target_size, **IMAGE_LIMITS)
     except Exception as e:
         raise ValueError(f"Invalid base64 image: {str(e)}")
 
-def encode_image_to_base64(image):
-    """Convert PIL Image to base64 string"""
-    buffer = io.BytesIO()
-    image.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}"
+def decode_image_file(file, target_size=None):
+    """Convert a binary image stream (e.g. an uploaded file) to PIL Image
+    
+    The header is validated before any pixels are decoded, and JPEGs are
+    decoded at reduced resolution when a smaller target_size is requested.
+    """
+    try:
+        return decode_image(file, target_size=target_size, **IMAGE_LIMITS)
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {str(e)}")
+
+def catalog_garment(garment_id):
+    """Clothing image and content digest of a catalog garment"""
+    if garment_catalog is None:
+        raise ValueError("garment_id given but no garment catalog is configured")
+    
+    return garment_catalog.image(garment_id), garment_catalog.entry(garment_id)['digest']
 
-def process_virtual_tryon(person_image, clothing_image, prompt=""):
-    """Process virtual try-on using Kolors model"""
-    global pipe
+def load_clothing_image(fields, files=None):
+    """Clothing image and optional cache digest, from a catalog ``garment_id`` or an upload
+    
+    ``fields`` is the JSON body or form; if ``files`` is given the upload is
+    read from there rather than from a base64 ``clothing_image`` field.
+    """
+    garment_id = fields.get('garment_id')
+    if garment_id:
+        return catalog_garment(garment_id)
+    
+    if files is not None:
+        return decode_image_file(files['clothing_image'].stream, CLOTHING_SIZE), None
+    return decode_base64_image(fields['clothing_image'], CLOTHING_SIZE), None
+
+def encode_image_to_bytes(image, options=None):
+    """Encode PIL Image in the encoder pool, returning the encoded result dict"""
+    return encoder_pool.encode(image, options)
+
+def to_data_url(encoded):
+    """Convert an encoded result dict to a base64 data URL string"""
+    return inline_result(encoded, data_url=True)
+
+def deliver_result(encoded, delivery):
+    """Response fields carrying the result: a store URL and ETag, or an inline data URL"""
+    return deliver_encoded(encoded, delivery, result_store, data_url=True)
+
+def encoding_details(encoded):
+    """Summarise an encoded result for API responses"""
+    return {
+        'output_format': encoded['format'],
+        'encoded_size': encoded['encoded_size'],
+        'encode_time': round(encoded['encode_time'], 3)
+    }
+
+def record_request(endpoint, status, seconds, stages=None):
+    """Record request counters, latency and per-request stage times"""
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    
+    if status != 'success':
+        ERRORS_TOTAL.inc(endpoint=endpoint)
+    
+    if stages is not None:
+        for stage, stage_seconds in stages.stages.items():
+            if stage not in BATCH_STAGES:
+                STAGE_SECONDS.observe(stage_seconds, stage=stage)
+
+def server_timing(stages):
+    """Format stage times as a Server-Timing header value"""
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.stages.items())
+
+def synchronize():
+    """Wait for queued device work so stage timings are accurate"""
+    if device == "cuda":
+        import torch
+        torch.cuda.synchronize()
+
+def decode_latents(pipe, latents):
+    """Decode latents into PIL images with the pipeline's VAE"""
+    import torch
+    
+    vae = pipe.vae
+    
+    # The SDXL VAE overflows in float16, so decode in float32 where required
+    needs_upcasting = vae.dtype == torch.float16 and vae.config.force_upcast
+    if needs_upcasting:
+        pipe.upcast_vae()
+    latents = latents.to(next(iter(vae.post_quant_conv.parameters())).dtype)
+    
+    latents_mean = getattr(vae.config, 'latents_mean', None)
+    latents_std = getattr(vae.config, 'latents_std', None)
+    with torch.no_grad():
+        if latents_mean is not None and latents_std is not None:
+            latents_mean = torch.tensor(latents_mean).view(1, -1, 1, 1).to(latents.device, latents.dtype)
+            latents_std = torch.tensor(latents_std).view(1, -1, 1, 1).to(latents.device, latents.dtype)
+            latents = latents * latents_std / vae.config.scaling_factor + latents_mean
+        else:
+            latents = latents / vae.config.scaling_factor
+        images = vae.decode(latents, return_dict=False)[0]
+    
+    if needs_upcasting:
+        vae.to(dtype=torch.float16)
+    
+    if getattr(pipe, 'watermark', None) is not None:
+        images = pipe.watermark.apply_watermark(images)
+    
+    return pipe.image_processor.postprocess(images, output_type='pil')
+
+def resize_to(image, size):
+    """Resize image to size unless it already has that size"""
+    if image.size == size:
+        return image
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+def preprocess_inputs(person_images, clothing_images, denoise_stats=None):
+    """Denoise and enhance a batch's person images, and enhance its garments, in vectorized passes
+    
+    One dict per person image with its denoise tier, noise estimate and time
+    is appended to ``denoise_stats`` if given.
+    """
+    persons = preprocess_person_batch(
+        np.stack([np.asarray(image.convert('RGB')) for image in person_images]), stats=denoise_stats
+    )
+    garments = preprocess_clothing_batch(np.stack([np.asarray(image.convert('RGB')) for image in clothing_images]))
+    return [Image.fromarray(image) for image in persons], [Image.fromarray(image) for image in garments]
+
+def process_virtual_tryon_batch(batch, num_inference_steps=None, record_metrics=True, return_exceptions=False):
+    """Process a batch of try-on requests
+    
+    Each request is a dict with ``person_image``, ``clothing_image``, ``prompt``,
+    optional ``model`` (a diffusion variant) and ``quality`` tier, an optional
+    ``cancel_token`` and optional ``on_progress(step, total_steps)`` and
+    ``on_preview(image, step, total_steps)`` callbacks. Requests of the same
+    model and tier run in one pipeline call. Returns one (result_image, info)
+    pair per request, in order; info includes the stage times of the pipeline
+    call the request ran in.
+    
+    A request with a ``profile`` mode has its pipeline call, and so the rest
+    of its batch, profiled; its info then has the trace's fields.
     
-    if pipe is None:
-        raise RuntimeError("Model not loaded")
+    With ``return_exceptions``, a group that fails (or whose requests were
+    all cancelled) yields the exception in place of each of its results, so
+    the other groups' requests are unaffected; otherwise it is raised.
+    """
+    results = [None] * len(batch)
+    groups = OrderedDict()
+    for index, item in enumerate(batch):
+        try:
+            key = (backends.get(item.get('model')).name, quality_tiers.get(item.get('quality')).name)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results[index] = e
+            continue
+        groups.setdefault(key, []).append(index)
+    
+    for (model, tier_name), indices in groups.items():
+        profile = next((batch[index]['profile'] for index in indices if batch[index].get('profile')), None)
+        try:
+            with profiler.profile(profile, label=f"{model}-{tier_name}") as trace:
+                # Loads the variant on first use, evicting the least recently used ones if needed
+                backend = backends.acquire(model)
+                outputs = run_pipeline_batch(
+                    backend, [batch[index] for index in indices], quality_tiers.get(tier_name),
+                    num_inference_steps=num_inference_steps, record_metrics=record_metrics
+                )
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            for index in indices:
+                results[index] = e
+            continue
+        
+        for index, (image, info) in zip(indices, outputs):
+            if batch[index].get('profile'):
+                info['profile'] = trace.fields()
+            results[index] = (image, info)
+    
+    return results
+
+def run_pipeline_batch(backend, batch, tier, num_inference_steps=None, record_metrics=True):
+    """Run requests of one quality tier through one call of ``backend``'s pipeline"""
+    import torch
+    
+    pipe = backend.pipe
+    prompt_cache = backend.prompt_cache
+    
+    num_inference_steps = num_inference_steps or tier.num_inference_steps
     
     try:
-        # Resize images
-        target_size = (512, 768)
-        person_image = person_image.resize(target_size, Image.Resampling.LANCZOS)
-        clothing_image = clothing_image.resize((512, 512), Image.Resampling.LANCZOS)
-        
-        # Create prompt
-        if not prompt:
-            prompt = "photorealistic, high quality, detailed clothing, perfect fit, natural lighting, professional photography"
-        
-        negative_prompt = "blurry, low quality, distorted, deformed, ugly, bad anatomy, extra limbs, missing limbs, floating limbs, disconnected limbs, malformed hands, poorly drawn hands, mutated hands, extra fingers, fewer fingers, bad proportions, mutation, deformed, ugly, disgusting, amputation"
-        
-        # Generate result
-        with torch.autocast(device):
-            result = pipe(
-                prompt=prompt,
-                image=person_image,
-                control_image=clothing_image,
-                num_inference_steps=20,
-                guidance_scale=7.5,
-                strength=0.8,
-                generator=torch.Generator(device=device).manual_seed(42)
-            )
-        
-        return result.images[0]
+        stages = StageTimer()
+        
+        # Resize images (a no-op when they were decoded at the target size)
+        with stages.stage('resize'):
+            person_images = [resize_to(item['person_image'], PERSON_SIZE) for item in batch]
+            clothing_images = [resize_to(item['clothing_image'], CLOTHING_SIZE) for item in batch]
+        
+        denoise_stats = []
+        if PREPROCESS_INPUTS:
+            with stages.stage('preprocess'):
+                person_images, clothing_images = preprocess_inputs(person_images, clothing_images, denoise_stats)
+        
+        # Look up prompt embeddings, encoding only prompts we have not seen
+        prompt_embeds = []
+        pooled_prompt_embeds = []
+        prompt_cache_hits = []
+        
+        with stages.stage('text_encode'):
+            for item in batch:
+                (embeds, pooled), cache_hit = prompt_cache.get(item.get('prompt') or DEFAULT_PROMPT)
+                prompt_embeds.append(embeds)
+                pooled_prompt_embeds.append(pooled)
+                prompt_cache_hits.append(cache_hit)
+                if record_metrics:
+                    CACHE_LOOKUPS.inc(cache='prompt', result='hit' if cache_hit else 'miss')
+            
+            (negative_embeds, negative_pooled), _ = prompt_cache.get(NEGATIVE_PROMPT)
+            synchronize()
+        
+        # One generator per request so each result matches its unbatched output
+        generators = [
+            torch.Generator(device=device).manual_seed(GENERATION_SEED)
+            for _ in batch
+        ]
+        
+        # Report denoising progress to every request in the batch, and previews to those that asked
+        progress_callbacks = [item['on_progress'] for item in batch if item.get('on_progress')]
+        preview_callbacks = [(index, item['on_preview']) for index, item in enumerate(batch) if item.get('on_preview')]
+        
+        # Stop between steps once every request in the batch has been cancelled or timed out;
+        # if only some have, the rest still need the shared pipeline call
+        cancel_tokens = [item.get('cancel_token') for item in batch]
+        can_cancel = all(token is not None for token in cancel_tokens)
+        
+        def on_step_end(pipeline, step_index, timestep, callback_kwargs):
+            if can_cancel and all(token.done for token in cancel_tokens):
+                cancel_tokens[0].check()
+            
+            total_steps = getattr(pipeline, 'num_timesteps', None) or num_inference_steps
+            for on_progress in progress_callbacks:
+                on_progress(step_index + 1, total_steps)
+            
+            if preview_callbacks and latent_previewer.due(step_index + 1, total_steps):
+                send_previews(callback_kwargs['latents'], step_index + 1, total_steps)
+            return callback_kwargs
         
+        def send_previews(latents, step, total_steps):
+            with stages.stage('preview'):
+                try:
+                    previews = latent_previewer.preview(latents[[index for index, _ in preview_callbacks]])
+                except Exception as e:
+                    # Previews are best-effort; never fail the batch over one
+                    logger.warning(f"Latent preview failed, disabling previews for this batch: {str(e)}")
+                    preview_callbacks.clear()
+                    return
+            for (_, on_preview), image in zip(preview_callbacks, previews):
+                on_preview(image, step, total_steps)
+        
+        # Batches run one at a time, so the tier's scheduler can be swapped in place
+        backend.scheduler_switcher.use(tier.scheduler)
+        
+        # Run the denoising loop, stopping at latents so VAE decode is timed separately;
+        # a guidance scale of 1 skips the unconditional UNet pass on tiers without CFG.
+        # Both are measured together for the call's peak memory
+        with memory_manager.track() as memory:
+            with stages.stage('denoise'), inference_autocast(device, cpu_options):
+                result = pipe(
+                    prompt_embeds=torch.cat(prompt_embeds),
+                    pooled_prompt_embeds=torch.cat(pooled_prompt_embeds),
+                    negative_prompt_embeds=negative_embeds.repeat(len(batch), 1, 1),
+                    negative_pooled_prompt_embeds=negative_pooled.repeat(len(batch), 1),
+                    image=person_images,
+                    control_image=clothing_images,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=tier.effective_guidance_scale,
+                    strength=tier.strength,
+                    generator=generators,
+                    callback_on_step_end=on_step_end if progress_callbacks or preview_callbacks or can_cancel else None,
+                    output_type='latent'
+                )
+                synchronize()
+            
+            with stages.stage('vae_decode'):
+                images = decode_latents(pipe, result.images)
+        
+        # Refine the per-image memory figure, and so the batch limit, from this call
+        apply_batch_limit(memory_manager.observe(memory, len(batch)))
+        
+        if record_metrics:
+            # Feeds the queue time estimate used for admission control
+            admission.observe(num_inference_steps * (2 if tier.cfg else 1), stages.stages['denoise'])
+            BATCH_SIZE.observe(len(batch))
+            PEAK_MEMORY.observe(memory.peak)
+            for stats in denoise_stats:
+                DENOISED_IMAGES.inc(tier=stats['denoise_tier'])
+                DENOISE_SECONDS.observe(stats['denoise_time'], tier=stats['denoise_tier'])
+                NOISE_SIGMA.observe(stats['noise_sigma'])
+            for stage, seconds in stages.stages.items():
+                STAGE_SECONDS.observe(seconds, stage=stage)
+        
+        return [
+            (image, {
+                'prompt_cache_hit': cache_hit,
+                'model': backend.name,
+                'quality': tier.name,
+                'stage_times': stages.stages,
+                'peak_memory': memory.peak,
+                'working_memory': memory.working
+            })
+            for image, cache_hit in zip(images, prompt_cache_hits)
+        ]
+        
+    except Cancelled:
+        raise
     except Exception as e:
         raise RuntimeError(f"Virtual try-on processing failed: {str(e)}")
 
+def process_virtual_tryon(person_image, clothing_image, prompt="", quality=None, model=None):
+    """Process virtual try-on using Kolors model"""
+    result_image, _ = process_virtual_tryon_batch([{
+        'person_image': person_image,
+        'clothing_image': clothing_image,
+        'prompt': prompt,
+        'quality': quality,
+        'model': model
+    }])[0]
+    return result_image
+
+def render_with_pipeline(backend, items):
+    """Backend interface of the diffusion variants: results of ``items`` without details"""
+    return [image for image, _ in process_virtual_tryon_batch([{**item, 'model': backend.name} for item in items])]
+
+# Backends requests pick with a ``model`` field: the diffusion variants, plus the
+# blend and overlay backends of the RunPod handlers
+backends = BackendRegistry(default=DEFAULT_MODEL, max_bytes=MODEL_CACHE_MB * MB)
+for name, variant in MODEL_VARIANTS.items():
+    backends.register(DiffusionBackend(
+        name, variant['model_id'], load_pipeline, render_with_pipeline,
+        components_from=variant.get('components_from'), person_size=PERSON_SIZE, clothing_size=CLOTHING_SIZE
+    ))
+backends.register(BlendBackend())
+backends.register(OverlayBackend(
+    catalog=garment_catalog, alpha_mode=os.environ.get('OVERLAY_ALPHA_MODE', 'constant')
+))
+
+def check_cancelled(item):
+    """Drop requests cancelled or past their deadline before their batch runs"""
+    if item.get('cancel_token') is not None:
+        item['cancel_token'].check()
+
+batch_scheduler = BatchScheduler(
+    functools.partial(process_virtual_tryon_batch, return_exceptions=True),
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait=BATCH_WINDOW_MS / 1000.0,
+    check_item=check_cancelled
+)
+
+def memory_mb(value):
+    """Bytes as MB for API responses"""
+    return None if value is None else round(value / MB, 1)
+
+def run_tryon(person_image, clothing_image, prompt="", on_progress=None, stages=None, clothing_key=None,
+              quality=None, on_preview=None, cancel_token=None, ticket=None, model=None, profile=None,
+              profile_requested=False):
+    """Run a try-on through the result cache and batch scheduler
+
+    Returns the result image and a dict of batching/caching details. Stage
+    times are added to ``stages`` if given. ``clothing_key`` is a content
+    digest (e.g. of a catalog garment) used for the cache key instead of
+    hashing the clothing pixels. ``quality`` names a tier; the default tier
+    is used if it is empty. ``on_preview(image, step, total_steps)`` receives
+    intermediate previews; results served from the cache have none.
+    ``model`` names a backend; blend and overlay run on the calling thread
+    and ignore the prompt and tier. With a ``profile`` mode the work is
+    profiled and the details carry the trace's path; a profile the request
+    asked for (``profile_requested``) skips the cache lookup, while a
+    sampled one is only taken if the result is not cached.
+    
+    ``cancel_token`` carries the request's deadline and cancellation. Work
+    is admitted before it is queued, which raises Overloaded when it could
+    not finish in time, unless the caller passes the ``ticket`` it was
+    already admitted with.
+    """
+    stages = stages if stages is not None else StageTimer()
+    backend = backends.get(model)
+    tier = quality_tiers.get(quality)
+    cancel_token = cancel_token or CancelToken()
+    
+    # Reuse a previous result for identical inputs
+    cache_key = None
+    result_image = None
+    batch_info = {'batch_size': 0, 'queue_wait': 0.0}
+    run_info = {'prompt_cache_hit': None, 'stage_times': {}, 'peak_memory': None, 'working_memory': None}
+    profile_fields = {}
+    
+    if result_cache.enabled and not profile_requested:
+        with stages.stage('cache_lookup'):
+            if backend.batched:
+                cache_key = ResultCache.make_key(
+                    person_image, clothing_key or clothing_image, prompt or DEFAULT_PROMPT,
+                    model=backend.model_id, negative_prompt=NEGATIVE_PROMPT, seed=GENERATION_SEED,
+                    preprocess=PREPROCESS_INPUTS, **tier.params()
+                )
+            else:
+                cache_key = ResultCache.make_key(person_image, clothing_key or clothing_image, **backend.params())
+            result_image = result_cache.get(cache_key)
+        CACHE_LOOKUPS.inc(cache='result', result='miss' if result_image is None else 'hit')
+    
+    cache_hit = result_image is not None
+    
+    if not cache_hit and not backend.batched:
+        # Cheap enough to run on the request thread, outside batching and admission
+        cancel_token.check()
+        with stages.stage(backend.name), profiler.profile(profile, label=backend.name) as trace:
+            result_image = backend.render(person_image, clothing_image)
+        profile_fields = trace.fields()
+        
+        if cache_key is not None:
+            with stages.stage('cache_store'):
+                result_cache.put(cache_key, result_image)
+    
+    elif not cache_hit:
+        cancel_token.check()
+        own_ticket = ticket is None
+        if own_ticket:
+            ticket = admission.admit(tier.unet_evaluations, cancel_token)
+        
+        try:
+            # Process virtual try-on, batched with any concurrent requests
+            future = batch_scheduler.submit({
+                'person_image': person_image,
+                'clothing_image': clothing_image,
+                'prompt': prompt,
+                'model': backend.name,
+                'quality': tier.name,
+                'profile': profile,
+                'on_progress': on_progress,
+                'on_preview': on_preview,
+                'cancel_token': cancel_token
+            })
+            try:
+                (result_image, run_info), batch_info = future.result(timeout=cancel_token.remaining())
+            except FutureTimeoutError:
+                # Skipped if still queued, or stopped between steps if its batch is all expired
+                future.cancel()
+                raise DeadlineExceeded("Request deadline exceeded")
+        finally:
+            if own_ticket:
+                ticket.release()
+        
+        stages.record('queue_wait', batch_info['queue_wait'])
+        stages.update(run_info['stage_times'])
+        profile_fields = run_info.get('profile', {})
+        
+        if cache_key is not None:
+            with stages.stage('cache_store'):
+                result_cache.put(cache_key, result_image)
+        
+        # A batch runs to the end for the other requests in it, even after this one was cancelled
+        if cancel_token.cancelled:
+            raise Cancelled("Request was cancelled")
+    
+    return result_image, {
+        'batch_size': batch_info['batch_size'],
+        'queue_wait': round(batch_info['queue_wait'], 3),
+        'cache_hit': cache_hit,
+        'prompt_cache_hit': run_info['prompt_cache_hit'],
+        'model': backend.name,
+        'quality': tier.name if backend.batched else None,
+        # Of the pipeline call the request ran in; None when served from the cache
+        'peak_memory_mb': memory_mb(run_info['peak_memory']),
+        'working_memory_mb': memory_mb(run_info['working_memory']),
+        **profile_fields
+    }
+
+def run_job(job, progress):
+    """Run an asynchronous try-on job on a job worker thread"""
+    payload = job.payload
+    stages = payload['stages']
+    
+    def on_preview(image, step, total_steps):
+        # Encode off the denoising thread; the job keeps only the latest preview
+        def publish(future):
+            if future.exception() is None:
+                job_manager.set_preview(job, future.result(), step)
+        encoder_pool.submit(image, PREVIEW_OUTPUT_OPTIONS).add_done_callback(publish)
+    
+    try:
+        result_image, details = run_tryon(
+            payload['person_image'], payload['clothing_image'], payload['prompt'],
+            on_progress=progress, stages=stages, clothing_key=payload['clothing_key'],
+            quality=payload['quality'], on_preview=on_preview if payload['preview'] else None,
+            cancel_token=payload['cancel_token'], ticket=payload['ticket'], model=payload['model'],
+            profile=payload['profile'], profile_requested=payload['profile_requested']
+        )
+        with stages.stage('encode'):
+            encoded = encode_image_to_bytes(result_image, payload['output_options'])
+        if payload['cancel_token'].cancelled:
+            raise Cancelled("Job was cancelled")
+    except Exception as e:
+        status = job_status(e)
+        record_request('jobs', 'error' if status == 'failed' else status, time.time() - job.created_at, stages)
+        raise
+    finally:
+        if payload['ticket'] is not None:
+            payload['ticket'].release()
+    
+    record_request('jobs', 'success', time.time() - job.created_at, stages)
+    return encoded, {**details, **encoding_details(encoded), 'stage_times': stages.rounded()}
+
+def job_status(error):
+    """Terminal status of a job that raised ``error``, matching its request metric"""
+    if isinstance(error, DeadlineExceeded):
+        return 'timeout'
+    if isinstance(error, Cancelled):
+        return 'cancelled'
+    return 'failed'
+
+def discard_job(job, payload):
+    """Release the admitted work of a job cancelled before it ran"""
+    if payload['ticket'] is not None:
+        payload['ticket'].release()
+    record_request('jobs', 'cancelled', time.time() - job.created_at, payload['stages'])
+
+job_manager = JobManager(
+    run_job, workers=JOB_WORKERS, max_history=JOB_HISTORY, discard_job=discard_job, error_status=job_status
+)
+
+QUEUE_DEPTH.set_function(batch_scheduler.queue_depth, queue='batch')
+QUEUE_DEPTH.set_function(job_manager.queue_depth, queue='jobs')
+ESTIMATED_WAIT.set_function(admission.estimate_wait)
+
+def request_cancel_token(fields):
+    """Cancel token with the request's deadline: a ``timeout`` field, an X-Request-Timeout header or REQUEST_TIMEOUT"""
+    timeout = (fields.get('timeout') if fields else None) or request.headers.get('X-Request-Timeout') or REQUEST_TIMEOUT
+    try:
+        timeout = float(timeout)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid timeout: {timeout}")
+    if timeout < 0:
+        raise ValueError("Timeout must not be negative")
+    return CancelToken(timeout)
+
+def rejected_response(endpoint, error, processing_time, stages=None):
+    """503 with Retry-After for shed requests, 504 for requests that ran out of time"""
+    if isinstance(error, Overloaded):
+        status, status_code = 'rejected', 503
+    elif isinstance(error, DeadlineExceeded):
+        status, status_code = 'timeout', 504
+    else:
+        status, status_code = 'cancelled', 409
+    
+    record_request(endpoint, status, processing_time, stages)
+    response = jsonify({
+        'error': str(error),
+        'processing_time': round(processing_time, 2),
+        'status': status
+    })
+    response.status_code = status_code
+    if isinstance(error, Overloaded):
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @app.route('/')
 def index():
     """Serve the main web interface"""
     return render_template('index.html')
 
 @app.route('/api/try-on', methods=['POST'])
+@require_ready
 def api_try_on():
     """API endpoint for virtual try-on"""
     start_time = time.time()
+    stages = StageTimer()
     
     try:
         data = request.get_json()
         
-        if not data or 'person_image' not in data or 'clothing_image' not in data:
+        if not data or 'person_image' not in data or not ('clothing_image' in data or data.get('garment_id')):
             return jsonify({
-                'error': 'Missing required fields: person_image and clothing_image'
+                'error': 'Missing required fields: person_image and clothing_image or garment_id'
             }), 400
         
-        # Decode images
-        person_image = decode_base64_image(data['person_image'])
-        clothing_image = decode_base64_image(data['clothing_image'])
+        # Decode images directly at the model's input size
+        with stages.stage('decode'):
+            person_image = decode_base64_image(data['person_image'], PERSON_SIZE)
+            clothing_image, clothing_key = load_clothing_image(data)
         
-        # Get optional prompt
+        # Get optional prompt, model, quality tier and output encoding
         prompt = data.get('prompt', '')
+        model = backends.get(data.get('model')).name
+        quality = quality_tiers.get(data.get('quality')).name
+        output_options = encoder_pool.resolve(request_output_overrides(data))
+        delivery = result_delivery(data, RESULT_DELIVERY)
+        cancel_token = request_cancel_token(data)
+        profile, profile_requested = profiler.resolve(requested_profile(data, request.headers))
         
         # Process virtual try-on
-        result_image = process_virtual_tryon(person_image, clothing_image, prompt)
+        result_image, details = run_tryon(
+            person_image, clothing_image, prompt, stages=stages, clothing_key=clothing_key,
+            quality=quality, cancel_token=cancel_token, model=model, profile=profile,
+            profile_requested=profile_requested
+        )
         
-        # Encode result
-        result_base64 = encode_image_to_base64(result_image)
+        # Encode result and store it, unless it is returned inline
+        with stages.stage('encode'):
+            encoded = encode_image_to_bytes(result_image, output_options)
+        with stages.stage('store'):
+            result_fields = deliver_result(encoded, delivery)
         
         processing_time = time.time() - start_time
+        record_request('try-on', 'success', processing_time, stages)
         
         return jsonify({
-            'result_image': result_base64,
+            **result_fields,
             'processing_time': round(processing_time, 2),
+            **details,
+            **encoding_details(encoded),
+            'stage_times': stages.rounded(),
             'status': 'success'
         })
         
+    except (Overloaded, Cancelled) as e:
+        return rejected_response('try-on', e, time.time() - start_time, stages)
+    
     except Exception as e:
         processing_time = time.time() - start_time
+        record_request('try-on', 'error', processing_time, stages)
         logger.error(f"Error in try-on API: {str(e)}")
         
         return jsonify({
@@ -148,27 +1006,341 @@ def api_try_on():
             'status': 'error'
         }), 500
 
+@app.route('/api/try-on/raw', methods=['POST'])
+@require_ready
+def api_try_on_raw():
+    """Binary API endpoint for virtual try-on
+
+    Accepts multipart/form-data with ``person_image`` and ``clothing_image``
+    files (or a catalog ``garment_id`` field in place of the clothing file)
+    and optional ``prompt`` and ``output_*`` fields, and returns the
+    result as raw image bytes. Details are reported in X-* response headers
+    and stage times in a Server-Timing header.
+    """
+    start_time = time.time()
+    stages = StageTimer()
+    
+    try:
+        if 'person_image' not in request.files or not (
+            'clothing_image' in request.files or request.form.get('garment_id')
+        ):
+            return jsonify({
+                'error': 'Missing required files: person_image and clothing_image (or a garment_id field)'
+            }), 400
+        
+        # Decode images straight from the upload streams
+        with stages.stage('decode'):
+            person_image = decode_image_file(request.files['person_image'].stream, PERSON_SIZE)
+            clothing_image, clothing_key = load_clothing_image(request.form, request.files)
+        
+        # Get optional prompt, model, quality tier and output encoding
+        prompt = request.form.get('prompt', '')
+        model = backends.get(request.form.get('model')).name
+        quality = quality_tiers.get(request.form.get('quality')).name
+        output_options = encoder_pool.resolve(request_output_overrides(request.form))
+        cancel_token = request_cancel_token(request.form)
+        profile, profile_requested = profiler.resolve(requested_profile(request.form, request.headers))
+        
+        # Process virtual try-on
+        result_image, details = run_tryon(
+            person_image, clothing_image, prompt, stages=stages, clothing_key=clothing_key,
+            quality=quality, cancel_token=cancel_token, model=model, profile=profile,
+            profile_requested=profile_requested
+        )
+        
+        # Encode result
+        with stages.stage('encode'):
+            encoded = encode_image_to_bytes(result_image, output_options)
+        
+        processing_time = time.time() - start_time
+        record_request('try-on-raw', 'success', processing_time, stages)
+        
+        response = app.response_class(encoded['data'], mimetype=encoded['mime_type'])
+        response.headers['X-Processing-Time'] = str(round(processing_time, 2))
+        response.headers['Server-Timing'] = server_timing(stages)
+        for name, value in {**details, **encoding_details(encoded)}.items():
+            header = 'X-' + '-'.join(part.capitalize() for part in name.split('_'))
+            response.headers[header] = str(value)
+        return response
+        
+    except (Overloaded, Cancelled) as e:
+        return rejected_response('try-on-raw', e, time.time() - start_time, stages)
+    
+    except Exception as e:
+        processing_time = time.time() - start_time
+        record_request('try-on-raw', 'error', processing_time, stages)
+        logger.error(f"Error in raw try-on API: {str(e)}")
+        
+        return jsonify({
+            'error': str(e),
+            'processing_time': round(processing_time, 2),
+            'status': 'error'
+        }), 500
+
+@app.route('/api/jobs', methods=['POST'])
+@require_ready
+def api_submit_job():
+    """Submit an asynchronous try-on job
+
+    Takes the same JSON body as /api/try-on and returns a job id straight
+    away; progress is available from the status and events endpoints. With
+    ``preview`` set, low-resolution previews of the intermediate latents are
+    published every few denoising steps. Jobs are admitted, or rejected with
+    503 and Retry-After, at submission; a ``timeout`` counts from then.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or 'person_image' not in data or not ('clothing_image' in data or data.get('garment_id')):
+            return jsonify({
+                'error': 'Missing required fields: person_image and clothing_image or garment_id'
+            }), 400
+        
+        backend = backends.get(data.get('model'))
+        tier = quality_tiers.get(data.get('quality'))
+        cancel_token = request_cancel_token(data)
+        output_options = encoder_pool.resolve(request_output_overrides(data))
+        profile, profile_requested = profiler.resolve(requested_profile(data, request.headers))
+        
+        stages = StageTimer()
+        with stages.stage('decode'):
+            person_image = decode_base64_image(data['person_image'], PERSON_SIZE)
+            clothing_image, clothing_key = load_clothing_image(data)
+        
+        # Shed the job now rather than after it has waited in the queue
+        ticket = admission.admit(tier.unet_evaluations, cancel_token) if backend.batched else None
+        
+        job = job_manager.submit({
+            'person_image': person_image,
+            'clothing_image': clothing_image,
+            'clothing_key': clothing_key,
+            'prompt': data.get('prompt', ''),
+            'model': backend.name,
+            'quality': tier.name,
+            'profile': profile,
+            'profile_requested': profile_requested,
+            'preview': bool(data.get('preview')) and backend.batched,
+            'output_options': output_options,
+            'stages': stages,
+            'cancel_token': cancel_token,
+            'ticket': ticket
+        }, cancel_event=cancel_token.event)
+        
+        urls = {
+            'status_url': f"/api/jobs/{job.id}",
+            'events_url': f"/api/jobs/{job.id}/events",
+            'result_url': f"/api/jobs/{job.id}/result"
+        }
+        if job.payload['preview']:
+            urls['preview_url'] = f"/api/jobs/{job.id}/preview"
+            urls['previews_url'] = f"/api/jobs/{job.id}/previews"
+        
+        return jsonify({**job_manager.snapshot(job), **urls}), 202
+        
+    except Overloaded as e:
+        response = jsonify({'error': str(e), 'status': 'rejected'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error submitting job: {str(e)}")
+        
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 500
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """Current status, queue position and progress of a job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job', 'status': 'error'}), 404
+    
+    return jsonify(job_manager.snapshot(job))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """Cancel a job: queued jobs are dropped, running ones stop at the next denoising step"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job', 'status': 'error'}), 404
+    
+    # The job's outcome is recorded, and its admitted work released, by whoever finishes it
+    if not job_manager.cancel(job):
+        return jsonify({'error': 'Job has already finished', **job_manager.snapshot(job)}), 409
+    
+    return jsonify(job_manager.snapshot(job)), 202
+
+@app.route('/api/jobs/<job_id>/events')
+def api_job_events(job_id):
+    """Server-Sent Events stream of job status updates until the job finishes"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job', 'status': 'error'}), 404
+    
+    def generate():
+        version = -1
+        while True:
+            state = job_manager.wait_for_update(job, version, timeout=SSE_HEARTBEAT_SECONDS)
+            if state is None:
+                # Keep proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            
+            version = state['version']
+            yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+            if state['status'] in TERMINAL_STATUSES:
+                return
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs/<job_id>/previews')
+def api_job_previews(job_id):
+    """Server-Sent Events stream of intermediate previews as data URLs until the job finishes"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job', 'status': 'error'}), 404
+    
+    def generate():
+        version = -1
+        preview_step = 0
+        while True:
+            state = job_manager.wait_for_update(job, version, timeout=SSE_HEARTBEAT_SECONDS)
+            if state is None:
+                yield ": keep-alive\n\n"
+                continue
+            
+            version = state['version']
+            if state['status'] in TERMINAL_STATUSES:
+                yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+                return
+            
+            # Progress-only updates are skipped; only new previews are sent
+            preview, step = job_manager.preview(job)
+            if preview is not None and step > preview_step:
+                preview_step = step
+                data = {'step': step, 'total_steps': state['total_steps'], 'image': to_data_url(preview)}
+                yield f"event: preview\ndata: {json.dumps(data)}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs/<job_id>/preview')
+def api_job_preview(job_id):
+    """Latest intermediate preview of a running job as a JPEG"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job', 'status': 'error'}), 404
+    
+    preview, step = job_manager.preview(job)
+    if preview is None:
+        return jsonify({'error': 'No preview available', 'status': job.status}), 404
+    
+    response = app.response_class(preview['data'], mimetype=preview['mime_type'])
+    response.headers['X-Preview-Step'] = str(step)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/jobs/<job_id>/result')
+def api_job_result(job_id):
+    """Raw result image of a completed job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job', 'status': 'error'}), 404
+    
+    if job.status == 'failed':
+        return jsonify({'error': job.error, 'status': 'error'}), 500
+    
+    if job.status == 'cancelled':
+        return jsonify({'error': job.error or 'Job was cancelled', 'status': 'cancelled'}), 409
+    
+    if job.status != 'completed':
+        return jsonify({'error': 'Job has not finished', 'status': job.status}), 409
+    
+    # A job's result never changes, so clients can revalidate it or fetch ranges of it
+    response = app.response_class(job.result['data'], mimetype=job.result['mime_type'])
+    response.set_etag(hashlib.sha256(job.result['data']).hexdigest())
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request, accept_ranges=True)
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'model_loaded': pipe is not None,
-        'device': device
+        'model_loaded': backends.get().loaded,
+        'ready': model_state['status'] == 'ready',
+        'device': device,
+        **({'cpu_inference': cpu_options.describe()} if device == 'cpu' else {}),
+        'admission': admission.stats(),
+        'memory': memory_manager.report(),
+        'models': {**backends.describe(), 'memory_mb': memory_mb(backends.memory_bytes())},
+        'result_store': result_store.stats(),
+        'profiling': profiler.stats(),
+        **startup_report()
     })
 
+@app.route('/health/live')
+def liveness_check():
+    """Liveness probe: the server is up, and the model has not failed to load"""
+    if model_state['status'] == 'failed':
+        return jsonify({'status': 'failed', **startup_report()}), 503
+    
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready')
+def readiness_check():
+    """Readiness probe: the model is loaded and warmed up, so requests can be routed here"""
+    if model_state['status'] != 'ready':
+        return jsonify({'status': 'not_ready', **startup_report()}), 503
+    
+    return jsonify({'status': 'ready', **startup_report()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics: latency histograms, per-stage timings, queue depth, cache and error counters"""
+    return Response(metrics.render(), content_type=metrics.content_type)
+
+@app.route('/results/<name>')
+def stored_result(name):
+    """Serve a stored result with a strong ETag, Cache-Control and Range support
+    
+    Names are content hashes, so a result never changes and may be cached
+    as immutable until it expires from the store.
+    """
+    entry = result_store.lookup(name)
+    if entry is None:
+        return jsonify({'error': 'Unknown or expired result', 'status': 'error'}), 404
+    
+    response = send_file(
+        entry['path'], mimetype=entry['mime_type'], conditional=True,
+        etag=entry['etag'], max_age=entry['max_age']
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/static/<path:filename>')
 def static_files(filename):
     """Serve static files"""
     return send_from_directory('static', filename)
 
 if __name__ == '__main__':
-    # Load model on startup
+    # Bind the server straight away and load the model in the background;
+    # /health/ready reports when requests can be served
     logger.info("Starting Kolors Virtual Try-On Flask App...")
     
-    if load_model():
-        logger.info("Model loaded successfully. Starting Flask server...")
-        app.run(host='0.0.0.0', port=5000, debug=False)
-    else:
-        logger.error("Failed to load model. Exiting...")
-        exit(1)
+    start_model_loading()
+    batch_scheduler.start()
+    job_manager.start()
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -0,0 +1,5 @@
+"""Load-test and benchmark suite for the try-on handlers and Flask app
+
+    python -m benchmarks.run --target handler_ultra --requests 200 --concurrency 8 --output ultra.json
+    python -m benchmarks.compare baseline.json ultra.json
+"""
@@ -0,0 +1,62 @@
+"""Compare saved benchmark results against a baseline
+
+    python -m benchmarks.compare baseline.json candidate.json [more.json ...]
+"""
+import argparse
+import json
+
+# (label, path into the summary)
+METRICS = (
+    ('throughput req/s', ('throughput',)),
+    ('latency p50 s', ('latency', 'p50')),
+    ('latency p95 s', ('latency', 'p95')),
+    ('latency p99 s', ('latency', 'p99')),
+    ('queue wait p95 s', ('queue_wait', 'p95')),
+    ('failed', ('failed',)),
+    ('peak RSS MB', ('peak_rss_mb', 'self')),
+    ('peak RSS children MB', ('peak_rss_mb', 'children'))
+)
+
+
+def lookup(summary, path):
+    value = summary
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def rows(baseline, candidate):
+    """(label, baseline, candidate, relative change) for headline metrics and every stage's mean"""
+    metrics = list(METRICS)
+    stages = sorted(set(baseline.get('stages', {})) | set(candidate.get('stages', {})))
+    metrics += [(f"stage {stage} mean s", ('stages', stage, 'mean')) for stage in stages]
+
+    for label, path in metrics:
+        before, after = lookup(baseline, path), lookup(candidate, path)
+        change = (after - before) / before if before and after is not None else None
+        yield label, before, after, change
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidates', nargs='+')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    for path in args.candidates:
+        with open(path) as f:
+            candidate = json.load(f)
+
+        print(f"{args.baseline} ({baseline['benchmark']['target']}) -> {path} ({candidate['benchmark']['target']})")
+        for label, before, after, change in rows(baseline['summary'], candidate['summary']):
+            change_text = f"{change:+.1%}" if change is not None else ''
+            print(f"  {label:<28} {str(before):>12} {str(after):>12} {change_text:>9}")
+
+
+if __name__ == '__main__':
+    main()
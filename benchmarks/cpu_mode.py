@@ -0,0 +1,194 @@
+"""Validate and time the CPU performance mode on a tiny randomly-initialized SDXL pipeline
+
+Builds a few-megabyte pipeline with random weights, so nothing is
+downloaded, and runs it once per configuration. Each configuration's
+output is compared with the plain float32 baseline and timed.
+
+    python -m benchmarks.cpu_mode --steps 4 --runs 3 --threads 4
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cpu_inference import CpuInferenceOptions, configure_threads, inference_autocast, prepare_pipeline
+
+# Configurations measured against the float32 baseline (CPU_MODE=off)
+CONFIGS = {
+    'baseline': {'mode': 'off'},
+    'int8': {'mode': 'fast', 'quantize': 'int8', 'channels_last': False},
+    'channels_last': {'mode': 'fast', 'quantize': 'none', 'bf16': 'off'},
+    'int8+channels_last': {'mode': 'fast', 'quantize': 'int8'},
+    'bf16+channels_last': {'mode': 'fast', 'quantize': 'none', 'bf16': 'on'},
+    'compile': {'mode': 'fast', 'quantize': 'none', 'bf16': 'off', 'compile': True, 'compile_mode': 'default'}
+}
+
+# Text embedding width of the tiny pipeline: two 32-wide CLIP encoders, concatenated
+EMBED_DIM = 32
+
+
+def tiny_pipeline(seed=0):
+    """SDXL pipeline with the same component layout as the app's, at toy size"""
+    import torch
+    from diffusers import AutoencoderKL, EulerDiscreteScheduler, StableDiffusionXLPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection
+
+    torch.manual_seed(seed)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=('DownBlock2D', 'CrossAttnDownBlock2D'),
+        up_block_types=('CrossAttnUpBlock2D', 'UpBlock2D'),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type='text_time',
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=6 * 8 + EMBED_DIM,
+        cross_attention_dim=2 * EMBED_DIM
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=['DownEncoderBlock2D', 'DownEncoderBlock2D'],
+        up_block_types=['UpDecoderBlock2D', 'UpDecoderBlock2D'],
+        latent_channels=4,
+        sample_size=128
+    )
+    text_config = CLIPTextConfig(
+        bos_token_id=0, eos_token_id=2, hidden_size=EMBED_DIM, intermediate_size=37,
+        layer_norm_eps=1e-05, num_attention_heads=4, num_hidden_layers=5, pad_token_id=1,
+        vocab_size=1000, hidden_act='gelu', projection_dim=EMBED_DIM
+    )
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085, beta_end=0.012, beta_schedule='scaled_linear',
+        steps_offset=1, timestep_spacing='leading'
+    )
+
+    # Prompts are passed as embeddings, so the pipeline needs no tokenizers
+    return StableDiffusionXLPipeline(
+        vae=vae,
+        text_encoder=CLIPTextModel(text_config),
+        text_encoder_2=CLIPTextModelWithProjection(text_config),
+        tokenizer=None,
+        tokenizer_2=None,
+        unet=unet,
+        scheduler=scheduler
+    )
+
+
+def make_inputs(seed=0):
+    import torch
+
+    generator = torch.Generator().manual_seed(seed)
+    return {
+        'prompt_embeds': torch.randn(1, 77, 2 * EMBED_DIM, generator=generator),
+        'pooled_prompt_embeds': torch.randn(1, EMBED_DIM, generator=generator),
+        'negative_prompt_embeds': torch.randn(1, 77, 2 * EMBED_DIM, generator=generator),
+        'negative_pooled_prompt_embeds': torch.randn(1, EMBED_DIM, generator=generator)
+    }
+
+
+def run_pipeline(pipe, inputs, options, steps, size):
+    import torch
+
+    with torch.no_grad(), inference_autocast('cpu', options):
+        images = pipe(
+            **inputs,
+            num_inference_steps=steps,
+            guidance_scale=7.5,
+            height=size,
+            width=size,
+            generator=torch.Generator().manual_seed(42),
+            output_type='np'
+        ).images
+    return images.astype('float32')
+
+
+def measure(name, settings, base_pipe, inputs, args):
+    options = CpuInferenceOptions(threads=args.threads, interop_threads=args.interop_threads, **settings)
+    pipe = copy.deepcopy(base_pipe)
+
+    start_time = time.perf_counter()
+    applied = prepare_pipeline(pipe, options)
+    prepare_time = time.perf_counter() - start_time
+
+    # The first call includes compilation and allocator warmup
+    start_time = time.perf_counter()
+    output = run_pipeline(pipe, inputs, options, args.steps, args.size)
+    first_run = time.perf_counter() - start_time
+
+    timings = []
+    for _ in range(args.runs):
+        start_time = time.perf_counter()
+        output = run_pipeline(pipe, inputs, options, args.steps, args.size)
+        timings.append(time.perf_counter() - start_time)
+
+    return {
+        'config': name,
+        'applied': applied,
+        'prepare_seconds': round(prepare_time, 3),
+        'first_run_seconds': round(first_run, 3),
+        'mean_seconds': round(sum(timings) / len(timings), 4),
+        'output': output
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--configs', nargs='+', choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=3, help='timed runs per configuration, after one warmup run')
+    parser.add_argument('--size', type=int, default=64, help='output width and height in pixels')
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--interop-threads', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='largest accepted mean absolute difference from the baseline, in [0, 1] pixel units')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    import numpy as np
+
+    threads, interop_threads = configure_threads(
+        CpuInferenceOptions(threads=args.threads, interop_threads=args.interop_threads)
+    )
+    print(f"{threads} intra-op / {interop_threads} inter-op threads")
+
+    base_pipe = tiny_pipeline()
+    inputs = make_inputs()
+    baseline = measure('baseline', CONFIGS['baseline'], base_pipe, inputs, args)
+    baseline_output = baseline.pop('output')
+
+    results = []
+    failures = []
+    print(f"{'config':>20} {'seconds':>9} {'speedup':>8} {'mean diff':>10}")
+    for name in args.configs:
+        result = baseline if name == 'baseline' else measure(name, CONFIGS[name], base_pipe, inputs, args)
+        output = baseline_output if result is baseline else result.pop('output')
+        result['mean_abs_diff'] = round(float(np.abs(output - baseline_output).mean()), 5)
+        result['speedup'] = round(baseline['mean_seconds'] / result['mean_seconds'], 2)
+        results.append(result)
+
+        if not np.isfinite(output).all() or result['mean_abs_diff'] > args.tolerance:
+            failures.append(name)
+        print(f"{name:>20} {result['mean_seconds']:>9.4f} {result['speedup']:>7.2f}x {result['mean_abs_diff']:>10.5f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'threads': threads, 'interop_threads': interop_threads, 'results': results}, f, indent=2)
+
+    if failures:
+        print(f"Output outside tolerance for: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+# Person resolutions exercised by default, from model input size up to phone-camera uploads
+DEFAULT_SIZES = ((512, 768), (1024, 1536), (2048, 3072))
+
+
+def parse_size(text):
+    """Parse 'WIDTHxHEIGHT' into a (width, height) tuple"""
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height)
+
+
+def format_size(size):
+    return f"{size[0]}x{size[1]}"
+
+
+def synthetic_person(size, seed):
+    """Photo-like RGB array: smooth colour regions with a little sensor noise"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    coarse = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    image = np.asarray(Image.fromarray(coarse).resize(size, Image.Resampling.BICUBIC), dtype=np.int16)
+    image += rng.integers(-4, 5, image.shape, dtype=np.int16)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def synthetic_garment(size, seed):
+    """Garment-like RGB array: a textured shape on a white background"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    top, bottom = height // 6, height - height // 8
+    left, right = width // 5, width - width // 5
+    colour = rng.integers(20, 220, 3)
+    texture = rng.integers(-12, 13, (bottom - top, right - left, 1))
+    image[top:bottom, left:right] = np.clip(colour + texture, 0, 255)
+    return image
+
+
+def to_data_url(array, image_format='JPEG', quality=90):
+    """Encode an RGB array as a base64 data URL, as a client would upload it"""
+    buffer = io.BytesIO()
+    kwargs = {'quality': quality} if image_format in ('JPEG', 'WEBP') else {}
+    Image.fromarray(array).save(buffer, format=image_format, **kwargs)
+    mime = Image.MIME[image_format]
+    return f"data:{mime};base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def synthetic_input(person_size, seed, clothing_size=None, image_format='JPEG'):
+    """Try-on input fields (person_image, clothing_image) for a synthetic pair
+
+    The garment defaults to a square as wide as the person image.
+    """
+    clothing_size = clothing_size or (person_size[0], person_size[0])
+    return {
+        'person_image': to_data_url(synthetic_person(person_size, seed), image_format),
+        'clothing_image': to_data_url(synthetic_garment(clothing_size, seed), image_format)
+    }
@@ -0,0 +1,244 @@
+"""Drive a handler or the Flask app with a synthetic or recorded trace and save the results
+
+    python -m benchmarks.run --target handler_ultra --requests 200 --concurrency 8 --output ultra.json
+    python -m benchmarks.run --target app --trace recorded.jsonl --speed 2 --output app.json
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.payloads import DEFAULT_SIZES, format_size, parse_size
+from benchmarks.runpod_local import LocalJobQueue
+from benchmarks.stats import distribution, peak_rss_mb, stage_breakdown
+from benchmarks.traces import entry_label, load_trace, materialize, save_trace, synthetic_trace
+
+TARGETS = ('handler', 'handler_ultra', 'app')
+
+
+class RunPodTarget:
+    """A RunPod handler module behind the local job queue"""
+
+    def __init__(self, module_name, concurrency=None):
+        self.module = importlib.import_module(module_name)
+        self.queue = LocalJobQueue(
+            self.module.handler,
+            concurrency=concurrency,
+            concurrency_modifier=getattr(self.module, 'concurrency_modifier', None)
+        )
+        self.concurrency = self.queue.concurrency
+
+    async def start(self):
+        # Start handler_ultra's compositing processes before the clock starts
+        if getattr(self.module, 'configure_composite_pool', None) and self.module.composite_pool is None:
+            pool = self.module.configure_composite_pool()
+            await asyncio.wrap_future(pool.submit(int))
+        await self.queue.start()
+
+    async def execute(self, job_input):
+        """Run one request; returns (output, queue_wait, finished_at)"""
+        result = await self.queue.submit(job_input)
+        return result['output'], result['queue_wait'], result['finished_at']
+
+    async def stop(self):
+        await self.queue.stop()
+        # Reap pool processes so their peak RSS is counted
+        pool = getattr(self.module, 'composite_pool', None)
+        if pool is not None:
+            pool.shutdown()
+
+
+class FlaskTarget:
+    """The Flask app's /api/try-on endpoint through its test client, from ``concurrency`` client threads"""
+
+    def __init__(self, concurrency=None, endpoint='/api/try-on'):
+        import app
+
+        self.app = app
+        self.endpoint = endpoint
+        self.concurrency = concurrency or app.BATCH_MAX_SIZE
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='client')
+
+    async def start(self):
+        if self.app.model_state['status'] != 'ready':
+            await asyncio.get_running_loop().run_in_executor(None, self.app.initialize_model)
+            if self.app.model_state['status'] != 'ready':
+                raise RuntimeError(f"Model failed to load: {self.app.model_state['error']}")
+        self.app.batch_scheduler.start()
+
+    def _post(self, job_input):
+        response = self.app.app.test_client().post(self.endpoint, json=job_input)
+        output = response.get_json(silent=True) or {}
+        output.setdefault('status', 'success' if response.status_code == 200 else 'error')
+        return output, None, time.perf_counter()
+
+    async def execute(self, job_input):
+        """Run one request; returns (output, queue_wait, finished_at)"""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._post, job_input)
+
+    async def stop(self):
+        self._pool.shutdown()
+
+
+def make_target(name, concurrency=None):
+    if name == 'app':
+        return FlaskTarget(concurrency)
+    return RunPodTarget(name, concurrency)
+
+
+async def replay(target, entries, speed=1.0):
+    """Send each entry at its trace offset (scaled by ``speed``) and collect per-request records"""
+    inputs = [materialize(entry['input']) for entry in entries]
+    await target.start()
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+
+    async def send(entry, job_input):
+        delay = entry['offset'] / speed - (loop.time() - start_time)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        sent_at = time.perf_counter()
+        output, queue_wait, finished_at = await target.execute(job_input)
+        return {
+            'label': entry_label(entry['input']),
+            'latency': finished_at - sent_at,
+            'queue_wait': queue_wait,
+            'status': output.get('status'),
+            'error': output.get('error'),
+            'stage_times': output.get('stage_times') or {}
+        }
+
+    try:
+        records = await asyncio.gather(*(send(entry, job_input) for entry, job_input in zip(entries, inputs)))
+        duration = loop.time() - start_time
+    finally:
+        await target.stop()
+
+    return records, duration
+
+
+def summarise(records, duration):
+    succeeded = [record for record in records if record['status'] == 'success']
+    errors = {}
+    for record in records:
+        if record['status'] != 'success':
+            errors[record['error']] = errors.get(record['error'], 0) + 1
+
+    queue_waits = [record['queue_wait'] for record in succeeded if record['queue_wait'] is not None]
+    by_label = {}
+    for record in succeeded:
+        by_label.setdefault(record['label'], []).append(record['latency'])
+
+    return {
+        'requests': len(records),
+        'succeeded': len(succeeded),
+        'failed': len(records) - len(succeeded),
+        'errors': errors,
+        'duration': round(duration, 3),
+        'throughput': round(len(succeeded) / duration, 3) if duration > 0 else None,
+        'latency': distribution([record['latency'] for record in succeeded]),
+        'queue_wait': distribution(queue_waits),
+        'stages': stage_breakdown(record['stage_times'] for record in succeeded),
+        'by_size': {label: distribution(latencies) for label, latencies in sorted(by_label.items())},
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def print_summary(summary):
+    latency = summary['latency'] or {}
+    print(f"{summary['succeeded']}/{summary['requests']} succeeded in {summary['duration']:.2f}s, "
+          f"{summary['throughput']} req/s")
+    if latency:
+        print("latency ms: " + '  '.join(f"{key} {latency[key] * 1000:.1f}" for key in ('p50', 'p95', 'p99', 'max')))
+    for label, stats in summary['by_size'].items():
+        print(f"  {label:>10}: p50 {stats['p50'] * 1000:.1f} ms  p95 {stats['p95'] * 1000:.1f} ms")
+    for stage, stats in summary['stages'].items():
+        print(f"  stage {stage:<14} mean {stats['mean'] * 1000:8.1f} ms  p95 {stats['p95'] * 1000:8.1f} ms")
+    print(f"peak RSS MB: self {summary['peak_rss_mb']['self']}, children {summary['peak_rss_mb']['children']}")
+    for error, count in summary['errors'].items():
+        print(f"  {count} x error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=TARGETS, default='handler_ultra')
+    parser.add_argument('--concurrency', type=int,
+                        help="jobs in flight (default: the handler's concurrency_modifier, or BATCH_MAX_SIZE for app)")
+    parser.add_argument('--trace', help='replay this JSONL trace instead of generating one')
+    parser.add_argument('--record-trace', help='save the generated trace here for later replay')
+    parser.add_argument('--requests', type=int, default=100, help='synthetic requests to generate')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=list(DEFAULT_SIZES),
+                        metavar='WxH', help='person image resolutions to cycle through')
+    parser.add_argument('--rate', type=float, help='Poisson arrival rate in req/s (default: all at once)')
+    parser.add_argument('--distinct', type=int, help='distinct payloads per size, to exercise the result cache')
+    parser.add_argument('--garment-id', help='request this catalog garment instead of uploading one')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed-up factor for trace offsets')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--verbose', action='store_true', help="show the handlers' own logging")
+    args = parser.parse_args()
+
+    if args.trace:
+        entries = load_trace(args.trace)
+    else:
+        extra = {'garment_id': args.garment_id} if args.garment_id else None
+        entries = synthetic_trace(args.requests, args.sizes, args.rate, args.distinct, args.seed, extra)
+    if args.record_trace:
+        save_trace(args.record_trace, entries)
+
+    target = make_target(args.target, args.concurrency)
+    print(f"Replaying {len(entries)} requests against {args.target} with concurrency {target.concurrency}")
+
+    output = io.StringIO() if not args.verbose else sys.stdout
+    with contextlib.redirect_stdout(output):
+        records, duration = asyncio.run(replay(target, entries, args.speed))
+
+    summary = summarise(records, duration)
+    print_summary(summary)
+
+    if args.output:
+        result = {
+            'benchmark': {
+                'target': args.target,
+                'concurrency': target.concurrency,
+                'trace': args.trace or 'synthetic',
+                'sizes': [format_size(size) for size in args.sizes] if not args.trace else None,
+                'rate': args.rate,
+                'speed': args.speed
+            },
+            'environment': environment(),
+            'summary': summary
+        }
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
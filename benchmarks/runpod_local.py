@@ -0,0 +1,60 @@
+import asyncio
+import inspect
+import time
+import uuid
+
+
+class LocalJobQueue:
+    """In-process stand-in for the RunPod serverless job queue
+
+    Jobs wait in a FIFO queue and are taken by ``concurrency`` worker tasks,
+    the way the RunPod worker takes up to ``concurrency_modifier`` jobs at
+    once. Async handlers run concurrently on the event loop; synchronous
+    handlers block it while they run, as they do under RunPod.
+    """
+
+    def __init__(self, handler, concurrency=None, concurrency_modifier=None):
+        self.handler = handler
+        if concurrency is None:
+            concurrency = concurrency_modifier(1) if concurrency_modifier else 1
+        self.concurrency = max(1, int(concurrency))
+        self._queue = None
+        self._workers = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, job_input):
+        """Queue a job and wait for it; returns ``{'output', 'queue_wait', 'execution_time', 'finished_at'}``"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(({'id': uuid.uuid4().hex, 'input': job_input}, future, time.perf_counter()))
+        return await future
+
+    async def _work(self):
+        while True:
+            job, future, enqueued_at = await self._queue.get()
+            started_at = time.perf_counter()
+            try:
+                output = self.handler(job)
+                if inspect.isawaitable(output):
+                    output = await output
+            except Exception as e:
+                # RunPod reports uncaught handler exceptions as job errors
+                output = {'error': str(e), 'status': 'error'}
+
+            finished_at = time.perf_counter()
+            future.set_result({
+                'output': output,
+                'queue_wait': started_at - enqueued_at,
+                'execution_time': finished_at - started_at,
+                'finished_at': finished_at
+            })
+            # Let waiting submitters resume between back-to-back synchronous jobs
+            await asyncio.sleep(0)
@@ -0,0 +1,45 @@
+import math
+import resource
+import sys
+
+
+def percentile(values, q):
+    """Linearly interpolated percentile (0-100) of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def distribution(values, digits=4):
+    """Mean, p50, p95, p99 and max of a list of durations in seconds"""
+    if not values:
+        return None
+    return {
+        'mean': round(sum(values) / len(values), digits),
+        'p50': round(percentile(values, 50), digits),
+        'p95': round(percentile(values, 95), digits),
+        'p99': round(percentile(values, 99), digits),
+        'max': round(max(values), digits)
+    }
+
+
+def stage_breakdown(stage_times):
+    """Per-stage distributions from a list of ``stage_times`` dicts"""
+    stages = {}
+    for times in stage_times:
+        for stage, seconds in times.items():
+            stages.setdefault(stage, []).append(seconds)
+    return {stage: distribution(values) for stage, values in stages.items()}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its waited-for children, in MB"""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+    }
@@ -0,0 +1,118 @@
+"""Request traces: a JSONL file with one ``{"offset": seconds, "input": {...}}`` per request
+
+``input`` holds the same fields as a RunPod job input or an /api/try-on
+body. Synthetic requests store ``{"synthetic": {"size": [w, h], "seed": n}}``
+instead of image data and are regenerated identically on replay.
+"""
+import asyncio
+import functools
+import json
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.payloads import synthetic_input
+
+
+def synthetic_trace(count, sizes, rate=None, distinct=None, seed=0, extra=None):
+    """Build a trace of ``count`` synthetic requests cycling through ``sizes``
+
+    With ``rate`` (requests/second) arrivals follow a Poisson process;
+    otherwise every request arrives at once and concurrency alone limits
+    the load. ``distinct`` caps the number of different payloads per size,
+    so repeated inputs can exercise the result cache.
+    """
+    rng = np.random.default_rng(seed)
+    offset = 0.0
+    entries = []
+    for i in range(count):
+        if rate:
+            offset += float(rng.exponential(1.0 / rate))
+        size = sizes[i % len(sizes)]
+        payload_seed = (i // len(sizes)) % distinct if distinct else i
+        entries.append({
+            'offset': round(offset, 6),
+            'input': {'synthetic': {'size': list(size), 'seed': payload_seed}, **(extra or {})}
+        })
+    return entries
+
+
+def save_trace(path, entries):
+    with open(path, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@functools.lru_cache(maxsize=256)
+def _synthetic_images(size, seed):
+    return synthetic_input(size, seed)
+
+
+def materialize(job_input):
+    """Expand a trace entry's input into real request fields"""
+    if 'synthetic' not in job_input:
+        return job_input
+
+    spec = job_input['synthetic']
+    fields = {key: value for key, value in job_input.items() if key != 'synthetic'}
+    images = _synthetic_images(tuple(spec['size']), spec['seed'])
+    if fields.get('garment_id'):
+        return {'person_image': images['person_image'], **fields}
+    return {**images, **fields}
+
+
+def entry_label(job_input):
+    """Group key for per-resolution results"""
+    if 'synthetic' in job_input:
+        return 'x'.join(map(str, job_input['synthetic']['size']))
+    return 'recorded'
+
+
+class TraceRecorder:
+    """Append incoming requests to a trace file as they arrive
+
+    Wrap a RunPod handler with ``wrap_handler`` or attach to a Flask app
+    with ``attach_flask`` to capture real traffic for later replay.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+
+    def record(self, job_input):
+        entry = {'offset': round(time.monotonic() - self._start_time, 6), 'input': job_input}
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def wrap_handler(self, handler):
+        """Return a handler that records each job's input before running it"""
+        if asyncio.iscoroutinefunction(handler):
+            async def recording_handler(job):
+                self.record(job.get('input', {}))
+                return await handler(job)
+        else:
+            def recording_handler(job):
+                self.record(job.get('input', {}))
+                return handler(job)
+        return functools.wraps(handler)(recording_handler)
+
+    def attach_flask(self, flask_app, paths=('/api/try-on', '/api/jobs')):
+        """Record the JSON body of every POST to ``paths``"""
+        from flask import request
+
+        @flask_app.before_request
+        def record_request():
+            if request.method == 'POST' and request.path in paths and request.is_json:
+                self.record(request.get_json(silent=True) or {})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,105 @@
+"""Throughput of the handler_ultra RunPod handler as the compositing pool grows
+
+Runs batches of synthetic try-on jobs through the async handler with 1, 2,
+4, ... compositing processes and reports jobs per second for each size.
+
+    python benchmarks/ultra_scaling.py --jobs 64 --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import handler_ultra
+from benchmarks.payloads import synthetic_input
+from utils.result_cache import ResultCache
+
+
+def make_jobs(count, person_size, clothing_size, seed=0):
+    """Jobs with distinct synthetic inputs, so none is served from the result cache"""
+    return [
+        {'id': str(i), 'input': synthetic_input(person_size, seed + i, clothing_size)}
+        for i in range(count)
+    ]
+
+
+async def run_jobs(jobs, concurrency):
+    """Run jobs through the handler with at most ``concurrency`` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(job):
+        async with semaphore:
+            return await handler_ultra.handler(job)
+
+    return await asyncio.gather(*(run_one(job) for job in jobs))
+
+
+def measure(jobs, workers):
+    handler_ultra.configure_composite_pool(workers)
+    concurrency = workers * 2
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Start every pool process before timing
+        asyncio.run(run_jobs(jobs[:concurrency], concurrency))
+
+        start_time = time.perf_counter()
+        results = asyncio.run(run_jobs(jobs, concurrency))
+        elapsed = time.perf_counter() - start_time
+
+    errors = [result['error'] for result in results if result['status'] != 'success']
+    if errors:
+        raise RuntimeError(f"{len(errors)} jobs failed, first error: {errors[0]}")
+
+    return {
+        'workers': workers,
+        'concurrency': concurrency,
+        'jobs': len(jobs),
+        'seconds': round(elapsed, 3),
+        'jobs_per_second': round(len(jobs) / elapsed, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=32, help='jobs per measurement')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        help='pool sizes to measure (default: powers of two up to the core count)')
+    parser.add_argument('--person-size', type=int, nargs=2, default=(1024, 1536), metavar=('W', 'H'))
+    parser.add_argument('--clothing-size', type=int, nargs=2, default=(800, 800), metavar=('W', 'H'))
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    worker_counts = args.workers
+    if not worker_counts:
+        cpus = handler_ultra.available_cpus()
+        worker_counts = [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+        if worker_counts[-1] != cpus:
+            worker_counts.append(cpus)
+
+    # Measure compositing, not the result cache
+    handler_ultra.result_cache = ResultCache(max_bytes=0)
+    jobs = make_jobs(args.jobs, tuple(args.person_size), tuple(args.clothing_size))
+
+    results = []
+    print(f"{'workers':>8} {'jobs/s':>8} {'speedup':>8}")
+    for workers in worker_counts:
+        result = measure(jobs, workers)
+        result['speedup'] = round(result['jobs_per_second'] / (results or [result])[0]['jobs_per_second'], 2)
+        results.append(result)
+        print(f"{workers:>8} {result['jobs_per_second']:>8.2f} {result['speedup']:>7.2f}x")
+
+    handler_ultra.composite_pool.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'available_cpus': handler_ultra.available_cpus(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
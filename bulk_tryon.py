@@ -0,0 +1,292 @@
+"""Offline bulk try-on: render every pair in a manifest straight to disk
+
+Runs the same code paths as the servers, without HTTP or base64 in between:
+``blend`` (handler.simple_image_blend), ``overlay`` (handler_ultra's
+compositing) or ``kolors`` (the diffusion pipeline in app.py).
+
+    python bulk_tryon.py manifest.json results/ --backend overlay --workers 8 --format webp
+
+The manifest is either JSON with ``persons`` and ``garments`` (image paths)
+and/or ``garment_ids`` (catalog ids), rendered as their cross product, or
+JSONL with one pair per line: ``{"person": ..., "garment": ... | "garment_id":
+..., "prompt": ..., "tier": ..., "id": ...}``. Pairs are split across worker processes;
+each result is written atomically and then recorded in a checkpoint, so an
+interrupted run resumes where it left off when started again.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+
+from utils.encoding import FORMAT_ALIASES, OUTPUT_FORMATS, default_output_options, encode_image, resolve_output_options
+
+BACKENDS = ('blend', 'overlay', 'kolors')
+CHECKPOINT_DIR = '.checkpoint'
+REPORT_FILE = 'report.json'
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def load_manifest(path):
+    """Read a manifest into a list of pair dicts with a unique ``id`` each"""
+    if path.endswith('.jsonl'):
+        with open(path) as f:
+            pairs = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path) as f:
+            manifest = json.load(f)
+        garments = [{'garment': garment} for garment in manifest.get('garments', [])]
+        garments += [{'garment_id': garment_id} for garment_id in manifest.get('garment_ids', [])]
+        # Person-major order, so consecutive pairs in a shard reuse the decoded person
+        pairs = [
+            {'person': person, 'prompt': manifest.get('prompt', ''), **garment}
+            for person in manifest.get('persons', [])
+            for garment in garments
+        ]
+
+    for pair in pairs:
+        if 'person' not in pair or not ('garment' in pair or 'garment_id' in pair):
+            raise ValueError(f"Manifest pair needs person and garment or garment_id: {pair}")
+        if 'id' not in pair:
+            pair['id'] = f"{_stem(pair['person'])}__{pair.get('garment_id') or _stem(pair['garment'])}"
+
+    ids = [pair['id'] for pair in pairs]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Manifest pair ids are not unique; add explicit 'id' fields")
+
+    return pairs
+
+
+def load_checkpoints(output_dir):
+    """Ids of pairs already rendered by previous (possibly interrupted) runs"""
+    done = set()
+    for path in glob.glob(os.path.join(output_dir, CHECKPOINT_DIR, '*.done')):
+        with open(path) as f:
+            done.update(line.strip() for line in f if line.strip())
+    return done
+
+
+def split_shards(pairs, count):
+    """Split pairs into ``count`` contiguous shards of near-equal size"""
+    count = max(1, min(count, len(pairs)))
+    return [pairs[len(pairs) * i // count:len(pairs) * (i + 1) // count] for i in range(count)]
+
+
+def load_backend(name):
+    """Import a backend in this process; returns (person_size, clothing_size, render_batch, batch_limit)
+
+    ``render_batch`` takes a list of dicts with ``person_image``,
+    ``clothing_image`` and ``prompt`` and returns one result image per item.
+    For the overlay backend ``clothing_image`` may be a catalog garment id.
+    ``batch_limit()`` is the size of the next batch to render.
+    """
+    if name == 'blend':
+        import handler
+        size = handler.BLEND_PARAMS['size']
+
+        def render_batch(items):
+            return [handler.simple_image_blend(item['person_image'], item['clothing_image']) for item in items]
+
+        return size, size, render_batch, lambda: 1
+
+    if name == 'overlay':
+        import handler_ultra
+
+        def render_batch(items):
+            return [
+                handler_ultra.process_virtual_tryon(item['person_image'], item['clothing_image'])
+                for item in items
+            ]
+
+        return (
+            handler_ultra.OVERLAY_PARAMS['target_size'], handler_ultra.OVERLAY_PARAMS['clothing_size'],
+            render_batch, lambda: 1
+        )
+
+    if name == 'kolors':
+        import app
+        if not app.load_model():
+            raise RuntimeError("Failed to load model")
+
+        def render_batch(items):
+            return [image for image, _ in app.process_virtual_tryon_batch(items)]
+
+        def batch_limit():
+            # Planned from the memory budget at load time, then refined from each batch's measured peak
+            return app.batch_scheduler.max_batch_size
+
+        return app.PERSON_SIZE, app.CLOTHING_SIZE, render_batch, batch_limit
+
+    raise ValueError(f"Unknown backend: {name}")
+
+
+def run_shard(shard_index, pairs, options):
+    """Render one shard of pairs in a worker process; returns its statistics"""
+    from utils.garment_catalog import GarmentCatalog
+    from utils.image_io import decode_image
+
+    person_size, clothing_size, render_batch, batch_limit = load_backend(options['backend'])
+    catalog = GarmentCatalog.from_env()
+    output_options = options['output_options']
+    output_dir = options['output_dir']
+
+    # Persons repeat across consecutive pairs and garments across the shard
+    @lru_cache(maxsize=4)
+    def load_person(path):
+        return decode_image(path, target_size=person_size)
+
+    @lru_cache(maxsize=64)
+    def load_garment(path):
+        return decode_image(path, target_size=clothing_size)
+
+    def load_clothing(pair):
+        if 'garment_id' not in pair:
+            return load_garment(pair['garment'])
+        if catalog is None:
+            raise ValueError("garment_id given but no garment catalog is configured")
+        # The overlay backend reads catalog garments itself, without a copy
+        return pair['garment_id'] if options['backend'] == 'overlay' else catalog.image(pair['garment_id'])
+
+    checkpoint_path = os.path.join(
+        output_dir, CHECKPOINT_DIR, f"{options['run_id']}-{shard_index}.done"
+    )
+    stats = {'shard': shard_index, 'pairs': len(pairs), 'rendered': 0, 'failed': 0, 'bytes': 0}
+    start_time = time.perf_counter()
+
+    with open(checkpoint_path, 'a') as checkpoint:
+        batch_start = 0
+        while batch_start < len(pairs):
+            batch = pairs[batch_start:batch_start + batch_limit()]
+            batch_start += len(batch)
+            try:
+                items = [{
+                    'person_image': load_person(pair['person']),
+                    'clothing_image': load_clothing(pair),
+                    'prompt': pair.get('prompt', ''),
+                    'quality': pair.get('tier') or options['tier']
+                } for pair in batch]
+                results = render_batch(items)
+            except Exception as e:
+                print(f"[shard {shard_index}] Failed {', '.join(pair['id'] for pair in batch)}: {str(e)}")
+                stats['failed'] += len(batch)
+                continue
+
+            for pair, image in zip(batch, results):
+                data, _ = encode_image(image, output_options)
+                path = os.path.join(output_dir, f"{pair['id']}.{options['extension']}")
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(path + '.tmp', path)
+
+                # Only recorded once the result is safely on disk
+                checkpoint.write(pair['id'] + '\n')
+                checkpoint.flush()
+                stats['rendered'] += 1
+                stats['bytes'] += len(data)
+
+            done = stats['rendered'] + stats['failed']
+            if done % options['progress_every'] < len(batch) or done == len(pairs):
+                rate = stats['rendered'] / (time.perf_counter() - start_time)
+                print(f"[shard {shard_index}] {done}/{len(pairs)} pairs, {rate:.2f} pairs/s")
+
+    stats['seconds'] = time.perf_counter() - start_time
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render every person/garment pair in a manifest to disk")
+    parser.add_argument('manifest', help='JSON cross-product manifest or JSONL list of pairs')
+    parser.add_argument('output_dir')
+    parser.add_argument('--backend', choices=BACKENDS, default='overlay')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per core, or 1 for kolors)')
+    parser.add_argument('--format', choices=sorted(set(OUTPUT_FORMATS) | set(FORMAT_ALIASES)),
+                        help='output format (default: OUTPUT_FORMAT, or png)')
+    parser.add_argument('--quality', type=int, help='JPEG/WebP quality (1-100)')
+    parser.add_argument('--tier', help='kolors quality tier, e.g. preview or high (default: DEFAULT_QUALITY_TIER)')
+    parser.add_argument('--catalog', help='garment catalog for garment_id pairs (default: GARMENT_CATALOG_DIR)')
+    parser.add_argument('--progress-every', type=int, default=100, help='pairs between progress lines')
+    args = parser.parse_args()
+
+    if args.catalog:
+        # Inherited by the worker processes
+        os.environ['GARMENT_CATALOG_DIR'] = args.catalog
+
+    output_options = resolve_output_options(
+        {'format': args.format, 'quality': args.quality}, default_output_options()
+    )
+
+    pairs = load_manifest(args.manifest)
+    os.makedirs(os.path.join(args.output_dir, CHECKPOINT_DIR), exist_ok=True)
+    done = load_checkpoints(args.output_dir)
+    pending = [pair for pair in pairs if pair['id'] not in done]
+
+    print(f"{len(pairs)} pairs in manifest, {len(pairs) - len(pending)} already rendered, {len(pending)} to go")
+    if not pending:
+        return
+
+    if args.workers:
+        workers = args.workers
+    elif args.backend == 'kolors':
+        workers = 1
+    else:
+        workers = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+    options = {
+        'backend': args.backend,
+        'output_dir': args.output_dir,
+        'output_options': output_options,
+        'extension': 'jpg' if output_options['format'] == 'jpeg' else output_options['format'],
+        'run_id': time.strftime('%Y%m%d-%H%M%S'),
+        'progress_every': max(1, args.progress_every),
+        'tier': args.tier
+    }
+
+    shards = split_shards(pending, workers)
+    start_time = time.perf_counter()
+    results = []
+
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(run_shard, index, shard, options) for index, shard in enumerate(shards)]
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    elapsed = time.perf_counter() - start_time
+    rendered = sum(result['rendered'] for result in results)
+    failed = sum(result['failed'] for result in results)
+    report = {
+        'backend': args.backend,
+        'workers': len(shards),
+        'format': output_options['format'],
+        'pairs': len(pairs),
+        'resumed': len(pairs) - len(pending),
+        'rendered': rendered,
+        'failed': failed,
+        'seconds': round(elapsed, 2),
+        'pairs_per_second': round(rendered / elapsed, 2) if elapsed > 0 else None,
+        'bytes_written': sum(result['bytes'] for result in results),
+        'shards': sorted(
+            ({**result, 'seconds': round(result['seconds'], 2)} for result in results),
+            key=lambda result: result['shard']
+        )
+    }
+
+    with open(os.path.join(args.output_dir, REPORT_FILE), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Rendered {rendered} pairs ({failed} failed) in {elapsed:.1f}s "
+          f"with {len(shards)} workers: {report['pairs_per_second']} pairs/s")
+    if failed:
+        print("Failed pairs were not checkpointed; run the same command again to retry them")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
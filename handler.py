@@ -1,42 +1,67 @@
 import runpod
 import base64
 import io
+import os
 import time
-from PIL import Image
 import json
+from utils.result_cache import ResultCache
+from utils.result_store import ResultStore, deliver_result, result_delivery
+from utils.encoding import EncoderPool, request_output_overrides
+from utils.image_io import decode_image
+from utils.metrics import StageTimer
+from utils.garment_catalog import GarmentCatalog
+from utils.backends import BlendBackend
+from utils.profiling import Profiler
 
-def decode_base64_image(base64_string):
-    """Convert base64 string to PIL Image"""
+# Output encoding settings (OUTPUT_FORMAT etc.) and bounded encoder pool
+encoder_pool = EncoderPool.from_env()
+
+# Cache of finished results keyed by input pixels and blend parameters
+result_cache = ResultCache.from_env()
+blend_backend = BlendBackend(size=(512, 768), alpha=0.3)
+BLEND_PARAMS = blend_backend.params()
+
+# Results written to RESULT_STORE_DIR are returned as URLs under RESULT_BASE_URL, which has to
+# serve that directory (e.g. a network volume behind a CDN); without a store they are inline base64
+result_store = ResultStore.from_env()
+RESULT_DELIVERY = os.environ.get('RESULT_DELIVERY', 'url' if result_store is not None else 'inline')
+
+# Precomputed catalog garments, requested by garment_id instead of clothing_image
+garment_catalog = GarmentCatalog.from_env()
+
+# Jobs with a ``profile`` input field (or sampled by PROFILE_SAMPLE_RATE) have their blend
+# profiled; the trace is written under PROFILE_DIR and only its path is returned
+profiler = Profiler.from_env()
+
+def decode_base64_image(base64_string, target_size=None):
+    """Convert base64 string to PIL Image, decoding straight to target_size if given"""
     try:
         if base64_string.startswith('data:image'):
-            base64_string = base64_string.split(',')[1]
+            base64_string = base64_string.partition(',')[2]
         
         image_data = base64.b64decode(base64_string)
-        image = Image.open(io.BytesIO(image_data))
-        return image.convert('RGB')
+        return decode_image(io.BytesIO(image_data), target_size=target_size)
     except Exception as e:
         raise ValueError(f"Invalid base64 image: {str(e)}")
 
-def encode_image_to_base64(image):
-    """Convert PIL Image to base64 string"""
-    buffer = io.BytesIO()
-    image.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
-    return img_str
+def load_clothing_image(job_input):
+    """Clothing image and optional cache digest, from a catalog garment_id or base64 clothing_image"""
+    garment_id = job_input.get("garment_id")
+    if garment_id:
+        if garment_catalog is None:
+            raise ValueError("garment_id given but no garment catalog is configured")
+        return garment_catalog.image(garment_id), garment_catalog.entry(garment_id)['digest']
+    
+    return decode_base64_image(job_input["clothing_image"], BLEND_PARAMS['size']), None
 
 def simple_image_blend(person_image, clothing_image):
     """Simple image blending as a placeholder for actual AI model"""
-    # Resize images to same size
-    person_image = person_image.resize((512, 768))
-    clothing_image = clothing_image.resize((512, 768))
-    
-    # Simple alpha blending
-    result = Image.blend(person_image, clothing_image, 0.3)
-    return result
+    return blend_backend.render(person_image, clothing_image)
 
 def handler(job):
     """RunPod serverless handler function"""
     start_time = time.time()
+    stages = StageTimer()
     
     try:
         # Get job input
@@ -45,34 +70,74 @@ def handler(job):
         print(f"Received job input: {list(job_input.keys())}")
         
         # Validate required inputs
-        if "person_image" not in job_input or "clothing_image" not in job_input:
+        if "person_image" not in job_input or not ("clothing_image" in job_input or job_input.get("garment_id")):
             return {
-                "error": "Missing required inputs: person_image and clothing_image",
+                "error": "Missing required inputs: person_image and clothing_image or garment_id",
                 "status": "error"
             }
         
+        # Resolve output encoding before doing any work
+        output_options = encoder_pool.resolve(request_output_overrides(job_input))
+        delivery = result_delivery(job_input, RESULT_DELIVERY)
+        if delivery == 'url' and result_store is None:
+            raise ValueError("result_delivery 'url' needs RESULT_STORE_DIR to be configured")
+        profile, profile_requested = profiler.resolve(job_input.get("profile"))
+        
         # Decode input images
         print("Decoding input images...")
-        person_image = decode_base64_image(job_input["person_image"])
-        clothing_image = decode_base64_image(job_input["clothing_image"])
+        with stages.stage('decode'):
+            person_image = decode_base64_image(job_input["person_image"], BLEND_PARAMS['size'])
+            clothing_image, clothing_key = load_clothing_image(job_input)
+        
+        print(f"Person image size: {person_image.info['original_size']}")
+        print(f"Clothing image size: {clothing_image.info['original_size']}")
         
-        print(f"Person image size: {person_image.size}")
-        print(f"Clothing image size: {clothing_image.size}")
+        # Reuse a previous result for identical inputs, unless a profile of the work was asked for;
+        # sampled jobs are only profiled when they miss the cache
+        cache_key = None
+        result_image = None
+        profile_fields = {}
+        if result_cache.enabled and not profile_requested:
+            with stages.stage('cache_lookup'):
+                cache_key = ResultCache.make_key(person_image, clothing_key or clothing_image, **BLEND_PARAMS)
+                result_image = result_cache.get(cache_key)
         
-        # Process (simple blend for now)
-        print("Processing images...")
-        result_image = simple_image_blend(person_image, clothing_image)
+        cache_hit = result_image is not None
+        
+        if not cache_hit:
+            # Process (simple blend for now)
+            print("Processing images...")
+            with stages.stage('blend'), profiler.profile(profile, label='blend') as trace:
+                result_image = simple_image_blend(person_image, clothing_image)
+            profile_fields = trace.fields()
+            
+            if cache_key is not None:
+                with stages.stage('cache_store'):
+                    result_cache.put(cache_key, result_image)
+        else:
+            print("Result cache hit")
         
         # Encode result
         print("Encoding result...")
-        result_base64 = encode_image_to_base64(result_image)
+        with stages.stage('encode'):
+            encoded = encoder_pool.encode(result_image, output_options)
+        
+        # Store the result and return its URL, or return it inline
+        with stages.stage('store'):
+            result_fields = deliver_result(encoded, delivery, result_store)
         
         processing_time = time.time() - start_time
         
         return {
-            "result_image": result_base64,
+            **result_fields,
             "processing_time": round(processing_time, 2),
             "status": "success",
+            "cache_hit": cache_hit,
+            "output_format": encoded['format'],
+            "encoded_size": encoded['encoded_size'],
+            "encode_time": round(encoded['encode_time'], 3),
+            "stage_times": stages.rounded(),
+            **profile_fields,
             "message": "Simple image blending completed (placeholder for AI model)"
         }
         
@@ -84,6 +149,7 @@ def handler(job):
         return {
             "error": error_msg,
             "processing_time": round(processing_time, 2),
+            "stage_times": stages.rounded(),
             "status": "error"
         }
 
@@ -1,78 +1,131 @@
 import runpod
+import asyncio
 import base64
+import multiprocessing
+import os
 import time
 import json
 import io
-from PIL import Image, ImageEnhance
+from concurrent.futures import ProcessPoolExecutor
+from utils.result_cache import ResultCache
+from utils.result_store import ResultStore, deliver_result, result_delivery
+from utils.encoding import EncoderPool, request_output_overrides
+from utils.image_io import decode_image
+from utils.metrics import StageTimer
+from utils.backends import OverlayBackend
+from utils.profiling import Profiler
+from utils.garment_catalog import GarmentCatalog
 
-def decode_base64_image(base64_string):
-    """Convert base64 string to PIL Image"""
+# Output encoding settings (OUTPUT_FORMAT etc.) and bounded encoder pool
+encoder_pool = EncoderPool.from_env()
+
+# Precomputed catalog garments, requested by garment_id instead of clothing_image;
+# every pool process maps the same files, so the pages are shared
+garment_catalog = GarmentCatalog.from_env()
+
+# The overlay backend keeps its compositing buffers between jobs; each pool process has its own.
+# 'constant' alpha mode applies alpha everywhere; 'mask' applies it only where
+# create_mask finds garment rather than white background
+overlay_backend = OverlayBackend(
+    catalog=garment_catalog,
+    alpha_mode=os.environ.get('OVERLAY_ALPHA_MODE', 'constant')
+)
+
+# Cache of finished results keyed by input pixels and overlay parameters
+result_cache = ResultCache.from_env()
+OVERLAY_PARAMS = overlay_backend.params()
+
+# Results written to RESULT_STORE_DIR are returned as URLs under RESULT_BASE_URL, which has to
+# serve that directory (e.g. a network volume behind a CDN); without a store they are inline base64
+result_store = ResultStore.from_env()
+RESULT_DELIVERY = os.environ.get('RESULT_DELIVERY', 'url' if result_store is not None else 'inline')
+
+# Jobs with a ``profile`` input field (or sampled by PROFILE_SAMPLE_RATE) have their compositing
+# profiled in the pool process that runs it; only the trace's path under PROFILE_DIR is returned
+profiler = Profiler.from_env()
+
+def available_cpus():
+    """Number of CPU cores this process is allowed to run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Compositing is CPU-bound, so it runs in a process pool with one worker per core;
+# decoding and encoding run on threads and overlap with compositing of other jobs
+COMPOSITE_WORKERS = int(os.environ.get('COMPOSITE_WORKERS', '0')) or available_cpus()
+
+# Jobs RunPod hands this worker at once; more than the pool size so the next
+# job's decode overlaps the current composite
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', '0')) or COMPOSITE_WORKERS * 2
+
+composite_pool = None
+
+def configure_composite_pool(workers=None):
+    """Create (or recreate) the compositing process pool with ``workers`` processes"""
+    global composite_pool, COMPOSITE_WORKERS
+    
+    if composite_pool is not None:
+        composite_pool.shutdown()
+    
+    COMPOSITE_WORKERS = workers or COMPOSITE_WORKERS
+    # Spawned rather than forked, since the encoder pool threads may already be running
+    composite_pool = ProcessPoolExecutor(
+        max_workers=COMPOSITE_WORKERS,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    return composite_pool
+
+def concurrency_modifier(current_concurrency):
+    """Tell RunPod how many jobs this worker may run concurrently"""
+    return MAX_CONCURRENCY
+
+def decode_base64_image(base64_string, target_size=None):
+    """Convert base64 string to PIL Image, decoding straight to target_size if given"""
     try:
         # Remove data URL prefix if present
         if base64_string.startswith('data:image'):
-            base64_string = base64_string.split(',')[1]
+            base64_string = base64_string.partition(',')[2]
         
         image_data = base64.b64decode(base64_string)
-        image = Image.open(io.BytesIO(image_data))
-        return image.convert('RGB')
+        return decode_image(io.BytesIO(image_data), target_size=target_size)
     except Exception as e:
         raise ValueError(f"Invalid base64 image: {str(e)}")
 
-def encode_image_to_base64(image):
-    """Convert PIL Image to base64 string"""
-    buffer = io.BytesIO()
-    image.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
-    return img_str
+def catalog_entry(garment_id):
+    """Index entry of a catalog garment"""
+    if garment_catalog is None:
+        raise ValueError("garment_id given but no garment catalog is configured")
+    return garment_catalog.entry(garment_id)
 
 def process_virtual_tryon(person_image, clothing_image):
-    """Process virtual try-on by blending images"""
+    """Process virtual try-on by blending images
+    
+    ``clothing_image`` may also be a catalog garment id, which is then read
+    from this process's memory map.
+    """
     try:
-        # Resize images to standard size
-        target_size = (512, 768)  # Width x Height for person
-        clothing_size = (512, 512)  # Square for clothing
-        
-        # Resize person image
-        person_resized = person_image.resize(target_size, Image.Resampling.LANCZOS)
-        
-        # Resize clothing image
-        clothing_resized = clothing_image.resize(clothing_size, Image.Resampling.LANCZOS)
-        
-        # Create a clothing overlay on the person image
-        # Position clothing in the center-upper area of the person
-        overlay_position = (0, 128)  # Start 128 pixels from top
-        
-        # Create a copy of the person image
-        result = person_resized.copy()
-        
-        # Paste clothing with some transparency
-        clothing_with_alpha = clothing_resized.copy()
-        clothing_with_alpha.putalpha(180)  # Semi-transparent
-        
-        # Convert result to RGBA for blending
-        result = result.convert('RGBA')
-        
-        # Paste the clothing onto the person
-        result.paste(clothing_with_alpha, overlay_position, clothing_with_alpha)
-        
-        # Convert back to RGB
-        result = result.convert('RGB')
-        
-        # Enhance the result
-        enhancer = ImageEnhance.Contrast(result)
-        result = enhancer.enhance(1.1)
-        
-        enhancer = ImageEnhance.Color(result)
-        result = enhancer.enhance(1.05)
-        
-        return result
+        return overlay_backend.render(person_image, clothing_image)
         
     except Exception as e:
         raise RuntimeError(f"Image processing failed: {str(e)}")
 
-def handler(job):
-    """Upgraded RunPod handler with real image processing"""
+def profiled_tryon(person_image, clothing_image, profile=None):
+    """process_virtual_tryon under this process's profiler; returns the result and the trace's fields"""
+    with profiler.profile(profile, label='composite') as trace:
+        result_image = process_virtual_tryon(person_image, clothing_image)
+    return result_image, trace.fields()
+
+async def handler(job):
+    """Upgraded RunPod handler with real image processing
+    
+    Runs as a coroutine so several jobs are in flight at once: decoding,
+    cache access and encoding use threads, compositing uses the process pool.
+    """
     start_time = time.time()
+    stages = StageTimer()
+    loop = asyncio.get_running_loop()
+    pool = composite_pool or configure_composite_pool()
     
     try:
         # Get job input
@@ -87,40 +140,99 @@ def handler(job):
                 "status": "error"
             }
         
-        if "clothing_image" not in job_input:
+        if "clothing_image" not in job_input and not job_input.get("garment_id"):
             return {
-                "error": "Missing clothing_image input", 
+                "error": "Missing clothing_image or garment_id input", 
                 "status": "error"
             }
         
+        # Resolve output encoding before doing any work
+        output_options = encoder_pool.resolve(request_output_overrides(job_input))
+        delivery = result_delivery(job_input, RESULT_DELIVERY)
+        if delivery == 'url' and result_store is None:
+            raise ValueError("result_delivery 'url' needs RESULT_STORE_DIR to be configured")
+        profile, profile_requested = profiler.resolve(job_input.get("profile"))
+        
         # Decode input images
         print("Decoding input images...")
-        person_image = decode_base64_image(job_input["person_image"])
-        clothing_image = decode_base64_image(job_input["clothing_image"])
+        clothing_key = None
+        with stages.stage('decode'):
+            if job_input.get("garment_id"):
+                # Catalog garments are read by the compositing process, so only the id is passed on
+                entry = catalog_entry(job_input["garment_id"])
+                person_image = await loop.run_in_executor(
+                    None, decode_base64_image, job_input["person_image"], OVERLAY_PARAMS['target_size']
+                )
+                clothing_image = job_input["garment_id"]
+                clothing_key = entry['digest']
+                clothing_original_size = tuple(entry['original_size'])
+            else:
+                person_image, clothing_image = await asyncio.gather(
+                    loop.run_in_executor(
+                        None, decode_base64_image, job_input["person_image"], OVERLAY_PARAMS['target_size']
+                    ),
+                    loop.run_in_executor(
+                        None, decode_base64_image, job_input["clothing_image"], OVERLAY_PARAMS['clothing_size']
+                    )
+                )
+                clothing_original_size = clothing_image.info['original_size']
         
-        print(f"Person image size: {person_image.size}")
-        print(f"Clothing image size: {clothing_image.size}")
+        print(f"Person image size: {person_image.info['original_size']}")
+        print(f"Clothing image size: {clothing_original_size}")
         
-        # Process virtual try-on
-        print("Processing virtual try-on...")
-        result_image = process_virtual_tryon(person_image, clothing_image)
+        # Reuse a previous result for identical inputs, unless a profile of the work was asked for;
+        # sampled jobs are only profiled when they miss the cache
+        cache_key = None
+        result_image = None
+        profile_fields = {}
+        if result_cache.enabled and not profile_requested:
+            with stages.stage('cache_lookup'):
+                cache_key = ResultCache.make_key(person_image, clothing_key or clothing_image, **OVERLAY_PARAMS)
+                result_image = await loop.run_in_executor(None, result_cache.get, cache_key)
+        
+        cache_hit = result_image is not None
+        
+        if not cache_hit:
+            # Process virtual try-on
+            print("Processing virtual try-on...")
+            with stages.stage('composite'):
+                result_image, profile_fields = await loop.run_in_executor(
+                    pool, profiled_tryon, person_image, clothing_image, profile
+                )
+            
+            if cache_key is not None:
+                with stages.stage('cache_store'):
+                    await loop.run_in_executor(None, result_cache.put, cache_key, result_image)
+        else:
+            print("Result cache hit")
         
         print(f"Result image size: {result_image.size}")
         
         # Encode result image
         print("Encoding result image...")
-        result_base64 = encode_image_to_base64(result_image)
+        with stages.stage('encode'):
+            encoded = await asyncio.wrap_future(encoder_pool.submit(result_image, output_options))
+        
+        # Store the result and return its URL, or return it inline
+        with stages.stage('store'):
+            result_fields = await loop.run_in_executor(None, deliver_result, encoded, delivery, result_store)
         
         processing_time = time.time() - start_time
         
         return {
-            "result_image": result_base64,
+            **result_fields,
             "processing_time": round(processing_time, 2),
             "status": "success",
+            "cache_hit": cache_hit,
+            "output_format": encoded['format'],
+            "encoded_size": encoded['encoded_size'],
+            "encode_time": round(encoded['encode_time'], 3),
+            "stage_times": stages.rounded(),
+            **profile_fields,
             "message": "Virtual try-on completed! Images processed and blended.",
             "input_info": {
-                "person_image_size": person_image.size,
-                "clothing_image_size": clothing_image.size,
+                "person_image_size": person_image.info['original_size'],
+                "clothing_image_size": clothing_original_size,
                 "result_image_size": result_image.size
             }
         }
@@ -133,12 +245,20 @@ def handler(job):
         return {
             "error": error_msg,
             "processing_time": round(processing_time, 2),
+            "stage_times": stages.rounded(),
             "status": "error"
         }
 
 if __name__ == "__main__":
     print("🚀 Starting upgraded RunPod handler...")
-    print("This version processes real images with PIL blending!")
+    print("This version processes real images with NumPy compositing!")
+    print(f"Compositing on {COMPOSITE_WORKERS} processes, up to {MAX_CONCURRENCY} concurrent jobs")
+    
+    # Start the pool processes now rather than on the first job
+    configure_composite_pool().submit(int).result()
     
     # Start RunPod serverless
-    runpod.serverless.start({"handler": handler})
\ No newline at end of file
+    runpod.serverless.start({
+        "handler": handler,
+        "concurrency_modifier": concurrency_modifier
+    })
\ No newline at end of file
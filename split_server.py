@@ -0,0 +1,464 @@
+"""Split deployment: HTTP front-end processes in front of model-owning inference workers
+
+    python split_server.py --port 5000 --http-workers 4 --inference-workers 1
+
+Front-end processes share one listening socket. They parse requests,
+decode uploads into shared-memory slots and encode results, so that work
+scales across cores. Inference worker processes each load the pipeline
+once and run the same result cache, batching and admission control as
+app.py. Only slot names and request fields cross the process boundary;
+see utils/shm_transport.py.
+
+The front-ends serve ``/api/try-on`` and ``/api/try-on/raw`` with the same
+request and response formats as app.py, plus the health probes.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from flask import Flask, jsonify, request
+from PIL import Image
+from werkzeug.serving import make_server
+
+import app as tryon_app
+from utils.admission import CancelToken, Cancelled, Overloaded
+from utils.encoding import request_output_overrides
+from utils.result_store import result_delivery
+from utils.metrics import StageTimer
+from utils.profiling import requested_profile
+from utils.shm_transport import InferenceClient, SlotCache, SlotLayout, SlotPool, error_reply, write_result
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Result region capacity in pixels; larger results fall back to a one-off block
+RESULT_MAX_PIXELS = int(os.environ.get('SHM_RESULT_MAX_PIXELS', str(1024 * 1536)))
+
+
+def slot_layout():
+    return SlotLayout(tryon_app.PERSON_SIZE, tryon_app.CLOTHING_SIZE, RESULT_MAX_PIXELS)
+
+
+def worker_in_flight():
+    """Requests an inference worker takes at once: as many as it can batch, twice over"""
+    return tryon_app.BATCH_MAX_SIZE * 2
+
+
+class WorkerLedger:
+    """Requests an inference worker has taken off the queue and not yet answered
+
+    Kept in shared memory: the worker records each request in a free entry
+    and clears it once replied to, so when the worker dies the supervisor
+    can fail its requests at once instead of leaving them to their deadlines.
+    """
+
+    def __init__(self, context, size):
+        self.size = size
+        self._frontends = context.Array('i', size, lock=False)
+        self._ids = context.Array('q', size, lock=False)
+        self._ready = context.Value('b', 0, lock=False)
+        self.reset()
+
+    @property
+    def ready(self):
+        return bool(self._ready.value)
+
+    def mark_ready(self):
+        self._ready.value = 1
+
+    def record(self, entry, frontend, request_id):
+        # The front-end index marks the entry as taken, so it is written last
+        self._ids[entry] = request_id
+        self._frontends[entry] = frontend
+
+    def clear(self, entry):
+        self._frontends[entry] = -1
+
+    def taken(self):
+        """(frontend, request id) of every recorded request"""
+        return [
+            (self._frontends[entry], self._ids[entry])
+            for entry in range(self.size) if self._frontends[entry] >= 0
+        ]
+
+    def reset(self):
+        for entry in range(self.size):
+            self._frontends[entry] = -1
+        self._ready.value = 0
+
+
+def inference_worker(index, request_queue, reply_queues, ready_count, ledger, device=None):
+    """Load the pipeline once, then serve requests from the shared queue"""
+    if device is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = device
+
+    tryon_app.initialize_model()
+    if tryon_app.model_state['status'] != 'ready':
+        logger.error(f"Inference worker {index}: model failed to load: {tryon_app.model_state['error']}")
+        return
+
+    tryon_app.batch_scheduler.start()
+    slots = SlotCache(slot_layout())
+
+    # Take only as much work as can be batched, so idle workers get the rest
+    in_flight = worker_in_flight()
+    capacity = threading.BoundedSemaphore(in_flight)
+    executor = ThreadPoolExecutor(max_workers=in_flight, thread_name_prefix='inference')
+    free_entries = queue.SimpleQueue()
+    for entry in range(in_flight):
+        free_entries.put(entry)
+
+    def serve(message, entry):
+        reply_queue = reply_queues[message['frontend']]
+        try:
+            reply_queue.put(run_request(message, slots))
+        except Exception as e:
+            reply_queue.put(error_reply(message['id'], e))
+        finally:
+            ledger.clear(entry)
+            free_entries.put(entry)
+            capacity.release()
+
+    with ready_count.get_lock():
+        ready_count.value += 1
+    ledger.mark_ready()
+    logger.info(f"Inference worker {index} ready")
+
+    while True:
+        capacity.acquire()
+        message = request_queue.get()
+        if message is None:
+            break
+        # Never blocks: capacity holds back one entry per request in flight
+        entry = free_entries.get()
+        ledger.record(entry, message['frontend'], message['id'])
+        executor.submit(serve, message, entry)
+
+    executor.shutdown()
+    slots.close()
+
+
+def run_request(message, slots):
+    """Run one request against pixels already in its slot and write the result back"""
+    stages = StageTimer()
+    slot = slots.get(message['slot'])
+
+    # The pipeline needs PIL images, which copy the pixels into this process's memory
+    person_image = Image.fromarray(slot.views['person'])
+    if message['has_clothing']:
+        clothing_image, clothing_key = Image.fromarray(slot.views['clothing']), None
+    else:
+        clothing_image, clothing_key = tryon_app.catalog_garment(message['garment_id'])
+
+    result_image, details = tryon_app.run_tryon(
+        person_image, clothing_image, message.get('prompt', ''), stages=stages,
+        clothing_key=clothing_key, quality=message.get('quality'),
+        cancel_token=CancelToken.until(message.get('deadline')), model=message.get('model'),
+        profile=message.get('profile'), profile_requested=message.get('profile_requested', False)
+    )
+
+    with stages.stage('transport'):
+        result = np.asarray(result_image.convert('RGB'))
+        location = write_result(slot, result)
+
+    return {'id': message['id'], **location, 'details': {**details, 'stage_times': stages.stages}}
+
+
+def create_frontend(client, ready_count):
+    """Flask app of one front-end process"""
+    frontend = Flask(__name__)
+    frontend.config['MAX_CONTENT_LENGTH'] = tryon_app.app.config['MAX_CONTENT_LENGTH']
+
+    def not_ready():
+        if ready_count.value > 0:
+            return None
+        response = jsonify({'error': 'Model is not ready', 'status': 'error'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(tryon_app.NOT_READY_RETRY_AFTER)
+        return response
+
+    def run(person_image, clothing_image, fields, stages):
+        """Send decoded images to an inference worker; returns the result image and details"""
+        garment_id = fields.get('garment_id')
+        # Sampled here; traces are written by the inference worker
+        profile, profile_requested = tryon_app.profiler.resolve(requested_profile(fields, request.headers))
+        request_fields = {
+            'prompt': fields.get('prompt', ''),
+            'model': tryon_app.backends.get(fields.get('model')).name,
+            'quality': tryon_app.quality_tiers.get(fields.get('quality')).name,
+            'garment_id': garment_id,
+            'profile': profile,
+            'profile_requested': profile_requested
+        }
+        timeout = tryon_app.request_cancel_token(fields).remaining()
+
+        start_time = time.perf_counter()
+        result, details = client.run(
+            np.asarray(person_image),
+            None if garment_id else np.asarray(clothing_image),
+            fields=request_fields,
+            timeout=timeout
+        )
+        elapsed = time.perf_counter() - start_time
+
+        # Whatever the worker did not account for was spent in queues and copies
+        worker_stages = details.pop('stage_times')
+        stages.update(worker_stages)
+        stages.record('transport', max(0.0, elapsed - sum(worker_stages.values())))
+        return Image.fromarray(result), details
+
+    def error_response(endpoint, error, start_time, stages):
+        processing_time = time.time() - start_time
+        if isinstance(error, (Overloaded, Cancelled)):
+            return tryon_app.rejected_response(endpoint, error, processing_time, stages)
+
+        logger.error(f"Error in front-end {endpoint}: {str(error)}")
+        return jsonify({
+            'error': str(error),
+            'processing_time': round(processing_time, 2),
+            'status': 'error'
+        }), 500
+
+    @frontend.route('/api/try-on', methods=['POST'])
+    def api_try_on():
+        """Same JSON API as app.py's /api/try-on"""
+        start_time = time.time()
+        stages = StageTimer()
+        rejected = not_ready()
+        if rejected is not None:
+            return rejected
+
+        try:
+            data = request.get_json()
+            if not data or 'person_image' not in data or not ('clothing_image' in data or data.get('garment_id')):
+                return jsonify({
+                    'error': 'Missing required fields: person_image and clothing_image or garment_id'
+                }), 400
+
+            output_options = tryon_app.encoder_pool.resolve(request_output_overrides(data))
+            delivery = result_delivery(data, tryon_app.RESULT_DELIVERY)
+            with stages.stage('decode'):
+                person_image = tryon_app.decode_base64_image(data['person_image'], tryon_app.PERSON_SIZE)
+                clothing_image = None
+                if not data.get('garment_id'):
+                    clothing_image = tryon_app.decode_base64_image(data['clothing_image'], tryon_app.CLOTHING_SIZE)
+
+            result_image, details = run(person_image, clothing_image, data, stages)
+
+            with stages.stage('encode'):
+                encoded = tryon_app.encode_image_to_bytes(result_image, output_options)
+            with stages.stage('store'):
+                result_fields = tryon_app.deliver_result(encoded, delivery)
+
+            return jsonify({
+                **result_fields,
+                'processing_time': round(time.time() - start_time, 2),
+                **details,
+                **tryon_app.encoding_details(encoded),
+                'stage_times': stages.rounded(),
+                'status': 'success'
+            })
+
+        except Exception as e:
+            return error_response('try-on', e, start_time, stages)
+
+    @frontend.route('/api/try-on/raw', methods=['POST'])
+    def api_try_on_raw():
+        """Same multipart API as app.py's /api/try-on/raw"""
+        start_time = time.time()
+        stages = StageTimer()
+        rejected = not_ready()
+        if rejected is not None:
+            return rejected
+
+        try:
+            if 'person_image' not in request.files or not (
+                'clothing_image' in request.files or request.form.get('garment_id')
+            ):
+                return jsonify({
+                    'error': 'Missing required files: person_image and clothing_image (or a garment_id field)'
+                }), 400
+
+            output_options = tryon_app.encoder_pool.resolve(request_output_overrides(request.form))
+            with stages.stage('decode'):
+                person_image = tryon_app.decode_image_file(request.files['person_image'].stream, tryon_app.PERSON_SIZE)
+                clothing_image = None
+                if not request.form.get('garment_id'):
+                    clothing_image = tryon_app.decode_image_file(
+                        request.files['clothing_image'].stream, tryon_app.CLOTHING_SIZE
+                    )
+
+            result_image, details = run(person_image, clothing_image, request.form, stages)
+
+            with stages.stage('encode'):
+                encoded = tryon_app.encode_image_to_bytes(result_image, output_options)
+
+            processing_time = time.time() - start_time
+            response = frontend.response_class(encoded['data'], mimetype=encoded['mime_type'])
+            response.headers['X-Processing-Time'] = str(round(processing_time, 2))
+            response.headers['Server-Timing'] = tryon_app.server_timing(stages)
+            for name, value in {**details, **tryon_app.encoding_details(encoded)}.items():
+                header = 'X-' + '-'.join(part.capitalize() for part in name.split('_'))
+                response.headers[header] = str(value)
+            return response
+
+        except Exception as e:
+            return error_response('try-on-raw', e, start_time, stages)
+
+    # Results stored by any front-end are served by all of them
+    frontend.add_url_rule('/results/<name>', view_func=tryon_app.stored_result)
+
+    @frontend.route('/health')
+    def health_check():
+        return jsonify({
+            'status': 'healthy',
+            'ready': ready_count.value > 0,
+            'inference_workers_ready': ready_count.value,
+            'frontend': client.frontend_id
+        })
+
+    @frontend.route('/health/live')
+    def liveness_check():
+        return jsonify({'status': 'alive'})
+
+    @frontend.route('/health/ready')
+    def readiness_check():
+        if ready_count.value == 0:
+            return jsonify({'status': 'not_ready', 'inference_workers_ready': 0}), 503
+        return jsonify({'status': 'ready', 'inference_workers_ready': ready_count.value})
+
+    return frontend
+
+
+def frontend_worker(index, listen_fd, host, port, request_queue, reply_queue, ready_count, slots):
+    """Serve HTTP on the shared listening socket"""
+    pool = SlotPool(slot_layout(), slots)
+    client = InferenceClient(request_queue, reply_queue, index, pool)
+    server = make_server(host, port, create_frontend(client, ready_count), threaded=True, fd=listen_fd)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    logger.info(f"Front-end {index} serving on {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        pool.close()
+
+
+def fail_in_flight(ledger, reply_queues):
+    """Reply with an error to every request a dead inference worker had taken; returns how many"""
+    taken = ledger.taken()
+    for frontend, request_id in taken:
+        reply_queues[frontend].put(
+            error_reply(request_id, RuntimeError("Inference worker exited while running the request"))
+        )
+    return len(taken)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve try-on with separate HTTP and inference processes")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--http-workers', type=int, default=int(os.environ.get('HTTP_WORKERS', '0')),
+                        help='front-end processes (default: one per core)')
+    parser.add_argument('--inference-workers', type=int, default=int(os.environ.get('INFERENCE_WORKERS', '1')),
+                        help='processes that each load the pipeline')
+    parser.add_argument('--devices', default=os.environ.get('INFERENCE_DEVICES'),
+                        help='comma-separated CUDA device ids, assigned to inference workers round-robin')
+    parser.add_argument('--slots', type=int, default=int(os.environ.get('SHM_SLOTS', '16')),
+                        help='shared-memory slots per front-end, i.e. its requests in flight')
+    args = parser.parse_args()
+
+    http_workers = args.http_workers or (
+        len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    )
+    devices = args.devices.split(',') if args.devices else None
+
+    # Inference workers are spawned so CUDA and torch start fresh; front-ends are forked
+    # so they inherit the listening socket
+    spawn = multiprocessing.get_context('spawn')
+    fork = multiprocessing.get_context('fork')
+    request_queue = spawn.Queue()
+    reply_queues = [spawn.Queue() for _ in range(http_workers)]
+    ready_count = spawn.Value('i', 0)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(128)
+
+    ledgers = [WorkerLedger(spawn, worker_in_flight()) for _ in range(args.inference_workers)]
+
+    def inference_process(index):
+        return spawn.Process(
+            target=inference_worker, name=f'inference-{index}',
+            args=(index, request_queue, reply_queues, ready_count, ledgers[index],
+                  devices[index % len(devices)] if devices else None)
+        )
+
+    inference = [inference_process(index) for index in range(args.inference_workers)]
+    frontends = [
+        fork.Process(
+            target=frontend_worker, name=f'frontend-{index}',
+            args=(index, listener.fileno(), args.host, args.port, request_queue, reply_queues[index],
+                  ready_count, args.slots)
+        )
+        for index in range(http_workers)
+    ]
+
+    logger.info(f"Starting {args.inference_workers} inference and {http_workers} front-end processes "
+                f"on {args.host}:{args.port}")
+    for process in inference + frontends:
+        process.start()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    def restart_crashed():
+        """Restart inference workers that died after becoming ready; False if one never got ready"""
+        for index, process in enumerate(inference):
+            if process.is_alive():
+                continue
+            ledger = ledgers[index]
+            if not ledger.ready:
+                return False
+
+            # Its requests will never be answered: fail them now rather than at their deadlines
+            failed = fail_in_flight(ledger, reply_queues)
+            with ready_count.get_lock():
+                ready_count.value -= 1
+            ledger.reset()
+            logger.error(f"Inference worker {index} exited with code {process.exitcode}; "
+                         f"failed {failed} in-flight requests, restarting")
+            inference[index] = inference_process(index)
+            inference[index].start()
+        return True
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while all(process.is_alive() for process in frontends) and restart_crashed():
+            time.sleep(1)
+        logger.error("A worker process exited; shutting down")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        processes = inference + frontends
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(10)
+        listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+from utils.admission import AdmissionController, CancelToken, Cancelled, DeadlineExceeded, Overloaded
+
+
+def test_token_without_a_deadline_never_expires():
+    token = CancelToken()
+
+    assert token.remaining() is None
+    assert not token.done
+    token.check()
+
+
+@pytest.mark.parametrize('timeout', [None, 0])
+def test_zero_or_missing_timeout_means_no_deadline(timeout):
+    assert CancelToken(timeout).deadline is None
+
+
+def test_token_expires_at_its_deadline():
+    token = CancelToken(0.02)
+    assert 0 < token.remaining() <= 0.02
+
+    time.sleep(0.03)
+
+    assert token.expired and token.done
+    assert token.remaining() == 0.0
+    with pytest.raises(DeadlineExceeded):
+        token.check()
+
+
+def test_cancelled_token_raises_cancelled():
+    token = CancelToken(60)
+    token.cancel()
+
+    assert token.cancelled and token.done
+    with pytest.raises(Cancelled) as raised:
+        token.check()
+    assert not isinstance(raised.value, DeadlineExceeded)
+
+
+def test_token_shares_its_owners_event():
+    event = threading.Event()
+    token = CancelToken(event=event)
+
+    event.set()
+
+    assert token.cancelled
+    assert token.event is event
+
+
+def test_token_until_an_absolute_deadline_counts_time_already_spent():
+    token = CancelToken.until(time.time() + 0.5)
+    assert 0.4 < token.remaining() <= 0.5
+
+    assert CancelToken.until(time.time() - 1).expired
+    assert CancelToken.until(None).deadline is None
+
+
+def test_admits_everything_until_a_batch_is_observed():
+    controller = AdmissionController(max_batch_size=2)
+    tickets = [controller.admit(1000, CancelToken(0.001)) for _ in range(5)]
+
+    assert controller.stats()['outstanding_requests'] == 5
+    assert controller.estimate_wait() == 0.0
+    for ticket in tickets:
+        ticket.release()
+
+
+def test_rejects_beyond_max_queue_until_a_ticket_is_released():
+    controller = AdmissionController(max_queue=2)
+    first = controller.admit(10)
+    controller.admit(10)
+
+    with pytest.raises(Overloaded) as raised:
+        controller.admit(10)
+    assert raised.value.retry_after >= 1
+
+    first.release()
+    controller.admit(10)
+    assert controller.stats()['rejected'] == 1
+    assert controller.stats()['admitted'] == 3
+
+
+def test_estimates_wait_from_outstanding_work_shared_across_a_batch():
+    controller = AdmissionController(max_batch_size=2)
+    controller.observe(10, 1.0)
+    controller.admit(40)
+
+    # 40 units at 0.1 s each, two requests per pipeline call
+    assert controller.estimate_wait() == pytest.approx(2.0)
+
+
+def test_sheds_work_that_cannot_meet_its_deadline():
+    controller = AdmissionController(max_batch_size=1)
+    controller.observe(10, 1.0)
+    controller.admit(50)
+
+    with pytest.raises(Overloaded) as raised:
+        controller.admit(50, CancelToken(7))
+    assert raised.value.retry_after == 5
+
+    controller.admit(50, CancelToken(20))
+
+
+def test_observations_are_smoothed():
+    controller = AdmissionController(smoothing=0.5)
+    controller.observe(10, 1.0)
+    controller.observe(10, 3.0)
+
+    assert controller.seconds_per_unit == pytest.approx(0.2)
+
+
+def test_release_is_idempotent():
+    controller = AdmissionController()
+    ticket = controller.admit(10)
+    controller.admit(5)
+
+    ticket.release()
+    ticket.release()
+
+    stats = controller.stats()
+    assert stats['outstanding_requests'] == 1
+    assert stats['outstanding_work'] == 5
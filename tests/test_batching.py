@@ -0,0 +1,137 @@
+import threading
+
+import pytest
+
+from utils.batching import BatchScheduler
+
+# Generous bound for results, so a slow machine does not fail the tests
+RESULT_TIMEOUT = 5
+
+
+class StubPipeline:
+    """Batch function recording each batch it was given; fails items that are exceptions"""
+
+    def __init__(self):
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def __call__(self, items):
+        with self._lock:
+            self.batches.append(list(items))
+        return [item if isinstance(item, Exception) else item * 10 for item in items]
+
+
+@pytest.fixture
+def pipeline():
+    return StubPipeline()
+
+
+def test_groups_requests_up_to_max_batch_size(pipeline):
+    # A long window, so only the size limit closes a batch until the queue runs dry
+    scheduler = BatchScheduler(pipeline, max_batch_size=3, max_wait=0.5)
+    try:
+        futures = [scheduler.submit(i) for i in range(7)]
+        infos = [future.result(RESULT_TIMEOUT)[1] for future in futures]
+    finally:
+        scheduler.stop(RESULT_TIMEOUT)
+
+    assert [len(batch) for batch in pipeline.batches] == [3, 3, 1]
+    assert [info['batch_size'] for info in infos] == [3, 3, 3, 3, 3, 3, 1]
+
+
+def test_flushes_a_partial_batch_after_the_wait_window(pipeline):
+    scheduler = BatchScheduler(pipeline, max_batch_size=8, max_wait=0.05)
+    try:
+        futures = [scheduler.submit(i) for i in range(2)]
+        results = [future.result(RESULT_TIMEOUT) for future in futures]
+    finally:
+        scheduler.stop(RESULT_TIMEOUT)
+
+    assert pipeline.batches == [[0, 1]]
+    first_info = results[0][1]
+    assert first_info['batch_size'] == 2
+    assert first_info['queue_wait'] >= 0.05 * 0.9
+
+
+def test_returns_each_caller_its_own_output(pipeline):
+    scheduler = BatchScheduler(pipeline, max_batch_size=4, max_wait=0.2)
+    try:
+        futures = {i: scheduler.submit(i) for i in (5, 1, 4, 2, 3)}
+        outputs = {i: future.result(RESULT_TIMEOUT)[0] for i, future in futures.items()}
+    finally:
+        scheduler.stop(RESULT_TIMEOUT)
+
+    assert outputs == {i: i * 10 for i in futures}
+
+
+def test_failing_request_does_not_fail_its_batch(pipeline):
+    scheduler = BatchScheduler(pipeline, max_batch_size=3, max_wait=0.2)
+    error = ValueError("bad input")
+    try:
+        futures = [scheduler.submit(1), scheduler.submit(error), scheduler.submit(3)]
+        with pytest.raises(ValueError, match="bad input"):
+            futures[1].result(RESULT_TIMEOUT)
+        outputs = [futures[0].result(RESULT_TIMEOUT)[0], futures[2].result(RESULT_TIMEOUT)[0]]
+    finally:
+        scheduler.stop(RESULT_TIMEOUT)
+
+    assert len(pipeline.batches) == 1
+    assert outputs == [10, 30]
+
+
+def test_exception_from_the_batch_function_fails_the_whole_batch():
+    def broken(items):
+        raise RuntimeError("pipeline down")
+
+    scheduler = BatchScheduler(broken, max_batch_size=2, max_wait=0.2)
+    try:
+        futures = [scheduler.submit(i) for i in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="pipeline down"):
+                future.result(RESULT_TIMEOUT)
+    finally:
+        scheduler.stop(RESULT_TIMEOUT)
+
+
+def test_wrong_number_of_outputs_is_an_error():
+    scheduler = BatchScheduler(lambda items: items[:1], max_batch_size=2, max_wait=0.2)
+    try:
+        futures = [scheduler.submit(i) for i in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="returned 1 results for 2 requests"):
+                future.result(RESULT_TIMEOUT)
+    finally:
+        scheduler.stop(RESULT_TIMEOUT)
+
+
+def test_check_item_drops_rejected_items_before_the_batch_runs(pipeline):
+    def check(item):
+        if item == 2:
+            raise TimeoutError("deadline passed")
+
+    scheduler = BatchScheduler(pipeline, max_batch_size=3, max_wait=0.2, check_item=check)
+    try:
+        futures = [scheduler.submit(i) for i in range(1, 4)]
+        with pytest.raises(TimeoutError):
+            futures[1].result(RESULT_TIMEOUT)
+        outputs = [futures[0].result(RESULT_TIMEOUT), futures[2].result(RESULT_TIMEOUT)]
+    finally:
+        scheduler.stop(RESULT_TIMEOUT)
+
+    assert pipeline.batches == [[1, 3]]
+    assert [output for output, _ in outputs] == [10, 30]
+    assert all(info['batch_size'] == 2 for _, info in outputs)
+
+
+def test_submit_after_stop_is_rejected(pipeline):
+    scheduler = BatchScheduler(pipeline)
+    scheduler.start()
+    scheduler.stop(RESULT_TIMEOUT)
+
+    with pytest.raises(RuntimeError):
+        scheduler.submit(1)
+
+
+def test_rejects_an_empty_batch_size(pipeline):
+    with pytest.raises(ValueError):
+        BatchScheduler(pipeline, max_batch_size=0)
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+from utils.compositing import Compositor
+
+# Largest per-channel difference from the PIL paste and enhance chain, in 0-255 levels
+TOLERANCE = 2
+
+OVERLAY = {'alpha': 180, 'contrast': 1.1, 'color': 1.05}
+
+
+def synthetic_image(height, width, seed):
+    """Gradients plus noise, so the blend and the enhancement both have something to change"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x * y) % 256], axis=-1)
+    return np.clip(base + rng.normal(0, 20, base.shape), 0, 255).astype(np.uint8)
+
+
+def pil_composite(person, garment, position, alpha, contrast, color, mask=None):
+    """The PIL chain Compositor replaces: paste with alpha, then Contrast and Color"""
+    result = Image.fromarray(person).convert('RGBA')
+    garment_image = Image.fromarray(garment)
+    if mask is None:
+        garment_image.putalpha(alpha)
+    else:
+        garment_image.putalpha(Image.fromarray((mask.astype(np.float32) * alpha / 255).round().astype(np.uint8)))
+    result.paste(garment_image, position, garment_image)
+    result = result.convert('RGB')
+    result = ImageEnhance.Contrast(result).enhance(contrast)
+    result = ImageEnhance.Color(result).enhance(color)
+    return np.asarray(result)
+
+
+def max_difference(a, b):
+    return int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+
+
+@pytest.mark.parametrize('position', [(0, 32), (40, 100), (-10, -10)])
+def test_matches_the_pil_chain(position):
+    person = synthetic_image(128, 96, seed=0)
+    garment = synthetic_image(64, 64, seed=1)
+    compositor = Compositor(position=position, **OVERLAY)
+
+    result = compositor.composite(person, garment)
+
+    assert result.shape == person.shape
+    assert result.dtype == np.uint8
+    assert max_difference(result, pil_composite(person, garment, position, **OVERLAY)) <= TOLERANCE
+
+
+def test_mask_alpha_matches_the_pil_chain():
+    person = synthetic_image(128, 96, seed=2)
+    garment = synthetic_image(64, 64, seed=3)
+    mask = np.zeros((64, 64), dtype=np.uint8)
+    mask[8:56, 16:48] = 255
+    mask[:, :4] = 128
+    compositor = Compositor(position=(16, 24), **OVERLAY)
+
+    result = compositor.composite(person, garment, mask)
+
+    expected = pil_composite(person, garment, (16, 24), mask=mask, **OVERLAY)
+    assert max_difference(result, expected) <= TOLERANCE
+
+
+def test_batch_matches_garments_composited_one_at_a_time():
+    person = synthetic_image(128, 96, seed=4)
+    garments = np.stack([synthetic_image(64, 64, seed=seed) for seed in (5, 6, 7)])
+    compositor = Compositor(position=(8, 40), **OVERLAY)
+
+    batch = compositor.composite(person, garments)
+
+    assert batch.shape == (3,) + person.shape
+    for garment, result in zip(garments, batch):
+        assert np.array_equal(result, compositor.composite(person, garment))
+
+
+def test_reused_buffers_do_not_leak_between_calls():
+    compositor = Compositor(position=(8, 40), **OVERLAY)
+    first = (synthetic_image(128, 96, seed=8), synthetic_image(64, 64, seed=9))
+    second = (synthetic_image(128, 96, seed=10), synthetic_image(64, 64, seed=11))
+
+    expected = Compositor(position=(8, 40), **OVERLAY).composite(*second)
+    compositor.composite(*first)
+
+    assert np.array_equal(compositor.composite(*second), expected)
+
+
+def test_garment_outside_the_frame_leaves_only_the_enhancement():
+    person = synthetic_image(64, 64, seed=12)
+    garment = synthetic_image(32, 32, seed=13)
+    compositor = Compositor(position=(100, 100), **OVERLAY)
+
+    result = compositor.composite(person, garment)
+
+    expected = ImageEnhance.Color(
+        ImageEnhance.Contrast(Image.fromarray(person)).enhance(OVERLAY['contrast'])
+    ).enhance(OVERLAY['color'])
+    assert max_difference(result, np.asarray(expected)) <= TOLERANCE
+
+
+def test_rejects_a_person_that_is_not_rgb():
+    with pytest.raises(ValueError):
+        Compositor().composite(np.zeros((8, 8), dtype=np.uint8), np.zeros((4, 4, 3), dtype=np.uint8))
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+from utils.image_utils import (
+    PERSON_WORKING_SIZE,
+    enhance_array,
+    enhance_result_batch,
+    enhance_result_image,
+    preprocess_clothing_batch,
+    preprocess_clothing_image,
+    preprocess_person_batch,
+    preprocess_person_image,
+)
+
+# Largest per-channel difference from PIL's ImageEnhance output, in 0-255 levels
+TOLERANCE = 2
+
+ENHANCERS = {
+    'contrast': ImageEnhance.Contrast,
+    'color': ImageEnhance.Color,
+    'sharpness': ImageEnhance.Sharpness,
+}
+
+
+def synthetic_batch(count, height=48, width=40, seed=0):
+    """Gradients plus noise, so every channel and the luma mean vary between images"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    images = []
+    for i in range(count):
+        base = np.stack([x * 255 / width, y * 255 / height, (x + y + 40 * i) % 256], axis=-1)
+        noise = rng.normal(0, 20, base.shape)
+        images.append(np.clip(base + noise, 0, 255).astype(np.uint8))
+    return np.stack(images)
+
+
+def pil_enhance(array, **factors):
+    image = Image.fromarray(array)
+    for name in ('contrast', 'color', 'sharpness'):
+        if name in factors:
+            image = ENHANCERS[name](image).enhance(factors[name])
+    return np.asarray(image)
+
+
+def max_difference(a, b):
+    return int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max())
+
+
+@pytest.mark.parametrize('name', sorted(ENHANCERS))
+@pytest.mark.parametrize('factor', [0.5, 1.2, 1.8])
+def test_single_enhancement_matches_pil(name, factor):
+    batch = synthetic_batch(3)
+    result = enhance_array(batch, **{name: factor})
+
+    assert result.shape == batch.shape
+    assert result.dtype == np.uint8
+    for image, enhanced in zip(batch, result):
+        assert max_difference(enhanced, pil_enhance(image, **{name: factor})) <= TOLERANCE
+
+
+@pytest.mark.parametrize('name', sorted(ENHANCERS))
+def test_batch_of_one_matches_pil(name):
+    batch = synthetic_batch(1, seed=1)
+    result = enhance_array(batch, **{name: 1.3})
+
+    assert result.shape == (1,) + batch.shape[1:]
+    assert max_difference(result[0], pil_enhance(batch[0], **{name: 1.3})) <= TOLERANCE
+
+
+def test_single_image_keeps_its_shape():
+    image = synthetic_batch(1, seed=2)[0]
+    result = enhance_array(image, contrast=1.2)
+
+    assert result.shape == image.shape
+    assert max_difference(result, pil_enhance(image, contrast=1.2)) <= TOLERANCE
+
+
+def test_batch_matches_images_enhanced_one_at_a_time():
+    batch = synthetic_batch(4, seed=3)
+    result = enhance_array(batch, contrast=1.1, color=1.05, sharpness=1.05)
+
+    for image, enhanced in zip(batch, result):
+        assert np.array_equal(enhanced, enhance_array(image, contrast=1.1, color=1.05, sharpness=1.05))
+
+
+def test_float_input_stays_float():
+    batch = synthetic_batch(2, seed=4).astype(np.float32)
+    result = enhance_array(batch, contrast=1.2, color=1.2)
+
+    assert result.dtype == np.float32
+    assert result.min() >= 0 and result.max() <= 255
+
+
+def test_clothing_batch_matches_pil_preprocessing():
+    batch = synthetic_batch(2, seed=5)
+    result = preprocess_clothing_batch(batch)
+
+    for image, enhanced in zip(batch, result):
+        expected = np.asarray(preprocess_clothing_image(Image.fromarray(image)))
+        assert max_difference(enhanced, expected) <= TOLERANCE
+
+
+def test_result_batch_matches_pil_enhancement():
+    batch = synthetic_batch(2, seed=6)
+    result = enhance_result_batch(batch)
+
+    for image, enhanced in zip(batch, result):
+        expected = np.asarray(enhance_result_image(Image.fromarray(image)))
+        assert max_difference(enhanced, expected) <= TOLERANCE
+
+
+def test_rejects_non_rgb_arrays():
+    with pytest.raises(ValueError):
+        enhance_array(np.zeros((4, 4), dtype=np.uint8), contrast=1.2)
+
+
+def test_person_preprocessing_keeps_the_input_size():
+    image = Image.fromarray(synthetic_batch(1, height=900, width=600, seed=7)[0])
+    stats = {}
+    result = preprocess_person_image(image, stats=stats)
+
+    assert result.size == image.size
+    assert stats['denoise_tier'] in ('none', 'bilateral', 'nlmeans')
+
+
+def test_person_preprocessing_reduces_to_a_given_working_size():
+    image = Image.fromarray(synthetic_batch(1, height=900, width=600, seed=8)[0])
+    result = preprocess_person_image(image, working_size=PERSON_WORKING_SIZE)
+
+    assert result.size[0] <= PERSON_WORKING_SIZE[0] and result.size[1] <= PERSON_WORKING_SIZE[1]
+
+
+def test_denoise_tier_follows_the_noise_estimate():
+    flat = np.full((64, 64, 3), 128, dtype=np.uint8)
+    noisy = np.clip(flat + np.random.default_rng(9).normal(0, 25, flat.shape), 0, 255).astype(np.uint8)
+    stats = []
+    preprocess_person_batch(np.stack([flat, noisy]), stats=stats)
+
+    assert stats[0]['denoise_tier'] == 'none'
+    assert stats[1]['denoise_tier'] == 'nlmeans'
+    assert stats[1]['noise_sigma'] > stats[0]['noise_sigma']
@@ -0,0 +1,194 @@
+import json
+import threading
+
+import pytest
+
+from utils.admission import Cancelled, DeadlineExceeded
+from utils.jobs import TERMINAL_STATUSES, JobManager
+
+# Generous bound for state changes, so a slow machine does not fail the tests
+WAIT_TIMEOUT = 5
+
+
+def wait_for_status(manager, job, *statuses):
+    """Follow the job's updates until it reaches one of ``statuses``; returns every snapshot seen"""
+    seen = []
+    version = -1
+    while True:
+        state = manager.wait_for_update(job, version, timeout=WAIT_TIMEOUT)
+        assert state is not None, f"job stuck in {job.status}"
+        seen.append(state)
+        version = state['version']
+        if state['status'] in statuses:
+            return seen
+
+
+class GatedRun:
+    """run_job that reports progress, then waits until released"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, job, progress):
+        progress(1, 2)
+        self.started.set()
+        assert self.release.wait(WAIT_TIMEOUT)
+        if job.cancel_event.is_set():
+            raise Cancelled("Job was cancelled")
+        return f"result of {job.payload}", {'detail': job.payload}
+
+
+def test_job_runs_through_queued_running_and_completed():
+    run = GatedRun()
+    manager = JobManager(run)
+    job = manager.submit('a')
+    assert manager.snapshot(job)['status'] in ('queued', 'running')
+
+    assert run.started.wait(WAIT_TIMEOUT)
+    running = manager.snapshot(job)
+    assert running['status'] == 'running'
+    assert (running['step'], running['total_steps']) == (1, 2)
+
+    run.release.set()
+    states = wait_for_status(manager, job, 'completed')
+
+    assert states[-1]['detail'] == 'a'
+    assert job.result == 'result of a'
+    assert job.payload is None
+    assert job.finished_at is not None
+
+
+def test_queued_jobs_report_their_position():
+    run = GatedRun()
+    manager = JobManager(run, workers=1)
+    first = manager.submit('first')
+    assert run.started.wait(WAIT_TIMEOUT)
+    second, third = manager.submit('second'), manager.submit('third')
+
+    assert manager.snapshot(second)['queue_position'] == 1
+    assert manager.snapshot(third)['queue_position'] == 2
+    assert manager.queue_depth() == 2
+
+    run.release.set()
+    for job in (first, second, third):
+        wait_for_status(manager, job, 'completed')
+
+
+def test_cancelling_a_queued_job_discards_it_once():
+    run = GatedRun()
+    discarded = []
+    manager = JobManager(run, workers=1, discard_job=lambda job, payload: discarded.append(payload))
+    running = manager.submit('running')
+    assert run.started.wait(WAIT_TIMEOUT)
+    queued = manager.submit('queued')
+
+    assert manager.cancel(queued)
+    assert not manager.cancel(queued)
+
+    assert queued.status == 'cancelled'
+    assert discarded == ['queued']
+    run.release.set()
+    wait_for_status(manager, running, 'completed')
+    assert queued.status == 'cancelled'
+
+
+def test_cancelling_a_running_job_asks_it_to_stop():
+    run = GatedRun()
+    discarded = []
+    manager = JobManager(run, discard_job=lambda job, payload: discarded.append(payload))
+    job = manager.submit('a')
+    assert run.started.wait(WAIT_TIMEOUT)
+
+    assert manager.cancel(job)
+    assert manager.snapshot(job)['cancel_requested']
+    run.release.set()
+
+    state = wait_for_status(manager, job, *TERMINAL_STATUSES)[-1]
+    assert state['status'] == 'cancelled'
+    # Running jobs are accounted for by run_job, not discarded
+    assert discarded == []
+
+
+@pytest.mark.parametrize('error, status', [
+    (ValueError("bad input"), 'failed'),
+    (DeadlineExceeded("Request deadline exceeded"), 'timeout'),
+    (Cancelled("Job was cancelled"), 'cancelled'),
+])
+def test_error_status_names_the_terminal_status(error, status):
+    def run(job, progress):
+        raise error
+
+    def error_status(e):
+        if isinstance(e, DeadlineExceeded):
+            return 'timeout'
+        return 'cancelled' if isinstance(e, Cancelled) else 'failed'
+
+    manager = JobManager(run, error_status=error_status)
+    job = manager.submit('a')
+    state = wait_for_status(manager, job, *TERMINAL_STATUSES)[-1]
+
+    assert state['status'] == status
+    assert state['error'] == str(error)
+
+
+def test_previews_only_move_forward():
+    run = GatedRun()
+    manager = JobManager(run)
+    job = manager.submit('a')
+    assert run.started.wait(WAIT_TIMEOUT)
+
+    manager.set_preview(job, 'step 4', 4)
+    manager.set_preview(job, 'step 2', 2)
+
+    assert manager.preview(job) == ('step 4', 4)
+    run.release.set()
+    wait_for_status(manager, job, 'completed')
+    manager.set_preview(job, 'step 6', 6)
+    assert manager.preview(job) == (None, 4)
+
+
+def test_wait_for_update_times_out_without_changes():
+    run = GatedRun()
+    manager = JobManager(run)
+    job = manager.submit('a')
+    assert run.started.wait(WAIT_TIMEOUT)
+
+    assert manager.wait_for_update(job, job.version, timeout=0.01) is None
+    run.release.set()
+    wait_for_status(manager, job, 'completed')
+
+
+def test_history_keeps_only_the_newest_finished_jobs():
+    manager = JobManager(lambda job, progress: (None, {}), max_history=2)
+    jobs = []
+    for name in ('a', 'b', 'c'):
+        jobs.append(manager.submit(name))
+        wait_for_status(manager, jobs[-1], 'completed')
+    manager.submit('d')
+
+    assert manager.get(jobs[0].id) is None
+    assert manager.get(jobs[2].id) is jobs[2]
+
+
+def test_events_stream_ends_with_the_terminal_status(monkeypatch):
+    import app
+
+    run = GatedRun()
+    manager = JobManager(run)
+    monkeypatch.setattr(app, 'job_manager', manager)
+    job = manager.submit('a')
+    assert run.started.wait(WAIT_TIMEOUT)
+    run.release.set()
+
+    response = app.app.test_client().get(f'/api/jobs/{job.id}/events')
+    events = [
+        (block.split('\n')[0][len('event: '):], json.loads(block.split('\n')[1][len('data: '):]))
+        for block in response.get_data(as_text=True).strip().split('\n\n')
+        if block.startswith('event: ')
+    ]
+
+    assert response.mimetype == 'text/event-stream'
+    assert events[-1][0] == 'completed'
+    assert events[-1][1]['detail'] == 'a'
+    assert all(name == state['status'] for name, state in events)
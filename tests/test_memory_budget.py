@@ -0,0 +1,179 @@
+import pytest
+
+from utils.memory_budget import MemoryManager, MemoryUsage, host_memory_limit, process_rss
+
+# A 10x10 output keeps the per-image estimates small: 380 kB resident, 330 kB with attention
+# slicing, 150 kB with VAE tiling as well (see UNET_BYTES_PER_PIXEL and VAE_BYTES_PER_PIXEL)
+IMAGE_SIZE = (10, 10)
+IMAGE_BYTES = {'none': 380_000, 'slicing': 330_000, 'tiling': 150_000}
+
+COMPONENT_BYTES = {'unet': 1_000_000, 'vae': 200_000, 'text_encoder': 300_000}
+MODEL_BYTES = sum(COMPONENT_BYTES.values())
+
+
+class FakeTensor:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def numel(self):
+        return self.nbytes
+
+    def element_size(self):
+        return 1
+
+
+class FakeModule:
+    def __init__(self, nbytes):
+        self._parameters = [FakeTensor(nbytes)]
+
+    def parameters(self):
+        return self._parameters
+
+    def buffers(self):
+        return []
+
+
+class FakeVae(FakeModule):
+    tiling = False
+
+    def enable_tiling(self):
+        self.tiling = True
+
+
+class FakePipe:
+    """Pipeline stand-in: components with parameter sizes, recording what was enabled"""
+
+    def __init__(self):
+        self.vae = FakeVae(COMPONENT_BYTES['vae'])
+        self.components = {
+            'unet': FakeModule(COMPONENT_BYTES['unet']),
+            'vae': self.vae,
+            'text_encoder': FakeModule(COMPONENT_BYTES['text_encoder']),
+            'scheduler': object()
+        }
+        self.attention_slicing = False
+
+    def enable_attention_slicing(self):
+        self.attention_slicing = True
+
+
+def plan(budget, offload='auto', max_batch_size=4):
+    manager = MemoryManager(budget_bytes=budget, offload=offload, max_batch_size=max_batch_size)
+    return manager, manager.plan_pipeline(FakePipe(), 'cuda', IMAGE_SIZE)
+
+
+def placement(memory_plan):
+    return memory_plan.offload, memory_plan.attention_slicing, memory_plan.vae_tiling
+
+
+@pytest.mark.parametrize('budget, expected', [
+    (MODEL_BYTES + 4 * IMAGE_BYTES['none'], ('none', False, False)),
+    (MODEL_BYTES + 4 * IMAGE_BYTES['slicing'], ('none', True, False)),
+    (MODEL_BYTES + 4 * IMAGE_BYTES['tiling'], ('none', True, True)),
+    (COMPONENT_BYTES['unet'] + 4 * IMAGE_BYTES['tiling'], ('model', True, True)),
+    (4 * IMAGE_BYTES['tiling'], ('sequential', True, True)),
+])
+def test_picks_the_cheapest_placement_that_fits_a_full_batch(budget, expected):
+    manager, memory_plan = plan(budget)
+
+    assert placement(memory_plan) == expected
+    assert memory_plan.max_batch_size == 4
+    assert memory_plan.fits
+    assert manager.model_bytes == MODEL_BYTES
+    assert manager.components == COMPONENT_BYTES
+
+
+def test_plans_a_smaller_batch_when_no_placement_fits_the_configured_one():
+    _, memory_plan = plan(2 * IMAGE_BYTES['tiling'])
+
+    assert placement(memory_plan) == ('sequential', True, True)
+    assert memory_plan.max_batch_size == 2
+
+
+def test_nothing_fitting_runs_one_request_at_a_time_with_the_smallest_placement():
+    _, memory_plan = plan(IMAGE_BYTES['tiling'] // 2)
+
+    assert not memory_plan.fits
+    assert memory_plan.max_batch_size == 1
+    assert placement(memory_plan) == ('sequential', True, True)
+
+
+def test_forced_offload_limits_the_placements():
+    _, memory_plan = plan(10 * MODEL_BYTES, offload='model')
+
+    assert memory_plan.offload == 'model'
+
+
+def test_cpu_plans_never_offload():
+    budget = process_rss() + 4 * IMAGE_BYTES['tiling'] + 50_000_000
+    manager = MemoryManager(budget_bytes=budget, max_batch_size=4)
+    memory_plan = manager.plan_pipeline(FakePipe(), 'cpu', IMAGE_SIZE)
+
+    assert memory_plan.offload == 'none'
+    assert manager.resident > 0
+
+
+def test_apply_enables_slicing_and_tiling():
+    manager, memory_plan = plan(MODEL_BYTES + 4 * IMAGE_BYTES['tiling'])
+    pipe = FakePipe()
+
+    applied = manager.apply(pipe, 'cpu', memory_plan)
+
+    assert applied == ['attention slicing', 'VAE tiling']
+    assert pipe.attention_slicing and pipe.vae.tiling
+
+
+def test_measured_batches_replace_the_estimate_and_set_the_limit():
+    manager, memory_plan = plan(MODEL_BYTES + 4 * IMAGE_BYTES['none'])
+    assert memory_plan.max_batch_size == 4
+
+    # Two images needed 1 MB each: only two fit next to the model
+    usage = MemoryUsage(MODEL_BYTES)
+    usage.peak = MODEL_BYTES + 2_000_000
+    assert manager.observe(usage, batch_size=2) == 1
+
+    # A lighter batch later does not loosen the limit
+    usage = MemoryUsage(MODEL_BYTES)
+    usage.peak = MODEL_BYTES + 100_000
+    assert manager.observe(usage, batch_size=1) == 1
+
+    report = manager.report()
+    assert report['per_image_measured']
+    assert report['plan']['max_batch_size'] == 1
+
+
+def test_observations_without_working_memory_keep_the_plan():
+    manager, memory_plan = plan(MODEL_BYTES + 4 * IMAGE_BYTES['none'])
+
+    assert manager.observe(MemoryUsage(MODEL_BYTES), batch_size=4) == 4
+    assert not manager.measured
+
+
+def test_model_capacity_sets_aside_a_full_batch():
+    manager, memory_plan = plan(MODEL_BYTES + 4 * IMAGE_BYTES['none'])
+
+    assert manager.model_capacity() == MODEL_BYTES
+
+
+def test_tracks_peak_process_memory_on_cpu():
+    manager = MemoryManager(budget_bytes=1 << 40)
+    manager.device = 'cpu'
+
+    with manager.track() as usage:
+        block = bytearray(16 * 1024 * 1024)
+        block[::4096] = b'x' * len(block[::4096])
+
+    assert usage.peak >= usage.baseline
+    assert usage.working >= 0
+
+
+def test_host_memory_limit_is_positive():
+    limit = host_memory_limit()
+
+    assert limit is None or limit > 0
+
+
+@pytest.mark.parametrize('kwargs', [{'offload': 'disk'}, {'headroom': 1.0}, {'headroom': -0.1}])
+def test_rejects_invalid_settings(kwargs):
+    with pytest.raises(ValueError):
+        MemoryManager(**kwargs)
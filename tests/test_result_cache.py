@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from utils.result_cache import ResultCache
+
+
+def solid(color, size=(16, 16)):
+    return Image.new('RGB', size, color)
+
+
+def entry_bytes(image):
+    """Memory used by one cached image"""
+    cache = ResultCache(max_bytes=1 << 20)
+    cache.put('probe', image)
+    return cache.stats()['bytes']
+
+
+def test_returns_a_stored_result_and_counts_hits_and_misses():
+    cache = ResultCache(max_bytes=1 << 20)
+    image = Image.fromarray(np.arange(16 * 16 * 3, dtype=np.uint8).reshape(16, 16, 3))
+    cache.put('key', image)
+
+    assert cache.get('missing') is None
+    cached = cache.get('key')
+
+    assert np.array_equal(np.asarray(cached), np.asarray(image))
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_evicts_the_least_recently_used_entry():
+    sizes = {color: entry_bytes(solid(color)) for color in ('red', 'green', 'blue')}
+    # Room for 'a' with either of the others, never all three
+    limit = sizes['red'] + max(sizes['green'], sizes['blue'])
+    cache = ResultCache(max_bytes=limit)
+    cache.put('a', solid('red'))
+    cache.put('b', solid('green'))
+    cache.get('a')
+    cache.put('c', solid('blue'))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.stats()['bytes'] <= limit
+
+
+def test_replacing_a_key_does_not_double_count_its_bytes():
+    cache = ResultCache(max_bytes=1 << 20)
+    cache.put('key', solid('red'))
+    cache.put('key', solid('red'))
+
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['bytes'] == entry_bytes(solid('red'))
+
+
+def test_skips_results_larger_than_the_memory_tier():
+    cache = ResultCache(max_bytes=10)
+    cache.put('key', solid('red'))
+
+    assert cache.get('key') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_disk_tier_survives_a_restart_and_is_promoted_to_memory(tmp_path):
+    ResultCache(max_bytes=1 << 20, disk_dir=str(tmp_path)).put('abcdef', solid('red'))
+    assert os.path.exists(tmp_path / 'ab' / 'abcdef.png')
+    assert not [name for name in os.listdir(tmp_path / 'ab') if name.endswith('.tmp')]
+
+    restarted = ResultCache(max_bytes=1 << 20, disk_dir=str(tmp_path))
+    cached = restarted.get('abcdef')
+
+    assert cached.getpixel((0, 0)) == (255, 0, 0)
+    assert restarted.stats()['entries'] == 1
+
+
+def test_disk_only_cache_is_enabled(tmp_path):
+    assert not ResultCache(max_bytes=0).enabled
+    assert ResultCache(max_bytes=0, disk_dir=str(tmp_path)).enabled
+
+
+def test_key_depends_on_pixels_prompt_and_parameters():
+    person, clothing = solid('red'), solid('blue')
+    key = ResultCache.make_key(person, clothing, 'a prompt', steps=20)
+
+    assert key == ResultCache.make_key(solid('red'), solid('blue'), 'a prompt', steps=20)
+    assert key != ResultCache.make_key(solid('green'), clothing, 'a prompt', steps=20)
+    assert key != ResultCache.make_key(person, clothing, 'another prompt', steps=20)
+    assert key != ResultCache.make_key(person, clothing, 'a prompt', steps=30)
+    assert key != ResultCache.make_key(person, 'digest-of-clothing', 'a prompt', steps=20)
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+from utils.result_store import ResultStore, deliver_result, inline_result, result_delivery
+
+
+def encoded(data=b'\x89PNG result bytes', image_format='png'):
+    """Encoded result dict as produced by EncoderPool"""
+    return {'data': data, 'format': image_format, 'mime_type': f'image/{image_format}'}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path), ttl=60, base_url='/results/')
+
+
+def test_stores_results_under_the_hash_of_their_bytes(store):
+    stored = store.put(encoded())
+    key = hashlib.sha256(encoded()['data']).hexdigest()
+
+    assert stored == {'name': f'{key}.png', 'url': f'/results/{key}.png', 'etag': key}
+    entry = store.lookup(stored['name'])
+    assert entry['etag'] == key
+    assert entry['mime_type'] == 'image/png'
+    assert 0 < entry['max_age'] <= 60
+    with open(entry['path'], 'rb') as f:
+        assert f.read() == encoded()['data']
+
+
+def test_storing_the_same_result_again_keeps_one_file(store, tmp_path):
+    first = store.put(encoded())
+    second = store.put(encoded())
+
+    assert first == second
+    files = [name for _, _, names in os.walk(tmp_path) for name in names]
+    assert files == [first['name']]
+
+
+@pytest.mark.parametrize('name', ['../secret.png', 'abc.png', f"{'0' * 64}.gif", f"{'A' * 64}.png"])
+def test_rejects_names_the_store_never_produces(store, name):
+    assert store.lookup(name) is None
+
+
+def test_expired_results_are_not_served_and_are_swept(store):
+    stored = store.put(encoded())
+    path = store.lookup(stored['name'])['path']
+    past = time.time() - 120
+    os.utime(path, (past, past))
+
+    assert store.lookup(stored['name']) is None
+    assert store.sweep() == 1
+    assert not os.path.exists(path)
+    assert store.stats()['evicted'] == 1
+
+
+def test_delivery_mode_defaults_and_validation():
+    assert result_delivery({}) == 'url'
+    assert result_delivery(None, default='inline') == 'inline'
+    assert result_delivery({'result_delivery': 'INLINE'}) == 'inline'
+    with pytest.raises(ValueError):
+        result_delivery({'result_delivery': 'email'})
+
+
+def test_inline_results_are_base64_or_data_urls():
+    assert inline_result(encoded(b'abc')) == 'YWJj'
+    assert inline_result(encoded(b'abc'), data_url=True) == 'data:image/png;base64,YWJj'
+    assert deliver_result(encoded(b'abc'), 'inline') == {'result_image': 'YWJj'}
+
+
+def test_url_delivery_stores_the_result(store):
+    fields = deliver_result(encoded(), 'url', store)
+
+    assert set(fields) == {'result_url', 'result_etag'}
+    assert store.lookup(fields['result_url'].rsplit('/', 1)[1]) is not None
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'result_store', store)
+    return app.app.test_client()
+
+
+def test_serves_stored_results_with_a_strong_etag(client, store):
+    data = bytes(range(256)) * 4
+    stored = store.put(encoded(data))
+
+    response = client.get(stored['url'])
+
+    assert response.status_code == 200
+    assert response.data == data
+    assert response.mimetype == 'image/png'
+    assert response.headers['ETag'] == f'"{stored["etag"]}"'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'public' in response.headers['Cache-Control']
+
+
+def test_matching_etag_is_not_modified(client, store):
+    stored = store.put(encoded())
+
+    response = client.get(stored['url'], headers={'If-None-Match': f'"{stored["etag"]}"'})
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_range_requests_get_partial_content(client, store):
+    data = bytes(range(256)) * 4
+    stored = store.put(encoded(data))
+
+    response = client.get(stored['url'], headers={'Range': 'bytes=10-19'})
+
+    assert response.status_code == 206
+    assert response.data == data[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(data)}'
+
+
+def test_unknown_results_are_not_found(client):
+    assert client.get(f"/results/{'0' * 64}.png").status_code == 404
@@ -0,0 +1,202 @@
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from utils.admission import DeadlineExceeded, Overloaded
+from utils.shm_transport import (
+    InferenceClient,
+    SlotCache,
+    SlotLayout,
+    SlotPool,
+    error_reply,
+    raise_reply_error,
+    write_result,
+)
+
+# Generous bound for replies, so a slow machine does not fail the tests
+REPLY_TIMEOUT = 5
+
+PERSON_SIZE = (8, 6)
+CLOTHING_SIZE = (4, 4)
+# Room for a result as large as the person image, but no larger
+RESULT_PIXELS = PERSON_SIZE[0] * PERSON_SIZE[1]
+
+
+class StubWorker:
+    """Inference worker on a thread: inverts the person image, or scales it up by ``repeat``
+
+    Each request waits for ``gate`` before it is answered, and the
+    messages it received are kept in ``messages``.
+    """
+
+    def __init__(self, request_queue, reply_queue, layout, repeat=1):
+        self.request_queue = request_queue
+        self.reply_queue = reply_queue
+        self.slots = SlotCache(layout)
+        self.repeat = repeat
+        self.gate = threading.Event()
+        self.gate.set()
+        self.messages = []
+        self.overflow_names = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            message = self.request_queue.get()
+            if message is None:
+                return
+            self.messages.append(message)
+            assert self.gate.wait(REPLY_TIMEOUT)
+
+            slot = self.slots.get(message['slot'])
+            result = 255 - slot.views['person']
+            result = np.repeat(np.repeat(result, self.repeat, axis=0), self.repeat, axis=1)
+            location = write_result(slot, result)
+            if location['overflow']:
+                self.overflow_names.append(location['overflow'])
+            self.reply_queue.put({'id': message['id'], **location, 'details': {'slot': message['slot']}})
+
+    def stop(self):
+        self.request_queue.put(None)
+        self._thread.join(REPLY_TIMEOUT)
+        self.slots.close()
+
+
+@pytest.fixture
+def transport():
+    """Factory of front-end clients, each served by its own stub worker"""
+    created = []
+
+    def make(slots=1, repeat=1):
+        layout = SlotLayout(PERSON_SIZE, CLOTHING_SIZE, RESULT_PIXELS)
+        pool = SlotPool(layout, slots)
+        request_queue, reply_queue = queue.Queue(), queue.Queue()
+        worker = StubWorker(request_queue, reply_queue, layout, repeat)
+        client = InferenceClient(request_queue, reply_queue, 0, pool)
+        created.append((worker, pool))
+        return client, worker, pool
+
+    yield make
+    for worker, pool in created:
+        worker.stop()
+        pool.close()
+
+
+def person_image(value=10):
+    return np.full((PERSON_SIZE[1], PERSON_SIZE[0], 3), value, dtype=np.uint8)
+
+
+def block_exists(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + REPLY_TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, "condition never became true"
+        time.sleep(0.01)
+
+
+def test_result_comes_back_through_the_slot(transport):
+    client, worker, pool = transport()
+    result, details = client.run(person_image(10), timeout=REPLY_TIMEOUT)
+
+    assert np.array_equal(result, person_image(245))
+    assert details['slot'] == pool._slots[0].name
+    assert worker.overflow_names == []
+
+
+def test_slot_is_reused_for_the_next_request(transport):
+    client, worker, pool = transport(slots=1)
+    for value in (10, 20, 30):
+        result, _ = client.run(person_image(value), timeout=REPLY_TIMEOUT)
+        assert result[0, 0, 0] == 255 - value
+
+    assert len({message['slot'] for message in worker.messages}) == 1
+
+
+def test_oversized_result_is_read_from_a_block_that_is_then_removed(transport):
+    client, worker, _ = transport(repeat=2)
+    result, _ = client.run(person_image(10), timeout=REPLY_TIMEOUT)
+
+    assert result.shape == (PERSON_SIZE[1] * 2, PERSON_SIZE[0] * 2, 3)
+    assert (result == 245).all()
+    assert len(worker.overflow_names) == 1
+    assert not block_exists(worker.overflow_names[0])
+
+
+def test_abandoned_request_keeps_its_slot_until_the_reply_arrives(transport):
+    client, worker, _ = transport(slots=1)
+    worker.gate.clear()
+
+    with pytest.raises(DeadlineExceeded):
+        client.run(person_image(), timeout=0.05)
+    # The worker may still write into the slot, so it is not handed out again yet
+    with pytest.raises(Overloaded):
+        client.run(person_image(), timeout=0.05)
+
+    worker.gate.set()
+    wait_until(lambda: client.pool._free.qsize() == 1)
+    result, _ = client.run(person_image(20), timeout=REPLY_TIMEOUT)
+    assert result[0, 0, 0] == 235
+
+
+def test_abandoned_oversized_result_is_removed(transport):
+    client, worker, _ = transport(repeat=2)
+    worker.gate.clear()
+
+    with pytest.raises(DeadlineExceeded):
+        client.run(person_image(), timeout=0.05)
+    worker.gate.set()
+
+    wait_until(lambda: client.pool._free.qsize() == 1)
+    assert len(worker.overflow_names) == 1
+    assert not block_exists(worker.overflow_names[0])
+
+
+def test_without_a_timeout_a_busy_pool_rejects_at_once(transport):
+    client, worker, _ = transport(slots=1)
+    worker.gate.clear()
+    first = threading.Thread(target=lambda: client.run(person_image(), timeout=REPLY_TIMEOUT))
+    first.start()
+    wait_until(lambda: worker.messages)
+
+    started = time.monotonic()
+    with pytest.raises(Overloaded):
+        client.run(person_image())
+    assert time.monotonic() - started < 1
+
+    worker.gate.set()
+    first.join(REPLY_TIMEOUT)
+
+
+def test_message_carries_an_absolute_deadline(transport):
+    client, worker, _ = transport()
+    before = time.time()
+    client.run(person_image(), fields={'prompt': 'p'}, timeout=30)
+
+    message = worker.messages[0]
+    assert before + 30 <= message['deadline'] <= time.time() + 30
+    assert message['prompt'] == 'p'
+
+
+@pytest.mark.parametrize('error', [
+    Overloaded("busy", retry_after=3),
+    DeadlineExceeded("too late"),
+    RuntimeError("broken"),
+])
+def test_error_replies_raise_the_same_kind(error):
+    reply = error_reply(7, error)
+
+    with pytest.raises(type(error), match=str(error)):
+        raise_reply_error(reply)
@@ -0,0 +1,193 @@
+"""Request deadlines, cancellation and deadline-aware admission control
+
+A ``CancelToken`` travels with a request through the batch scheduler into
+the pipeline's step callback, which checks it between denoising steps.
+The ``AdmissionController`` estimates how long new work would wait from
+the observed time per unit of denoising work, and sheds requests that
+could not finish before their deadline.
+"""
+import math
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """The request was cancelled before it finished"""
+
+
+class DeadlineExceeded(Cancelled):
+    """The request's deadline passed before it finished"""
+
+
+class Overloaded(Exception):
+    """New work was rejected; ``retry_after`` is a suggested wait in seconds"""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CancelToken:
+    """Cancellation flag and optional deadline of one request
+
+    ``timeout`` is in seconds from now; ``None`` or 0 means no deadline.
+    ``event`` lets an owner, such as a job, share its own cancel flag.
+    """
+
+    def __init__(self, timeout=None, event=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._event = event or threading.Event()
+
+    @classmethod
+    def until(cls, deadline, event=None):
+        """Token for an absolute ``time.time()`` deadline, e.g. one set by another process; None means none"""
+        token = cls(event=event)
+        if deadline is not None:
+            token.deadline = time.monotonic() + (deadline - time.time())
+        return token
+
+    @property
+    def event(self):
+        """The underlying flag, for owners that cancel through it"""
+        return self._event
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    @property
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def done(self):
+        """Whether the request should stop, either way"""
+        return self.cancelled or self.expired
+
+    def remaining(self):
+        """Seconds until the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """Raise Cancelled or DeadlineExceeded if the request should stop"""
+        if self.cancelled:
+            raise Cancelled("Request was cancelled")
+        if self.expired:
+            raise DeadlineExceeded("Request deadline exceeded")
+
+
+class AdmissionTicket:
+    """Outstanding work of one admitted request, released when it finishes"""
+
+    def __init__(self, controller, work):
+        self.controller = controller
+        self.work = work
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self.work)
+
+
+class AdmissionController:
+    """Admit or shed requests based on estimated queue time
+
+    Work is counted in UNet evaluations per request (steps, doubled with
+    classifier-free guidance). ``observe`` feeds an exponential moving
+    average of seconds per unit of work for a pipeline call. Up to
+    ``max_batch_size`` requests share each call, so the wait for new work
+    is estimated as outstanding work x seconds per unit / batch size.
+
+    A request is rejected when its estimated wait plus its own run time
+    passes its deadline, or when ``max_queue`` requests are already
+    outstanding (0 disables that limit). Until a first batch has been
+    observed, only ``max_queue`` applies.
+    """
+
+    def __init__(self, max_batch_size=1, max_queue=0, smoothing=0.2):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_queue = max(0, int(max_queue))
+        self.smoothing = smoothing
+
+        self.seconds_per_unit = None
+        self._outstanding_work = 0
+        self._outstanding_requests = 0
+        self._lock = threading.Lock()
+
+        self.admitted = 0
+        self.rejected = 0
+
+    def observe(self, work, seconds):
+        """Record that ``work`` units of a pipeline call took ``seconds``"""
+        if work <= 0 or seconds <= 0:
+            return
+        sample = seconds / work
+        with self._lock:
+            if self.seconds_per_unit is None:
+                self.seconds_per_unit = sample
+            else:
+                self.seconds_per_unit += self.smoothing * (sample - self.seconds_per_unit)
+
+    def estimate_wait(self):
+        """Estimated seconds before newly admitted work starts running"""
+        with self._lock:
+            return self._estimate_wait()
+
+    def _estimate_wait(self):
+        if self.seconds_per_unit is None:
+            return 0.0
+        return self._outstanding_work * self.seconds_per_unit / self.max_batch_size
+
+    def admit(self, work, token=None):
+        """Admit ``work`` units or raise Overloaded; returns a ticket to release when done"""
+        with self._lock:
+            wait = self._estimate_wait()
+
+            if self.max_queue and self._outstanding_requests >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded(
+                    f"Too many requests in progress ({self._outstanding_requests})",
+                    retry_after=self._retry_after(wait)
+                )
+
+            remaining = token.remaining() if token is not None else None
+            if remaining is not None and self.seconds_per_unit is not None:
+                estimate = wait + work * self.seconds_per_unit
+                if estimate > remaining:
+                    self.rejected += 1
+                    raise Overloaded(
+                        f"Estimated completion in {estimate:.1f}s exceeds the {remaining:.1f}s deadline",
+                        retry_after=self._retry_after(wait)
+                    )
+
+            self._outstanding_work += work
+            self._outstanding_requests += 1
+            self.admitted += 1
+            return AdmissionTicket(self, work)
+
+    def _retry_after(self, wait):
+        # Roughly when the current backlog will have drained
+        return max(1, math.ceil(wait))
+
+    def _release(self, work):
+        with self._lock:
+            self._outstanding_work = max(0, self._outstanding_work - work)
+            self._outstanding_requests = max(0, self._outstanding_requests - 1)
+
+    def stats(self):
+        """Outstanding work, the latency estimate and admit/reject counters"""
+        with self._lock:
+            return {
+                'outstanding_requests': self._outstanding_requests,
+                'outstanding_work': self._outstanding_work,
+                'seconds_per_unit': self.seconds_per_unit,
+                'estimated_wait': round(self._estimate_wait(), 3),
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,436 @@
+"""Try-on backends behind one interface, and a registry that loads them on demand
+
+Requests name a backend with a ``model`` field. A backend can be:
+
+- ``blend``: alpha blend of person and garment (the basic RunPod handler)
+- ``overlay``: NumPy compositing of the garment onto the person (the ultra handler)
+- a diffusion variant: an SDXL-style pipeline identified by its model id
+
+Blend and overlay are cheap and always loaded. Diffusion pipelines are
+loaded when first requested and kept in an LRU. When a newly loaded
+pipeline pushes the total past the registry's memory cap, the least
+recently used ones are unloaded. The default backend is never unloaded.
+
+Variants that name the same ``components_from`` model share its VAE, text
+encoders and tokenizers. Those modules are loaded once and held by the
+registry for as long as any variant uses them, so a variant only adds the
+memory of its own UNet.
+"""
+import gc
+import sys
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from utils.memory_budget import component_bytes, module_bytes
+
+# Pipeline components reused across variants built on the same base model
+SHARED_COMPONENT_NAMES = ('vae', 'text_encoder', 'text_encoder_2', 'tokenizer', 'tokenizer_2')
+
+
+class Backend:
+    """Interface of a try-on backend
+
+    ``render_batch`` takes a list of dicts with ``person_image`` and
+    ``clothing_image`` (plus backend-specific fields) and returns one
+    result image per item. ``batched`` backends are expensive enough to
+    be run through the batch scheduler; the others run on the caller's
+    thread. ``params`` are the settings that determine the output, for
+    result cache keys.
+    """
+
+    batched = False
+    person_size = (512, 768)
+    clothing_size = (512, 512)
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def loaded(self):
+        return True
+
+    def load(self):
+        return self
+
+    def unload(self):
+        pass
+
+    def memory_bytes(self):
+        """Memory held by this backend alone, excluding shared components"""
+        return 0
+
+    def params(self):
+        return {'backend': self.name}
+
+    def render(self, person_image, clothing_image):
+        return self.render_batch([{'person_image': person_image, 'clothing_image': clothing_image}])[0]
+
+    def render_batch(self, items):
+        raise NotImplementedError
+
+    def describe(self):
+        return {'kind': type(self).__name__, 'loaded': self.loaded, 'batched': self.batched}
+
+
+class BlendBackend(Backend):
+    """Alpha blend of the person and garment images at one size"""
+
+    def __init__(self, name='blend', size=(512, 768), alpha=0.3):
+        super().__init__(name)
+        self.size = tuple(size)
+        self.alpha = alpha
+        self.person_size = self.clothing_size = self.size
+
+    def params(self):
+        return {'backend': self.name, 'size': self.size, 'alpha': self.alpha}
+
+    def render_batch(self, items):
+        return [
+            Image.blend(item['person_image'].resize(self.size), item['clothing_image'].resize(self.size), self.alpha)
+            for item in items
+        ]
+
+
+class OverlayBackend(Backend):
+    """Garment composited onto the person with utils.compositing.Compositor
+
+    ``clothing_image`` may also be a catalog garment id, read from
+    ``catalog`` together with its precomputed mask. ``alpha_mode`` is
+    ``constant`` (alpha over the whole garment square) or ``mask`` (alpha
+    only on garment pixels found on a white background).
+    """
+
+    def __init__(self, name='overlay', catalog=None, target_size=(512, 768), clothing_size=(512, 512),
+                 position=(0, 128), alpha=180, alpha_mode='constant', contrast=1.1, color=1.05):
+        from utils.compositing import Compositor
+
+        super().__init__(name)
+        self.catalog = catalog
+        self.person_size = tuple(target_size)
+        self.clothing_size = tuple(clothing_size)
+        self.position = tuple(position)
+        self.alpha = alpha
+        self.alpha_mode = alpha_mode
+        self.contrast = contrast
+        self.color = color
+
+        # The compositor keeps working buffers between calls, so calls are serialized
+        self._compositor = Compositor(position=position, alpha=alpha, contrast=contrast, color=color)
+        self._lock = threading.Lock()
+
+    def params(self):
+        return {
+            'backend': self.name,
+            'target_size': self.person_size,
+            'clothing_size': self.clothing_size,
+            'position': self.position,
+            'alpha': self.alpha,
+            'alpha_mode': self.alpha_mode,
+            'contrast': self.contrast,
+            'color': self.color
+        }
+
+    def catalog_clothing(self, garment_id):
+        """Catalog garment and its mask as arrays at clothing_size
+
+        These are views of the memory-mapped store, with no copy, unless the
+        catalog was built at a different size.
+        """
+        import numpy as np
+
+        if self.catalog is None:
+            raise ValueError("garment_id given but no garment catalog is configured")
+
+        clothing = self.catalog.array(garment_id)
+        mask = self.catalog.mask(garment_id)
+
+        if self.catalog.size != self.clothing_size:
+            clothing = np.asarray(Image.fromarray(clothing).resize(self.clothing_size, Image.Resampling.LANCZOS))
+            mask = np.asarray(Image.fromarray(mask).resize(self.clothing_size, Image.Resampling.LANCZOS))
+
+        return clothing, mask
+
+    def render_batch(self, items):
+        return [self._render(item['person_image'], item['clothing_image']) for item in items]
+
+    def _render(self, person_image, clothing_image):
+        import numpy as np
+        from utils.compositing import garment_mask
+
+        # Images are normally decoded at these sizes already
+        person = np.asarray(_resize_to(person_image, self.person_size))
+
+        if isinstance(clothing_image, str):
+            clothing, mask = self.catalog_clothing(clothing_image)
+        else:
+            clothing = np.asarray(_resize_to(clothing_image, self.clothing_size))
+            mask = None
+
+        if self.alpha_mode != 'mask':
+            mask = None
+        elif mask is None:
+            mask = garment_mask(clothing)
+
+        # Overlay, alpha and contrast/color enhancement in one pass
+        with self._lock:
+            return Image.fromarray(self._compositor.composite(person, clothing, mask))
+
+
+class DiffusionBackend(Backend):
+    """A diffusion pipeline variant, loaded on demand
+
+    ``load_pipeline(backend, shared)`` loads the pipeline and sets
+    ``backend.pipe``, ``backend.scheduler_switcher`` and
+    ``backend.prompt_cache``; ``shared`` holds the components to reuse, if
+    any. ``run_batch(backend, items)`` runs a batch through it. Both come
+    from the app, which owns device placement and the denoising loop.
+    """
+
+    batched = True
+
+    def __init__(self, name, model_id, load_pipeline, run_batch, components_from=None,
+                 person_size=(512, 768), clothing_size=(512, 512)):
+        super().__init__(name)
+        self.model_id = model_id
+        self.components_from = components_from or model_id
+        self.person_size = tuple(person_size)
+        self.clothing_size = tuple(clothing_size)
+
+        self._load_pipeline = load_pipeline
+        self._run_batch = run_batch
+
+        self.pipe = None
+        self.scheduler_switcher = None
+        self.prompt_cache = None
+        self.shared_names = ()
+        self.last_bytes = None
+
+    @property
+    def loaded(self):
+        return self.pipe is not None
+
+    def load(self, shared=None):
+        if self.pipe is None:
+            self._load_pipeline(self, shared or {})
+            self.last_bytes = self.memory_bytes()
+        return self
+
+    def use_shared(self, shared):
+        """Record which of ``shared`` this pipeline holds, so they are not counted as its own"""
+        components = self.pipe.components
+        self.shared_names = tuple(name for name, component in shared.items() if components.get(name) is component)
+        self.last_bytes = self.memory_bytes()
+
+    def unload(self):
+        self.pipe = None
+        self.scheduler_switcher = None
+        self.prompt_cache = None
+        self.shared_names = ()
+
+    def memory_bytes(self):
+        if self.pipe is None:
+            return 0
+        sizes = component_bytes(self.pipe)
+        return sum(size for name, size in sizes.items() if name not in self.shared_names)
+
+    def params(self):
+        return {'backend': self.name, 'model': self.model_id}
+
+    def render_batch(self, items):
+        return self._run_batch(self, items)
+
+    def describe(self):
+        return {
+            **super().describe(),
+            'model_id': self.model_id,
+            'components_from': self.components_from,
+            'shared_components': list(self.shared_names)
+        }
+
+
+class SharedComponents:
+    """Components loaded once per base model and reused by every variant built on it"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, source_id):
+        """Shared components of ``source_id``, or None if not loaded"""
+        with self._lock:
+            entry = self._entries.get(source_id)
+            return dict(entry['components']) if entry is not None else None
+
+    def put(self, source_id, components):
+        """Keep the shareable ones of ``components`` (e.g. ``pipe.components``) for ``source_id``"""
+        shared = {name: components[name] for name in SHARED_COMPONENT_NAMES if components.get(name) is not None}
+        with self._lock:
+            entry = self._entries.setdefault(source_id, {'components': shared, 'users': set()})
+            return dict(entry['components'])
+
+    def acquire(self, source_id, user):
+        with self._lock:
+            self._entries[source_id]['users'].add(user)
+
+    def release(self, user):
+        """Drop ``user``'s hold; components no variant uses any more are freed"""
+        with self._lock:
+            for source_id, entry in list(self._entries.items()):
+                entry['users'].discard(user)
+                if not entry['users']:
+                    del self._entries[source_id]
+
+    def memory_bytes(self):
+        with self._lock:
+            modules = [
+                component for entry in self._entries.values() for component in entry['components'].values()
+                if hasattr(component, 'parameters')
+            ]
+        return sum(module_bytes(module) for module in modules)
+
+    def describe(self):
+        with self._lock:
+            return {
+                source_id: {'components': list(entry['components']), 'users': sorted(entry['users'])}
+                for source_id, entry in self._entries.items()
+            }
+
+
+class BackendRegistry:
+    """Named backends, with loaded diffusion pipelines kept in an LRU under ``max_bytes``
+
+    ``max_bytes`` of 0 means no cap. ``share_components`` can be turned off
+    where sharing modules between pipelines is unsafe, e.g. with CPU
+    offload hooks, which are installed per pipeline.
+    """
+
+    def __init__(self, default, max_bytes=0):
+        self.default = default
+        self.max_bytes = max(0, int(max_bytes))
+        self.share_components = True
+        self.shared = SharedComponents()
+
+        self._backends = {}
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+        self.loads = 0
+        self.evictions = 0
+
+    def register(self, backend):
+        with self._lock:
+            self._backends[backend.name] = backend
+            if backend.loaded and not backend.batched:
+                self._loaded[backend.name] = backend
+        return backend
+
+    def get(self, name=None):
+        """The backend called ``name`` (loaded or not), or the default if ``name`` is empty"""
+        name = name or self.default
+        with self._lock:
+            backend = self._backends.get(name)
+        if backend is None:
+            raise ValueError(f"Unknown model: {name} (expected one of {', '.join(self.names())})")
+        return backend
+
+    def names(self):
+        with self._lock:
+            return list(self._backends)
+
+    def acquire(self, name=None):
+        """The backend called ``name``, loaded, and marked most recently used
+
+        Loading evicts least recently used pipelines to stay under the cap.
+        Callers must not use a pipeline concurrently with loads of others:
+        the app only acquires pipelines on its batch worker.
+        """
+        backend = self.get(name)
+        with self._lock:
+            if backend.name in self._loaded:
+                self._loaded.move_to_end(backend.name)
+                return backend
+
+        with self._load_lock:
+            if not backend.loaded:
+                # Make room for what it took last time, or for the largest loaded pipeline
+                estimate = backend.last_bytes or max(
+                    (loaded.memory_bytes() for loaded in self._loaded_pipelines()), default=0
+                )
+                self._evict(estimate, keep=backend.name)
+
+                shared = None
+                if self.share_components:
+                    shared = self.shared.get(backend.components_from)
+                backend.load(shared)
+                if self.share_components:
+                    backend.use_shared(self.shared.put(backend.components_from, backend.pipe.components))
+                    self.shared.acquire(backend.components_from, backend.name)
+                self.loads += 1
+
+            with self._lock:
+                self._loaded[backend.name] = backend
+                self._loaded.move_to_end(backend.name)
+            self._evict(0, keep=backend.name)
+        return backend
+
+    def unload(self, name):
+        """Unload a diffusion backend now; returns whether it was loaded"""
+        backend = self.get(name)
+        with self._lock:
+            if not backend.batched or self._loaded.pop(backend.name, None) is None:
+                return False
+        backend.unload()
+        self.shared.release(backend.name)
+        _release_memory()
+        return True
+
+    def memory_bytes(self):
+        """Memory of all loaded pipelines, counting shared components once"""
+        return sum(backend.memory_bytes() for backend in self._loaded_pipelines()) + self.shared.memory_bytes()
+
+    def describe(self):
+        with self._lock:
+            backends = dict(self._backends)
+            order = list(self._loaded)
+        return {
+            'default': self.default,
+            'max_bytes': self.max_bytes,
+            'loaded': [name for name in order if backends[name].batched],
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'backends': {name: backend.describe() for name, backend in backends.items()},
+            'shared_components': self.shared.describe()
+        }
+
+    def _loaded_pipelines(self):
+        with self._lock:
+            return [backend for backend in self._loaded.values() if backend.batched]
+
+    def _evict(self, incoming, keep):
+        """Unload least recently used pipelines until ``incoming`` more bytes fit under the cap"""
+        if not self.max_bytes:
+            return
+        for backend in self._loaded_pipelines():
+            if self.memory_bytes() + incoming <= self.max_bytes:
+                return
+            if backend.name in (keep, self.default):
+                continue
+            self.unload(backend.name)
+            self.evictions += 1
+
+
+def _resize_to(image, size):
+    """Resize image to size unless it already has that size"""
+    if image.size == tuple(size):
+        return image
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+def _release_memory():
+    gc.collect()
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
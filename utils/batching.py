@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchRequest:
+    """A single queued request waiting to be batched"""
+
+    __slots__ = ('item', 'future', 'enqueued_at')
+
+    def __init__(self, item):
+        self.item = item
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchScheduler:
+    """Collect concurrent requests and run them through one batched call
+
+    Requests are gathered for up to ``max_wait`` seconds after the first one
+    arrives, or until ``max_batch_size`` are waiting, then handed to
+    ``process_batch`` as a list. ``process_batch`` must return one output per
+    input, in the same order. Each caller's future resolves to
+    ``(output, info)`` where ``info`` holds the batch size and the time the
+    request spent in the queue. An output that is an exception is raised to
+    that caller alone; an exception raised by ``process_batch`` itself fails
+    the whole batch.
+
+    ``check_item``, if given, is called on each item just before its batch
+    runs; an item for which it raises (e.g. because its deadline passed) is
+    dropped from the batch and its future gets the exception.
+    """
+
+    def __init__(self, process_batch, max_batch_size=4, max_wait=0.05, name='batch-scheduler',
+                 check_item=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait)
+        self.name = name
+        self.check_item = check_item
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stopped = False
+
+    def start(self):
+        """Start the background worker thread if it is not running yet"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stopped = False
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def stop(self, timeout=None):
+        """Stop the worker after the current batch finishes"""
+        with self._lock:
+            self._stopped = True
+            worker = self._worker
+        self._queue.put(None)
+        if worker is not None:
+            worker.join(timeout)
+
+    def submit(self, item):
+        """Queue an item and return a future for its ``(output, info)`` pair"""
+        if self._stopped:
+            raise RuntimeError("Batch scheduler has been stopped")
+
+        self.start()
+        request = BatchRequest(item)
+        self._queue.put(request)
+        return request.future
+
+    def queue_depth(self):
+        """Approximate number of requests waiting to be batched"""
+        return self._queue.qsize()
+
+    def _collect(self, first):
+        """Gather a batch starting with ``first``"""
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    request = self._queue.get(timeout=remaining)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if request is None:
+                # Stop sentinel: run what we have, then exit
+                self._queue.put(None)
+                break
+            batch.append(request)
+
+        return batch
+
+    def _check(self, request):
+        try:
+            self.check_item(request.item)
+        except Exception as e:
+            request.future.set_exception(e)
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            batch = self._collect(first)
+            started_at = time.perf_counter()
+
+            # Skip requests whose callers have already given up
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if self.check_item is not None:
+                batch = [request for request in batch if self._check(request)]
+            if not batch:
+                continue
+
+            try:
+                outputs = self.process_batch([request.item for request in batch])
+                if len(outputs) != len(batch):
+                    raise RuntimeError(
+                        f"Batch function returned {len(outputs)} results for {len(batch)} requests"
+                    )
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            for request, output in zip(batch, outputs):
+                if isinstance(output, BaseException):
+                    request.future.set_exception(output)
+                    continue
+                request.future.set_result((output, {
+                    'batch_size': len(batch),
+                    'queue_wait': started_at - request.enqueued_at
+                }))
@@ -0,0 +1,115 @@
+import numpy as np
+
+from utils.image_utils import LUMA_WEIGHTS, _as_image_batch, create_mask
+
+
+def garment_mask(garments, threshold=240):
+    """Per-pixel alpha (0-255) separating garments from a white background
+
+    Wraps ``utils.image_utils.create_mask`` for an (h, w, 3) garment or an
+    (N, h, w, 3) batch. OpenCV is only imported when a mask is requested.
+    """
+    from PIL import Image
+
+    batch, single = _as_image_batch(garments)
+    masks = np.stack([
+        np.asarray(create_mask(Image.fromarray(np.ascontiguousarray(garment, dtype=np.uint8)), threshold))
+        for garment in batch
+    ])
+    return masks[0] if single else masks
+
+
+class Compositor:
+    """Overlay garments onto a person image with alpha, contrast and color in one pass
+
+    Equivalent to pasting a garment with a constant or per-pixel alpha and
+    then applying ImageEnhance.Contrast and Color, but done on NumPy arrays
+    in float32 working buffers that are kept between calls. Contrast and
+    color are folded into a single affine step once the composite's mean
+    luma is known. Only the returned array is allocated per call, so an
+    instance must not be shared between threads.
+    """
+
+    def __init__(self, position=(0, 0), alpha=255, contrast=1.0, color=1.0):
+        self.position = tuple(position)
+        self.alpha = alpha
+        self.contrast = contrast
+        self.color = color
+        self._buffers = {}
+
+    def _buffer(self, name, shape):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[name] = np.empty(shape, dtype=np.float32)
+        return buffer
+
+    def composite(self, person, garments, mask=None, out=None):
+        """Composite one garment, or a batch of garments, onto a person image
+
+        ``person`` is an (H, W, 3) uint8 RGB array and ``garments`` an
+        (h, w, 3) array or (N, h, w, 3) batch, placed at ``position`` and
+        clipped to the person frame. ``mask`` is an optional (h, w) or
+        (N, h, w) uint8 alpha, e.g. from ``garment_mask``, scaled by the
+        constant ``alpha``. Returns (H, W, 3), or (N, H, W, 3) for a batch,
+        written to ``out`` if given.
+        """
+        person = np.asarray(person)
+        if person.ndim != 3 or person.shape[-1] != 3:
+            raise ValueError("Expected person array of shape (H, W, 3)")
+
+        garments, single = _as_image_batch(garments)
+        count = len(garments)
+        height, width = person.shape[:2]
+
+        work = self._buffer('work', (count, height, width, 3))
+        work[...] = person
+
+        # Overlap of the garment with the person frame
+        left, top = self.position
+        x0, y0 = max(left, 0), max(top, 0)
+        x1 = min(left + garments.shape[2], width)
+        y1 = min(top + garments.shape[1], height)
+
+        if x1 > x0 and y1 > y0:
+            region = work[:, y0:y1, x0:x1]
+            source = garments[:, y0 - top:y1 - top, x0 - left:x1 - left]
+
+            # region += (garment - region) * alpha
+            delta = self._buffer('delta', region.shape)
+            np.subtract(source, region, out=delta)
+            if mask is None:
+                delta *= self.alpha / 255.0
+            else:
+                mask = np.asarray(mask)
+                if mask.ndim == 2:
+                    mask = mask[np.newaxis]
+                weight = self._buffer('weight', (mask.shape[0], y1 - y0, x1 - x0, 1))
+                np.multiply(
+                    mask[:, y0 - top:y1 - top, x0 - left:x1 - left, np.newaxis],
+                    self.alpha / (255.0 * 255.0),
+                    out=weight
+                )
+                delta *= weight
+            region += delta
+            # Pasting yields whole uint8 levels, which the enhancement below expects
+            np.rint(region, out=region)
+
+        if self.contrast != 1.0 or self.color != 1.0:
+            luma = self._buffer('luma', (count, height, width))
+            np.matmul(work, LUMA_WEIGHTS, out=luma)
+            # Contrast blends towards the rounded mean luma of the whole image
+            mean = np.floor(luma.mean(axis=(1, 2)) + 0.5)
+
+            # Contrast then color, folded into one affine map:
+            # x' = contrast * (color * x + (1 - color) * luma) + (1 - contrast) * mean
+            luma *= self.contrast * (1.0 - self.color)
+            luma += ((1.0 - self.contrast) * mean)[:, np.newaxis, np.newaxis]
+            work *= self.contrast * self.color
+            work += luma[..., np.newaxis]
+
+        np.clip(work, 0, 255, out=work)
+        result = work[0] if single else work
+        if out is None:
+            out = np.empty(result.shape, dtype=np.uint8)
+        np.copyto(out, result, casting='unsafe')
+        return out
@@ -0,0 +1,193 @@
+"""CPU performance mode for the diffusion pipeline
+
+Hosts without a GPU run the pipeline in float32 by default. With
+``CPU_MODE=fast`` the pipeline is instead prepared with:
+
+- bf16 autocast, when the CPU has native bf16 support
+- dynamic int8 quantization of the ``nn.Linear`` layers of the UNet and text encoders
+- channels-last memory format for the UNet and VAE convolutions
+- optionally, ``torch.compile`` of the UNet
+
+plus explicit intra-/inter-op thread counts. torch is only imported when
+these are applied, like everywhere else in the app.
+"""
+import contextlib
+import functools
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CPU_MODES = ('off', 'fast')
+BF16_MODES = ('auto', 'on', 'off')
+QUANTIZE_MODES = ('none', 'int8')
+
+# Pipeline components whose linear layers are quantized, when present
+QUANTIZE_COMPONENTS = ('unet', 'text_encoder', 'text_encoder_2')
+
+# Components switched to channels-last; both are convolution-heavy
+CHANNELS_LAST_COMPONENTS = ('unet', 'vae')
+
+
+def _flag(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+@functools.lru_cache(maxsize=None)
+def bf16_supported():
+    """Whether this CPU runs bf16 matmuls natively (AVX512-BF16 or AMX)"""
+    import torch
+
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class CpuInferenceOptions:
+    """Resolved CPU performance settings
+
+    ``bf16`` is ``'auto'`` (use it when the CPU supports it), ``'on'`` or
+    ``'off'``. bf16 autocast is not combined with int8 quantization: the
+    dynamically quantized linear layers only take float32 inputs, so
+    ``'auto'`` resolves to off when ``quantize`` is ``'int8'`` and ``'on'``
+    together with ``'int8'`` is rejected. Thread counts of 0 leave torch's
+    defaults in place.
+    """
+
+    def __init__(self, mode='off', bf16='auto', quantize='int8', channels_last=True,
+                 compile=False, compile_mode='reduce-overhead', threads=0, interop_threads=0):
+        mode = str(mode).lower()
+        bf16 = str(bf16).lower()
+        quantize = str(quantize).lower()
+
+        if mode not in CPU_MODES:
+            raise ValueError(f"Unsupported CPU mode: {mode} (expected one of {', '.join(CPU_MODES)})")
+        if bf16 not in BF16_MODES:
+            raise ValueError(f"Unsupported bf16 setting: {bf16} (expected one of {', '.join(BF16_MODES)})")
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Unsupported quantization: {quantize} (expected one of {', '.join(QUANTIZE_MODES)})")
+        if bf16 == 'on' and quantize == 'int8':
+            raise ValueError("bf16 autocast cannot be combined with int8 quantization")
+
+        self.mode = mode
+        self.bf16 = bf16
+        self.quantize = quantize
+        self.channels_last = bool(channels_last)
+        self.compile = bool(compile)
+        self.compile_mode = compile_mode
+        self.threads = max(0, int(threads))
+        self.interop_threads = max(0, int(interop_threads))
+
+    @classmethod
+    def from_env(cls):
+        """Settings from CPU_MODE, CPU_BF16, CPU_QUANTIZE, CPU_CHANNELS_LAST, CPU_COMPILE,
+        CPU_COMPILE_MODE, CPU_THREADS and CPU_INTEROP_THREADS"""
+        return cls(
+            mode=os.environ.get('CPU_MODE', 'off'),
+            bf16=os.environ.get('CPU_BF16', 'auto'),
+            quantize=os.environ.get('CPU_QUANTIZE', 'int8'),
+            channels_last=_flag(os.environ.get('CPU_CHANNELS_LAST', '1')),
+            compile=_flag(os.environ.get('CPU_COMPILE', '0')),
+            compile_mode=os.environ.get('CPU_COMPILE_MODE', 'reduce-overhead'),
+            threads=int(os.environ.get('CPU_THREADS', '0')),
+            interop_threads=int(os.environ.get('CPU_INTEROP_THREADS', '0'))
+        )
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def use_bf16(self):
+        """Whether inference should run under bf16 autocast"""
+        if not self.enabled or self.bf16 == 'off':
+            return False
+        if self.bf16 == 'on':
+            return True
+        return self.quantize == 'none' and bf16_supported()
+
+    def describe(self):
+        """Settings for health reports and logs"""
+        return {
+            'mode': self.mode,
+            'bf16': self.use_bf16() if self.enabled else False,
+            'quantize': self.quantize if self.enabled else 'none',
+            'channels_last': self.enabled and self.channels_last,
+            'compile': self.enabled and self.compile,
+            'threads': self.threads or None,
+            'interop_threads': self.interop_threads or None
+        }
+
+
+def configure_threads(options):
+    """Apply explicit intra-/inter-op thread counts
+
+    Call before the first inference: torch only accepts a new inter-op
+    thread count before any inter-op parallel work has started.
+    """
+    import torch
+
+    if options.threads:
+        torch.set_num_threads(options.threads)
+
+    if options.interop_threads:
+        try:
+            torch.set_num_interop_threads(options.interop_threads)
+        except RuntimeError as e:
+            logger.warning(f"Could not set inter-op threads to {options.interop_threads}: {str(e)}")
+
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def prepare_pipeline(pipe, options):
+    """Apply the CPU performance settings to a float32 pipeline in place
+
+    Returns the names of the optimizations that were applied.
+    """
+    import torch
+
+    applied = []
+    if not options.enabled:
+        return applied
+
+    if options.quantize == 'int8':
+        for name in QUANTIZE_COMPONENTS:
+            module = getattr(pipe, name, None)
+            if module is not None:
+                torch.ao.quantization.quantize_dynamic(
+                    module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+                )
+        applied.append('int8')
+
+    if options.channels_last:
+        for name in CHANNELS_LAST_COMPONENTS:
+            module = getattr(pipe, name, None)
+            if module is not None:
+                module.to(memory_format=torch.channels_last)
+        applied.append('channels_last')
+
+    if options.use_bf16():
+        applied.append('bf16')
+
+    if options.compile:
+        # Compiled lazily on the first call, which the warmup inference pays for
+        pipe.unet = torch.compile(pipe.unet, mode=options.compile_mode, fullgraph=False)
+        applied.append('compile')
+
+    return applied
+
+
+def inference_autocast(device, options=None):
+    """Autocast context for a pipeline call on ``device``
+
+    CUDA keeps float16 autocast. On CPU, autocast only runs when the CPU
+    mode selects bf16; otherwise inference stays in plain float32.
+    """
+    import torch
+
+    if device == 'cpu':
+        if options is not None and options.use_bf16():
+            return torch.autocast('cpu', dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    return torch.autocast(device)
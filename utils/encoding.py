@@ -0,0 +1,126 @@
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Supported output formats: name -> (PIL format, MIME type)
+OUTPUT_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp')
+}
+
+FORMAT_ALIASES = {'jpg': 'jpeg'}
+
+
+def default_output_options():
+    """Per-deployment output settings from OUTPUT_FORMAT, OUTPUT_QUALITY, PNG_COMPRESS_LEVEL and WEBP_METHOD"""
+    return resolve_output_options({
+        'format': os.environ.get('OUTPUT_FORMAT', 'png'),
+        'quality': os.environ.get('OUTPUT_QUALITY', '90'),
+        'compress_level': os.environ.get('PNG_COMPRESS_LEVEL', '6'),
+        'method': os.environ.get('WEBP_METHOD', '4')
+    })
+
+
+def resolve_output_options(overrides=None, defaults=None):
+    """Merge per-request output options over the defaults and validate them"""
+    options = dict(defaults or {'format': 'png', 'quality': 90, 'compress_level': 6, 'method': 4})
+
+    for key, value in (overrides or {}).items():
+        if value is not None and value != '':
+            options[key] = value
+
+    fmt = str(options['format']).lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {options['format']}")
+
+    try:
+        quality = int(options['quality'])
+        compress_level = int(options['compress_level'])
+        method = int(options['method'])
+    except (TypeError, ValueError):
+        raise ValueError("Output quality, compress_level and method must be integers")
+
+    if not 1 <= quality <= 100:
+        raise ValueError("Output quality must be between 1 and 100")
+    if not 0 <= compress_level <= 9:
+        raise ValueError("PNG compress_level must be between 0 and 9")
+    if not 0 <= method <= 6:
+        raise ValueError("WebP method must be between 0 and 6")
+
+    return {'format': fmt, 'quality': quality, 'compress_level': compress_level, 'method': method}
+
+
+def request_output_overrides(fields):
+    """Pick output options from request fields (output_format, output_quality, ...)"""
+    return {
+        'format': fields.get('output_format'),
+        'quality': fields.get('output_quality'),
+        'compress_level': fields.get('output_compress_level'),
+        'method': fields.get('output_method')
+    }
+
+
+def encode_image(image, options):
+    """Encode a PIL Image with resolved output options, returning (bytes, mime_type)"""
+    pil_format, mime_type = OUTPUT_FORMATS[options['format']]
+
+    if options['format'] == 'png':
+        save_kwargs = {'compress_level': options['compress_level']}
+    elif options['format'] == 'jpeg':
+        save_kwargs = {'quality': options['quality']}
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    else:
+        save_kwargs = {'quality': options['quality'], 'method': options['method']}
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=pil_format, **save_kwargs)
+    return buffer.getvalue(), mime_type
+
+
+class EncoderPool:
+    """Bounded thread pool for output encoding
+
+    PIL releases the GIL while encoding, so running it here lets encoding of
+    one result overlap with inference or decoding of the next.
+    """
+
+    def __init__(self, max_workers=2, defaults=None):
+        self.defaults = defaults or default_output_options()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='encoder')
+
+    @classmethod
+    def from_env(cls):
+        """Create a pool sized by ENCODER_WORKERS with deployment defaults"""
+        return cls(max_workers=int(os.environ.get('ENCODER_WORKERS', '2')))
+
+    def resolve(self, overrides=None):
+        """Resolve per-request output options against this pool's defaults"""
+        return resolve_output_options(overrides, self.defaults)
+
+    def submit(self, image, options=None):
+        """Encode ``image`` in the pool; the future resolves to a result dict"""
+        options = options or self.defaults
+        return self._executor.submit(self._encode, image, options)
+
+    def encode(self, image, options=None):
+        """Encode ``image`` in the pool and wait for the result"""
+        return self.submit(image, options).result()
+
+    @staticmethod
+    def _encode(image, options):
+        start_time = time.perf_counter()
+        data, mime_type = encode_image(image, options)
+        return {
+            'data': data,
+            'mime_type': mime_type,
+            'format': options['format'],
+            'encoded_size': len(data),
+            'encode_time': time.perf_counter() - start_time
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,193 @@
+"""Precomputed store of catalog garments
+
+Build a catalog once from a directory of garment images:
+
+    python -m utils.garment_catalog build garments/ /data/catalog --size 512 512
+
+The store holds every garment decoded and resized into one (N, H, W, 3)
+uint8 array, its background mask in an (N, H, W) array, and an index.json
+mapping garment ids (file names without extension) to rows. At runtime
+the arrays are memory-mapped, so lookups read straight from the page cache
+and processes serving the same catalog share its memory.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils.image_io import SUPPORTED_FORMATS, decode_image
+
+INDEX_FILE = 'index.json'
+IMAGES_FILE = 'garments.npy'
+MASKS_FILE = 'masks.npy'
+CATALOG_VERSION = 1
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+
+
+def pixel_digest(array):
+    """Content digest of an image array, used in place of hashing its pixels per request"""
+    digest = hashlib.sha256()
+    digest.update(f"{array.dtype}:{'x'.join(map(str, array.shape))}:".encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+class GarmentCatalog:
+    """Read-only, memory-mapped view of a garment store built by ``build_catalog``"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+
+        if index.get('version') != CATALOG_VERSION:
+            raise ValueError(f"Unsupported garment catalog version: {index.get('version')}")
+
+        self.size = tuple(index['size'])
+        self.mask_threshold = index['mask_threshold']
+        self.images = np.load(os.path.join(directory, IMAGES_FILE), mmap_mode='r')
+        self.masks = np.load(os.path.join(directory, MASKS_FILE), mmap_mode='r')
+        self._entries = {entry['id']: entry for entry in index['entries']}
+
+    @classmethod
+    def from_env(cls):
+        """Open the catalog in GARMENT_CATALOG_DIR, or return None if it is not set"""
+        directory = os.environ.get('GARMENT_CATALOG_DIR')
+        return cls(directory) if directory else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, garment_id):
+        return garment_id in self._entries
+
+    def entry(self, garment_id):
+        """Index entry for ``garment_id``: row, digest, source file and original size"""
+        entry = self._entries.get(garment_id)
+        if entry is None:
+            raise ValueError(f"Unknown garment_id: {garment_id}")
+        return entry
+
+    def array(self, garment_id):
+        """(H, W, 3) uint8 view of the garment, backed by the memory map without copying"""
+        return self.images[self.entry(garment_id)['row']]
+
+    def mask(self, garment_id):
+        """(H, W) uint8 background mask of the garment, backed by the memory map"""
+        return self.masks[self.entry(garment_id)['row']]
+
+    def image(self, garment_id):
+        """The garment as a PIL Image, for code paths that need one
+
+        ``info['original_size']`` holds the size of the source file, as for
+        images decoded with ``decode_image``.
+        """
+        entry = self.entry(garment_id)
+        image = Image.fromarray(self.images[entry['row']])
+        image.info['original_size'] = tuple(entry['original_size'])
+        return image
+
+
+def find_images(source_dir):
+    """Garment image files in ``source_dir``, sorted by name"""
+    return sorted(
+        os.path.join(source_dir, name)
+        for name in os.listdir(source_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def build_catalog(source_dir, output_dir, size=(512, 512), mask_threshold=240, log=print):
+    """Decode, resize and mask every garment in ``source_dir`` into a store in ``output_dir``"""
+    from utils.image_utils import create_mask
+
+    paths = find_images(source_dir)
+    ids = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    duplicates = sorted({garment_id for garment_id in ids if ids.count(garment_id) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate garment ids: {', '.join(duplicates)}")
+    if not paths:
+        raise ValueError(f"No garment images found in {source_dir}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    width, height = size
+    images = np.lib.format.open_memmap(
+        os.path.join(output_dir, IMAGES_FILE), mode='w+', dtype=np.uint8, shape=(len(paths), height, width, 3)
+    )
+    masks = np.lib.format.open_memmap(
+        os.path.join(output_dir, MASKS_FILE), mode='w+', dtype=np.uint8, shape=(len(paths), height, width)
+    )
+
+    entries = []
+    start_time = time.perf_counter()
+    for row, (garment_id, path) in enumerate(zip(ids, paths)):
+        with open(path, 'rb') as f:
+            image = decode_image(f, target_size=size, formats=SUPPORTED_FORMATS)
+
+        images[row] = np.asarray(image)
+        masks[row] = np.asarray(create_mask(image, mask_threshold))
+        entries.append({
+            'id': garment_id,
+            'row': row,
+            'source': os.path.basename(path),
+            'original_size': list(image.info['original_size']),
+            'digest': pixel_digest(images[row])
+        })
+
+        if log and (row + 1) % 100 == 0:
+            log(f"Processed {row + 1}/{len(paths)} garments")
+
+    images.flush()
+    masks.flush()
+    del images, masks
+
+    # The index is written last, so a store without one is incomplete
+    index = {
+        'version': CATALOG_VERSION,
+        'size': list(size),
+        'mask_threshold': mask_threshold,
+        'created_at': time.time(),
+        'entries': entries
+    }
+    tmp_path = os.path.join(output_dir, INDEX_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(output_dir, INDEX_FILE))
+
+    if log:
+        log(f"Built catalog of {len(entries)} garments in {time.perf_counter() - start_time:.1f}s")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect a precomputed garment catalog")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='ingest a directory of garment images')
+    build.add_argument('source_dir')
+    build.add_argument('output_dir')
+    build.add_argument('--size', type=int, nargs=2, default=(512, 512), metavar=('WIDTH', 'HEIGHT'))
+    build.add_argument('--mask-threshold', type=int, default=240,
+                       help='grey level above which pixels count as white background')
+
+    info = commands.add_parser('info', help='summarise an existing catalog')
+    info.add_argument('catalog_dir')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_catalog(args.source_dir, args.output_dir, tuple(args.size), args.mask_threshold)
+    else:
+        catalog = GarmentCatalog(args.catalog_dir)
+        print(f"{len(catalog)} garments at {catalog.size[0]}x{catalog.size[1]}, "
+              f"{(catalog.images.nbytes + catalog.masks.nbytes) / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
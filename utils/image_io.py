@@ -0,0 +1,62 @@
+from PIL import Image
+
+# Formats accepted from clients; anything else is rejected from the header alone
+SUPPORTED_FORMATS = ('JPEG', 'PNG', 'WEBP', 'BMP', 'GIF', 'TIFF', 'MPO')
+
+# Modes that can be resized directly and converted to RGB afterwards, at the
+# smaller size; everything else (palette, CMYK, 16-bit, alpha) is converted first
+RESIZE_FIRST_MODES = ('RGB', 'L')
+
+
+def validate_image_header(image, min_size=(256, 256), max_size=(2048, 2048), formats=SUPPORTED_FORMATS):
+    """Validate format and dimensions of an opened but not yet decoded image
+
+    Image.open only parses the header, so this runs before any pixel data is
+    decoded.
+    """
+    if formats is not None and image.format not in formats:
+        raise ValueError(f"Unsupported image format: {image.format}")
+
+    width, height = image.size
+
+    if width < min_size[0] or height < min_size[1]:
+        raise ValueError(f"Image too small. Minimum size: {min_size}")
+
+    if width > max_size[0] or height > max_size[1]:
+        raise ValueError(f"Image too large. Maximum size: {max_size}")
+
+    return True
+
+
+def decode_image(source, target_size=None, min_size=(1, 1), max_size=(8192, 8192), formats=SUPPORTED_FORMATS):
+    """Decode an image file or stream to RGB, optionally straight to target_size
+
+    The header is validated before decoding. For JPEGs the decoder is asked
+    for a reduced-resolution draft no smaller than target_size, so large
+    photos are never decoded at full size. Resizing and RGB conversion are
+    then done in a single step. The original dimensions are kept in
+    ``image.info['original_size']``.
+    """
+    image = Image.open(source)
+    original_size = image.size
+    validate_image_header(image, min_size=min_size, max_size=max_size, formats=formats)
+
+    if target_size is not None and image.format in ('JPEG', 'MPO'):
+        # Lets libjpeg scale by 1/2, 1/4 or 1/8 while decoding
+        image.draft('RGB', target_size)
+
+    if target_size is None or image.size == tuple(target_size):
+        if image.mode == 'RGB':
+            image.load()
+            result = image
+        else:
+            result = image.convert('RGB')
+    elif image.mode in RESIZE_FIRST_MODES:
+        result = image.resize(target_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if result.mode != 'RGB':
+            result = result.convert('RGB')
+    else:
+        result = image.convert('RGB').resize(target_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    result.info['original_size'] = original_size
+    return result
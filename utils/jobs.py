@@ -0,0 +1,242 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled', 'timeout')
+
+
+class Job:
+    """State of a single asynchronous try-on job"""
+
+    def __init__(self, payload, cancel_event=None):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = 'queued'
+        self.step = 0
+        self.total_steps = None
+        self.result = None
+        self.details = {}
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Latest intermediate preview (an encoded result dict) and the step it shows
+        self.preview = None
+        self.preview_step = 0
+        # Set to ask a running job to stop; run_job is expected to check it
+        self.cancel_event = cancel_event or threading.Event()
+        # Bumped on every change so watchers can wait for updates
+        self.version = 0
+
+    @property
+    def finished(self):
+        return self.status in TERMINAL_STATUSES
+
+
+class JobManager:
+    """Run submitted jobs on dedicated worker threads and track their progress
+
+    ``run_job(job, progress)`` does the work and returns ``(result, details)``;
+    it may call ``progress(step, total_steps)`` as it goes, and publish
+    intermediate previews with ``set_preview``. Finished jobs are kept for
+    ``max_history`` jobs so their status and result can be fetched.
+
+    Cancelled queued jobs never run; ``discard_job(job, payload)``, if given,
+    is called once for each so it can release what the job held. A running
+    job is asked to stop through its ``cancel_event``. A job that raises ends
+    with the status ``error_status(exception)`` returns: ``failed``,
+    ``cancelled`` or ``timeout``; by default ``cancelled`` if it was asked
+    to stop, else ``failed``.
+    """
+
+    def __init__(self, run_job, workers=1, max_history=256, name='job-worker', discard_job=None,
+                 error_status=None):
+        self.run_job = run_job
+        self.discard_job = discard_job
+        self.error_status = error_status
+        self.workers = max(1, int(workers))
+        self.max_history = max_history
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._jobs = OrderedDict()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads if they are not running yet"""
+        with self._cond:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run, name=f"{self.name}-{len(self._threads)}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, payload, cancel_event=None):
+        """Queue a job and return it immediately
+
+        ``cancel_event`` lets the caller share a flag that ``run_job`` already
+        watches, such as a request's cancel token.
+        """
+        self.start()
+        job = Job(payload, cancel_event)
+
+        with self._cond:
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._prune()
+            self._cond.notify_all()
+
+        return job
+
+    def cancel(self, job):
+        """Cancel a queued or running job; returns False if it had already finished"""
+        discarded = None
+        with self._cond:
+            if job.finished:
+                return False
+
+            job.cancel_event.set()
+            if job.status == 'queued':
+                # Never handed to a worker, so nothing else finishes this job
+                self._pending.remove(job)
+                discarded = job.payload
+                job.status = 'cancelled'
+                job.payload = None
+                job.finished_at = time.time()
+                for waiting in self._pending:
+                    waiting.version += 1
+            job.version += 1
+            self._cond.notify_all()
+
+        if discarded is not None and self.discard_job is not None:
+            self.discard_job(job, discarded)
+        return True
+
+    def get(self, job_id):
+        """Return the job with ``job_id``, or None if unknown or expired"""
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def queue_depth(self):
+        """Number of jobs waiting for a worker"""
+        with self._cond:
+            return len(self._pending)
+
+    def snapshot(self, job):
+        """Return a JSON-serialisable view of the job's current state"""
+        with self._cond:
+            return self._snapshot(job)
+
+    def set_preview(self, job, preview, step):
+        """Publish an intermediate preview, unless a later step's preview arrived first"""
+        with self._cond:
+            if job.finished or step <= job.preview_step:
+                return
+            job.preview = preview
+            job.preview_step = step
+            job.version += 1
+            self._cond.notify_all()
+
+    def preview(self, job):
+        """Return ``(preview, step)`` for the job's latest preview, or ``(None, 0)``"""
+        with self._cond:
+            return job.preview, job.preview_step
+
+    def wait_for_update(self, job, version, timeout=None):
+        """Block until the job changes past ``version``; returns a snapshot or None on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while job.version <= version:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._snapshot(job)
+
+    def _snapshot(self, job):
+        state = {
+            'job_id': job.id,
+            'status': job.status,
+            'step': job.step,
+            'total_steps': job.total_steps,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+            'version': job.version
+        }
+
+        if job.preview_step:
+            state['preview_step'] = job.preview_step
+
+        if job.status == 'queued':
+            try:
+                state['queue_position'] = self._pending.index(job) + 1
+            except ValueError:
+                state['queue_position'] = 0
+        else:
+            state['queue_position'] = 0
+
+        if job.status == 'completed':
+            state.update(job.details)
+        elif job.status in ('failed', 'cancelled', 'timeout') and job.error:
+            state['error'] = job.error
+        elif job.status == 'running' and job.cancel_event.is_set():
+            state['cancel_requested'] = True
+
+        return state
+
+    def _update(self, job, **changes):
+        with self._cond:
+            for key, value in changes.items():
+                setattr(job, key, value)
+            job.version += 1
+            self._cond.notify_all()
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond ``max_history``"""
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:excess]:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pending.popleft()
+                job.status = 'running'
+                job.started_at = time.time()
+                job.version += 1
+                # Queue positions of every other waiting job changed too
+                for waiting in self._pending:
+                    waiting.version += 1
+                self._cond.notify_all()
+
+            def progress(step, total_steps, job=job):
+                self._update(job, step=step, total_steps=total_steps)
+
+            try:
+                result, details = self.run_job(job, progress)
+            except Exception as e:
+                if self.error_status is not None:
+                    status = self.error_status(e)
+                else:
+                    status = 'cancelled' if job.cancel_event.is_set() else 'failed'
+                self._update(
+                    job, status=status, error=str(e), payload=None, preview=None, finished_at=time.time()
+                )
+                continue
+
+            # Inputs are no longer needed once the job is done
+            self._update(
+                job, status='completed', result=result, details=details, payload=None,
+                preview=None, finished_at=time.time()
+            )
@@ -0,0 +1,400 @@
+"""Memory budget: measure model and per-request memory, and plan the pipeline to fit
+
+The budget is the memory the process may use: ``MEMORY_BUDGET_MB`` if set,
+otherwise the device's total memory on a GPU, or the container's cgroup
+limit (falling back to the host's total memory) on CPU, less a headroom
+fraction.
+
+When the model is loaded, a plan picks the cheapest placement that fits
+the budget, in order: everything resident, attention slicing, VAE tiling,
+model CPU offload and sequential CPU offload. (On CPU only the first three
+apply.) The plan also sets the largest batch whose working memory fits
+next to the model. The per-image working memory starts as a rough
+estimate. It is then replaced by the peak measured during warmup and
+during each later batch, so the batch limit follows what requests really
+use.
+
+Memory is measured with the CUDA allocator's statistics when the pipeline
+runs on a GPU, and as process RSS on CPU. RSS covers the whole process,
+so decoding or encoding on other threads during a batch is counted too.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Rough working memory per output pixel in float16, including classifier-free
+# guidance; only used until a batch has been measured
+UNET_BYTES_PER_PIXEL = {False: 3800, True: 1500}   # keyed by attention slicing
+VAE_BYTES_PER_PIXEL = {False: 3300, True: 900}     # keyed by VAE tiling
+
+# Placements from cheapest to most memory-frugal: (offload, attention slicing, VAE tiling)
+PLAN_LEVELS = (
+    ('none', False, False),
+    ('none', True, False),
+    ('none', True, True),
+    ('model', True, True),
+    ('sequential', True, True)
+)
+
+OFFLOAD_MODES = ('auto', 'none', 'model', 'sequential')
+
+CGROUP_LIMIT_FILES = (
+    '/sys/fs/cgroup/memory.max',                      # cgroup v2
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes'     # cgroup v1
+)
+
+# Sampling interval of the RSS fallback when the peak cannot be reset
+RSS_SAMPLE_INTERVAL = 0.01
+
+
+def _proc_status(field):
+    """A ``kB`` field of /proc/self/status in bytes, or None off Linux"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def process_rss():
+    """Resident set size of this process in bytes"""
+    rss = _proc_status('VmRSS')
+    if rss is not None:
+        return rss
+
+    import resource
+    import sys
+
+    # Only the lifetime peak is available here; ru_maxrss is in kB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def reset_peak_rss():
+    """Reset the kernel's RSS high-water mark (VmHWM); False where that is not possible"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def host_memory_limit():
+    """Memory available to this container: the cgroup limit, else the host's total memory"""
+    for path in CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # 'max', or v1's "unlimited" of nearly 2**63, mean no limit
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def module_bytes(module):
+    """Bytes held by a module's parameters and buffers"""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def component_bytes(pipe):
+    """Parameter and buffer bytes of each model component of a pipeline"""
+    sizes = {}
+    for name, component in pipe.components.items():
+        if hasattr(component, 'parameters') and hasattr(component, 'buffers'):
+            sizes[name] = module_bytes(component)
+    return sizes
+
+
+class MemoryUsage:
+    """Memory of one tracked pipeline call: the level before it and the peak during it"""
+
+    __slots__ = ('baseline', 'peak')
+
+    def __init__(self, baseline):
+        self.baseline = baseline
+        self.peak = baseline
+
+    @property
+    def working(self):
+        """Peak above the level before the call: what the call itself needed"""
+        return max(0, self.peak - self.baseline)
+
+
+class MemoryPlan:
+    """Chosen placement and batch limit"""
+
+    def __init__(self, offload='none', attention_slicing=False, vae_tiling=False, max_batch_size=1, fits=True):
+        self.offload = offload
+        self.attention_slicing = attention_slicing
+        self.vae_tiling = vae_tiling
+        self.max_batch_size = max_batch_size
+        self.fits = fits
+
+    def describe(self):
+        return {
+            'offload': self.offload,
+            'attention_slicing': self.attention_slicing,
+            'vae_tiling': self.vae_tiling,
+            'max_batch_size': self.max_batch_size,
+            'fits': self.fits
+        }
+
+
+class MemoryManager:
+    """Plan the pipeline's placement and batch size within a memory budget
+
+    ``budget_bytes`` of 0 detects the budget (see the module docstring),
+    keeping ``headroom`` of it free. ``offload`` forces a placement instead
+    of choosing one: ``none``, ``model`` or ``sequential``. ``max_batch_size``
+    is the configured upper bound; the plan never exceeds it.
+
+    ``track`` and ``observe`` are meant for one pipeline call at a time,
+    which is how the batch worker runs them.
+    """
+
+    def __init__(self, budget_bytes=0, headroom=0.1, offload='auto', max_batch_size=4):
+        offload = str(offload).lower()
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"Unsupported offload mode: {offload} (expected one of {', '.join(OFFLOAD_MODES)})")
+        if not 0.0 <= float(headroom) < 1.0:
+            raise ValueError("Memory headroom must be in [0, 1)")
+
+        self.budget_bytes = max(0, int(budget_bytes))
+        self.headroom = float(headroom)
+        self.offload = offload
+        self.max_batch_size = max(1, int(max_batch_size))
+
+        self.device = None
+        self.budget = None
+        self.model_bytes = None
+        self.components = {}
+        self.resident = None
+        self.image_bytes = None
+        self.measured = False
+        self.plan = None
+        self.peak = 0
+
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, max_batch_size=4):
+        """Manager configured from MEMORY_BUDGET_MB, MEMORY_HEADROOM and MEMORY_OFFLOAD"""
+        return cls(
+            budget_bytes=float(os.environ.get('MEMORY_BUDGET_MB', '0')) * MB,
+            headroom=float(os.environ.get('MEMORY_HEADROOM', '0.1')),
+            offload=os.environ.get('MEMORY_OFFLOAD', 'auto'),
+            max_batch_size=max_batch_size
+        )
+
+    def detect_budget(self, device):
+        """Budget in bytes for ``device``, or None if it cannot be determined"""
+        if self.budget_bytes:
+            return self.budget_bytes
+
+        if device == 'cuda':
+            import torch
+
+            total = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+        else:
+            total = host_memory_limit()
+        return int(total * (1.0 - self.headroom)) if total else None
+
+    def current(self):
+        """Memory in use now: allocated device memory on a GPU, process RSS on CPU"""
+        if self.device == 'cuda':
+            import torch
+
+            return torch.cuda.memory_allocated()
+        return process_rss()
+
+    def plan_pipeline(self, pipe, device, image_size, dtype_bytes=2):
+        """Measure the loaded model and choose a plan for ``image_size`` (width, height) outputs
+
+        Call before the pipeline is moved to the device, then ``apply``.
+        """
+        self.device = device
+        self.budget = self.detect_budget(device)
+        self.components = component_bytes(pipe)
+        self.model_bytes = sum(self.components.values())
+        pixels = image_size[0] * image_size[1]
+
+        if device == 'cuda':
+            levels = [level for level in PLAN_LEVELS if self.offload in ('auto', level[0])]
+        else:
+            # The weights are in host memory either way; offloading only applies to a device
+            levels = [level for level in PLAN_LEVELS if level[0] == 'none']
+            self.resident = process_rss()
+
+        candidates = []
+        for offload, attention_slicing, vae_tiling in levels:
+            resident = self.resident if device != 'cuda' else self._resident_on_device(offload)
+            image_bytes = self._estimate_image_bytes(pixels, dtype_bytes, attention_slicing, vae_tiling)
+            fit = self._fit(resident, image_bytes)
+            candidates.append((fit, MemoryPlan(offload, attention_slicing, vae_tiling), resident, image_bytes))
+
+        # The cheapest placement that fits the configured batch size, else the one that fits most,
+        # else, when not even one request fits, the most frugal
+        chosen = next((candidate for candidate in candidates if candidate[0] >= self.max_batch_size), None)
+        if chosen is None:
+            chosen = max(candidates, key=lambda candidate: candidate[0])
+            if chosen[0] == 0:
+                chosen = candidates[-1]
+
+        fit, plan, resident, image_bytes = chosen
+        plan.fits = fit >= 1
+        plan.max_batch_size = min(self.max_batch_size, max(1, fit))
+        if not plan.fits:
+            logger.warning(
+                f"Estimated memory for one request exceeds the {self.budget / MB:.0f} MB budget; "
+                f"running with the smallest placement"
+            )
+
+        with self._lock:
+            self.plan = plan
+            self.image_bytes = image_bytes
+            if device == 'cuda':
+                self.resident = resident
+        return plan
+
+    def apply(self, pipe, device, plan=None):
+        """Place ``pipe`` according to ``plan``; returns the names of what was enabled"""
+        plan = plan or self.plan
+        applied = []
+
+        if device == 'cuda':
+            if plan.offload == 'sequential':
+                pipe.enable_sequential_cpu_offload()
+                applied.append('sequential CPU offload')
+            elif plan.offload == 'model':
+                pipe.enable_model_cpu_offload()
+                applied.append('model CPU offload')
+            else:
+                pipe.to('cuda')
+
+        if plan.attention_slicing:
+            pipe.enable_attention_slicing()
+            applied.append('attention slicing')
+        if plan.vae_tiling:
+            pipe.vae.enable_tiling()
+            applied.append('VAE tiling')
+
+        if device == 'cuda':
+            # Measure what actually stayed on the device
+            with self._lock:
+                self.resident = self.current()
+        return applied
+
+    def model_capacity(self):
+        """Bytes left for model weights once a full batch's working memory is set aside, or None"""
+        with self._lock:
+            if self.budget is None or self.plan is None:
+                return None
+            return max(0, self.budget - self.image_bytes * self.plan.max_batch_size)
+
+    @contextmanager
+    def track(self):
+        """Track the peak memory of the enclosed pipeline call; yields a MemoryUsage"""
+        usage = MemoryUsage(self.current())
+
+        if self.device == 'cuda':
+            import torch
+
+            torch.cuda.reset_peak_memory_stats()
+            try:
+                yield usage
+            finally:
+                usage.peak = max(usage.baseline, torch.cuda.max_memory_allocated())
+            return
+
+        if reset_peak_rss():
+            try:
+                yield usage
+            finally:
+                usage.peak = max(usage.baseline, _proc_status('VmHWM') or process_rss())
+            return
+
+        # No resettable high-water mark: sample RSS while the call runs
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(RSS_SAMPLE_INTERVAL):
+                usage.peak = max(usage.peak, process_rss())
+
+        sampler = threading.Thread(target=sample, name='rss-sampler', daemon=True)
+        sampler.start()
+        try:
+            yield usage
+        finally:
+            stop.set()
+            sampler.join()
+            usage.peak = max(usage.peak, process_rss())
+
+    def observe(self, usage, batch_size):
+        """Update the per-image estimate from a measured call; returns the new batch limit"""
+        with self._lock:
+            self.peak = max(self.peak, usage.peak)
+            sample = usage.working / max(1, batch_size)
+            if sample <= 0 or self.plan is None:
+                return self.max_batch_size if self.plan is None else self.plan.max_batch_size
+
+            # Keep the largest per-image figure seen, so the limit errs on the safe side
+            self.image_bytes = sample if not self.measured else max(self.image_bytes, sample)
+            self.measured = True
+            self.resident = usage.baseline
+
+            fit = self._fit(self.resident, self.image_bytes)
+            self.plan.fits = fit >= 1
+            self.plan.max_batch_size = min(self.max_batch_size, max(1, fit))
+            return self.plan.max_batch_size
+
+    def report(self):
+        """Budget, model footprint, per-image working memory and the current plan"""
+        def mb(value):
+            return None if value is None else round(value / MB, 1)
+
+        with self._lock:
+            return {
+                'budget_mb': mb(self.budget),
+                'model_mb': mb(self.model_bytes),
+                'components_mb': {name: mb(size) for name, size in self.components.items()},
+                'resident_mb': mb(self.resident),
+                'per_image_mb': mb(self.image_bytes),
+                'per_image_measured': self.measured,
+                'peak_mb': mb(self.peak),
+                **({'plan': self.plan.describe()} if self.plan is not None else {})
+            }
+
+    def _resident_on_device(self, offload):
+        if offload == 'none':
+            return self.model_bytes
+        if offload == 'model':
+            # One component at a time is on the device
+            return max(self.components.values(), default=0)
+        return 0
+
+    def _estimate_image_bytes(self, pixels, dtype_bytes, attention_slicing, vae_tiling):
+        # The UNet and the VAE run one after the other, so the larger of the two counts
+        per_pixel = max(UNET_BYTES_PER_PIXEL[attention_slicing], VAE_BYTES_PER_PIXEL[vae_tiling])
+        return int(pixels * per_pixel * dtype_bytes / 2)
+
+    def _fit(self, resident, image_bytes):
+        """Number of images whose working memory fits next to ``resident`` bytes"""
+        if self.budget is None:
+            return self.max_batch_size
+        return int(max(0, self.budget - resident) // max(1, image_bytes))
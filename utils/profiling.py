@@ -0,0 +1,218 @@
+"""Per-request profiling, on demand or sampled, with traces written to a directory
+
+A request asks for a profile with an ``X-Profile`` header (HTTP) or a
+``profile`` input field (RunPod): ``cprofile``, ``torch``, or any true
+value for the default mode. A fraction ``sample_rate`` of the other
+requests is profiled as well. Traces are written to files and only their
+paths are returned:
+
+- ``cprofile``: ``.prof`` stats of the profiled thread, for ``pstats`` or snakeviz
+- ``torch``: ``torch.profiler`` Chrome trace (``.json``) of CPU and CUDA ops,
+  for chrome://tracing or Perfetto
+
+Profilers are process-wide, so one trace is recorded at a time per
+process; a request that finds the profiler busy runs unprofiled and says
+so in its response.
+"""
+import cProfile
+import importlib.util
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('cprofile', 'torch')
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('', '0', 'false', 'no', 'off')
+
+
+class Trace:
+    """Outcome of one profiled section: the trace file, or why there is none"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.path = None
+        self.skipped = None
+
+    def fields(self):
+        """Response fields describing the trace; empty when profiling was not requested"""
+        if self.mode is None:
+            return {}
+        fields = {'profile_mode': self.mode, 'profile_trace': self.path}
+        if self.skipped:
+            fields['profile_skipped'] = self.skipped
+        return fields
+
+
+class Profiler:
+    """Runs requested or sampled sections under cProfile or torch.profiler
+
+    ``on_demand`` allows requests to ask for a profile; ``sample_rate`` is
+    the fraction of other requests profiled in ``mode``. At most
+    ``max_traces`` trace files are kept; older ones are removed.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, mode='cprofile', on_demand=True, max_traces=200):
+        mode = str(mode).lower()
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unsupported profile mode: {mode} (expected one of {', '.join(PROFILE_MODES)})")
+        if not 0.0 <= float(sample_rate) <= 1.0:
+            raise ValueError("Profile sample rate must be in [0, 1]")
+
+        self.directory = directory
+        self.sample_rate = float(sample_rate)
+        self.mode = mode
+        self.on_demand = on_demand
+        self.max_traces = max(1, int(max_traces))
+
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+
+        self.traces = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_env(cls, default_dir=None):
+        """Profiler configured from PROFILE_DIR, PROFILE_MODE, PROFILE_SAMPLE_RATE, PROFILE_ON_DEMAND and PROFILE_MAX_TRACES"""
+        import tempfile
+
+        return cls(
+            os.environ.get('PROFILE_DIR') or default_dir or os.path.join(tempfile.gettempdir(), 'tryon-profiles'),
+            sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+            mode=os.environ.get('PROFILE_MODE', 'cprofile'),
+            on_demand=os.environ.get('PROFILE_ON_DEMAND', '1').lower() in TRUE_VALUES,
+            max_traces=int(os.environ.get('PROFILE_MAX_TRACES', '200'))
+        )
+
+    def resolve(self, requested=None):
+        """Profile of a request, from its ``requested`` value and the sample rate
+
+        Returns ``(mode, on_demand)``: the mode to profile in, or None, and
+        whether the request asked for it rather than being sampled. Only
+        on-demand profiles should bypass result caches; sampled requests
+        are profiled only when they do real work.
+        """
+        value = str(requested if requested is not None else '').strip().lower()
+
+        if value in FALSE_VALUES:
+            if self.sample_rate and random.random() < self.sample_rate:
+                return self.mode, False
+            return None, False
+
+        if not self.on_demand:
+            raise ValueError("On-demand profiling is disabled (PROFILE_ON_DEMAND=0)")
+        mode = self.mode if value in TRUE_VALUES else value
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unsupported profile mode: {mode} (expected one of {', '.join(PROFILE_MODES)})")
+        if mode == 'torch' and importlib.util.find_spec('torch') is None:
+            raise ValueError("Profile mode 'torch' needs torch to be installed")
+        return mode, True
+
+    @contextmanager
+    def profile(self, mode, label='request'):
+        """Profile the body in ``mode`` (a no-op if None); yields the Trace, complete on exit"""
+        trace = Trace(mode)
+        if mode is None:
+            yield trace
+            return
+
+        if not self._busy.acquire(blocking=False):
+            trace.skipped = 'busy'
+            with self._lock:
+                self.skipped += 1
+            yield trace
+            return
+
+        try:
+            path = self._trace_path(label, '.json' if mode == 'torch' else '.prof')
+            if mode == 'torch':
+                with self._torch_profile(path, trace):
+                    yield trace
+            else:
+                with self._cprofile(path, trace):
+                    yield trace
+        finally:
+            self._busy.release()
+
+        with self._lock:
+            self.traces += 1
+        self._prune()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'mode': self.mode,
+                'sample_rate': self.sample_rate,
+                'on_demand': self.on_demand,
+                'traces': self.traces,
+                'skipped': self.skipped
+            }
+
+    @contextmanager
+    def _cprofile(self, path, trace):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._write(trace, path, profile.dump_stats)
+
+    @contextmanager
+    def _torch_profile(self, path, trace):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+
+        with profile(activities=activities) as prof:
+            yield
+        self._write(trace, path, prof.export_chrome_trace)
+
+    def _write(self, trace, path, write):
+        # A trace that cannot be written must not fail the request it profiled
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write(path)
+            trace.path = path
+        except OSError as e:
+            logger.warning(f"Could not write profile trace: {str(e)}")
+
+    def _trace_path(self, label, extension):
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}{extension}"
+        return os.path.join(self.directory, name)
+
+    def _prune(self):
+        """Remove the oldest traces beyond max_traces"""
+        try:
+            entries = [
+                entry for entry in os.scandir(self.directory)
+                if entry.is_file() and entry.name.endswith(('.prof', '.json'))
+            ]
+        except OSError:
+            return
+        if len(entries) <= self.max_traces:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_traces]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def requested_profile(fields=None, headers=None):
+    """Profile value of a request: its X-Profile header, else its ``profile`` field"""
+    value = headers.get('X-Profile') if headers is not None else None
+    if value is None and fields:
+        value = fields.get('profile')
+    return value
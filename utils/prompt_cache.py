@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+
+class PromptEmbeddingCache:
+    """Cache text-encoder outputs so repeated prompts skip encoding
+
+    ``encode_fn`` maps a prompt string to its embeddings (any object, usually
+    a tuple of tensors). Pinned prompts, such as the default and negative
+    prompts, are encoded once and never evicted; all other prompts share a
+    bounded LRU of ``max_entries``.
+    """
+
+    def __init__(self, encode_fn, max_entries=64):
+        self.encode_fn = encode_fn
+        self.max_entries = max(0, int(max_entries))
+
+        self._pinned = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def pin(self, prompt):
+        """Encode ``prompt`` now and keep it for the lifetime of the cache"""
+        embeddings = self.encode_fn(prompt)
+        with self._lock:
+            self._pinned[prompt] = embeddings
+        return embeddings
+
+    def get(self, prompt):
+        """Return ``(embeddings, hit)`` for ``prompt``, encoding it on a miss"""
+        with self._lock:
+            embeddings = self._pinned.get(prompt)
+            if embeddings is None:
+                embeddings = self._entries.get(prompt)
+                if embeddings is not None:
+                    self._entries.move_to_end(prompt)
+
+            if embeddings is not None:
+                self.hits += 1
+                return embeddings, True
+            self.misses += 1
+
+        embeddings = self.encode_fn(prompt)
+
+        if self.max_entries:
+            with self._lock:
+                self._entries[prompt] = embeddings
+                self._entries.move_to_end(prompt)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return embeddings, False
+
+    def clear(self):
+        """Drop every cached embedding, including pinned ones"""
+        with self._lock:
+            self._pinned.clear()
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the number of cached prompts"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'pinned': len(self._pinned),
+                'entries': len(self._entries),
+                'max_entries': self.max_entries
+            }
@@ -0,0 +1,153 @@
+"""Named quality/speed tiers for the diffusion pipeline
+
+A tier fixes the scheduler, step count, guidance scale and img2img
+strength of a request. Tiers with ``cfg`` off run with a guidance scale
+of 1, where the pipeline skips classifier-free guidance and so runs the
+UNet once per step instead of twice.
+
+Schedulers are built from the loaded pipeline's scheduler config and
+swapped in per batch, so changing tier never reloads the model.
+"""
+import json
+import os
+import threading
+
+# Scheduler names -> (diffusers class name, config overrides)
+SCHEDULERS = {
+    'default': (None, {}),
+    'euler': ('EulerDiscreteScheduler', {}),
+    'euler_a': ('EulerAncestralDiscreteScheduler', {}),
+    'dpmpp_2m': ('DPMSolverMultistepScheduler', {'algorithm_type': 'dpmsolver++', 'solver_order': 2}),
+    'dpmpp_2m_karras': (
+        'DPMSolverMultistepScheduler',
+        {'algorithm_type': 'dpmsolver++', 'solver_order': 2, 'use_karras_sigmas': True}
+    ),
+    'unipc': ('UniPCMultistepScheduler', {})
+}
+
+# 'standard' keeps the original generation settings, so its results are unchanged
+DEFAULT_TIERS = {
+    'preview': {'scheduler': 'dpmpp_2m_karras', 'num_inference_steps': 8, 'guidance_scale': 7.5,
+                'strength': 0.8, 'cfg': False},
+    'fast': {'scheduler': 'dpmpp_2m_karras', 'num_inference_steps': 12, 'guidance_scale': 7.5,
+             'strength': 0.8, 'cfg': True},
+    'standard': {'scheduler': 'default', 'num_inference_steps': 20, 'guidance_scale': 7.5,
+                 'strength': 0.8, 'cfg': True},
+    'high': {'scheduler': 'dpmpp_2m', 'num_inference_steps': 30, 'guidance_scale': 7.5,
+             'strength': 0.8, 'cfg': True}
+}
+
+DEFAULT_TIER = 'standard'
+
+
+class QualityTier:
+    """Generation settings of one named tier"""
+
+    def __init__(self, name, scheduler='default', num_inference_steps=20, guidance_scale=7.5,
+                 strength=0.8, cfg=True):
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f"Unknown scheduler for tier {name}: {scheduler}")
+        if int(num_inference_steps) < 1:
+            raise ValueError(f"Tier {name} needs at least one inference step")
+        if not 0.0 < float(strength) <= 1.0:
+            raise ValueError(f"Tier {name} strength must be in (0, 1]")
+
+        self.name = name
+        self.scheduler = scheduler
+        self.num_inference_steps = int(num_inference_steps)
+        self.guidance_scale = float(guidance_scale)
+        self.strength = float(strength)
+        self.cfg = bool(cfg) and self.guidance_scale > 1.0
+
+    @property
+    def effective_guidance_scale(self):
+        """Guidance scale passed to the pipeline; 1.0 disables classifier-free guidance"""
+        return self.guidance_scale if self.cfg else 1.0
+
+    @property
+    def unet_evaluations(self):
+        """UNet passes per request: one per step, two with classifier-free guidance"""
+        return self.num_inference_steps * (2 if self.cfg else 1)
+
+    def params(self):
+        """Settings that determine the output, for result cache keys
+
+        The tier name is left out, so tiers with identical settings share
+        cached results.
+        """
+        return {
+            'scheduler': self.scheduler,
+            'num_inference_steps': self.num_inference_steps,
+            'guidance_scale': self.effective_guidance_scale,
+            'strength': self.strength
+        }
+
+
+class QualityTiers:
+    """The configured tiers and the default used when a request names none"""
+
+    def __init__(self, tiers=None, default=DEFAULT_TIER):
+        tiers = tiers if tiers is not None else DEFAULT_TIERS
+        self.tiers = {name: QualityTier(name, **settings) for name, settings in tiers.items()}
+
+        if default not in self.tiers:
+            raise ValueError(f"Default quality tier {default} is not defined")
+        self.default = default
+
+    @classmethod
+    def from_env(cls):
+        """Tiers from DEFAULT_QUALITY_TIER and QUALITY_TIERS
+
+        QUALITY_TIERS is a JSON object of tier name -> settings; its entries
+        are merged over the built-in tiers, so a single field can be changed.
+        """
+        tiers = {name: dict(settings) for name, settings in DEFAULT_TIERS.items()}
+        overrides = json.loads(os.environ.get('QUALITY_TIERS') or '{}')
+        for name, settings in overrides.items():
+            tiers.setdefault(name, {}).update(settings)
+
+        return cls(tiers, default=os.environ.get('DEFAULT_QUALITY_TIER', DEFAULT_TIER))
+
+    def get(self, name=None):
+        """Tier called ``name``, or the default tier if ``name`` is empty"""
+        name = name or self.default
+        tier = self.tiers.get(str(name).lower())
+        if tier is None:
+            raise ValueError(f"Unknown quality tier: {name} (expected one of {', '.join(self.tiers)})")
+        return tier
+
+    def names(self):
+        return list(self.tiers)
+
+
+class SchedulerSwitcher:
+    """Swap the pipeline's scheduler per tier without reloading the model
+
+    Schedulers are created from the scheduler the pipeline was loaded
+    with, once per name, and reused. Only the batch worker calls ``use``,
+    so batches never share a scheduler instance concurrently.
+    """
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self._default = pipe.scheduler
+        self._schedulers = {'default': pipe.scheduler}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Scheduler instance for ``name``, created on first use"""
+        with self._lock:
+            scheduler = self._schedulers.get(name)
+            if scheduler is None:
+                import diffusers
+
+                class_name, overrides = SCHEDULERS[name]
+                scheduler_class = getattr(diffusers, class_name)
+                scheduler = scheduler_class.from_config(self._default.config, **overrides)
+                self._schedulers[name] = scheduler
+            return scheduler
+
+    def use(self, name):
+        """Install the scheduler called ``name`` on the pipeline"""
+        self.pipe.scheduler = self.get(name)
+        return self.pipe.scheduler
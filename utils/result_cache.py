@@ -0,0 +1,153 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+
+class ResultCache:
+    """Content-addressed cache for deterministic try-on results
+
+    Results are keyed by a hash of the decoded input pixels, the prompt and
+    the generation parameters. A bounded in-memory LRU tier holds the most
+    recent results as PNG bytes; an optional on-disk tier keeps them across
+    restarts.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max(0, int(max_bytes))
+        self.disk_dir = disk_dir
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Create a cache configured from RESULT_CACHE_MAX_MB and RESULT_CACHE_DIR"""
+        max_mb = float(os.environ.get('RESULT_CACHE_MAX_MB', '256'))
+        disk_dir = os.environ.get('RESULT_CACHE_DIR') or None
+        return cls(max_bytes=max_mb * 1024 * 1024, disk_dir=disk_dir)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or bool(self.disk_dir)
+
+    @staticmethod
+    def make_key(person_image, clothing_image, prompt="", **params):
+        """Build a cache key from decoded images, prompt and generation parameters
+
+        Either image may instead be given as a precomputed content digest
+        string, such as a garment catalog entry's ``digest``.
+        """
+        digest = hashlib.sha256()
+
+        for image in (person_image, clothing_image):
+            if isinstance(image, str):
+                digest.update(f"digest:{image}:".encode())
+                continue
+            digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+            digest.update(image.tobytes())
+
+        digest.update(prompt.encode('utf-8'))
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached result image for ``key``, or None"""
+        data = self._get_bytes(key)
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def put(self, key, image):
+        """Store a result image under ``key``"""
+        if not self.enabled:
+            return
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', compress_level=1)
+        data = buffer.getvalue()
+
+        self._put_memory(key, data)
+        if self.disk_dir:
+            self._put_disk(key, data)
+
+    def stats(self):
+        """Return hit/miss counters and memory tier usage"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _get_bytes(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        if not self.disk_dir:
+            return None
+
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        # Promote disk hits into the memory tier
+        self._put_memory(key, data)
+        return data
+
+    def _put_memory(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= len(previous)
+
+            self._entries[key] = data
+            self._total_bytes += len(data)
+
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.png")
+
+    def _put_disk(self, key, data):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write atomically so a crash never leaves a truncated entry behind
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+import time
+
+# File extension -> MIME type of stored results
+EXTENSIONS = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp'
+}
+
+NAME_PATTERN = re.compile(r'^([0-9a-f]{64})\.(png|jpeg|webp)$')
+
+RESULT_DELIVERY_MODES = ('url', 'inline')
+
+
+class ResultStore:
+    """Content-addressed directory of encoded results, served by URL
+
+    Each result is stored once under the SHA-256 of its encoded bytes, so
+    the name doubles as a strong ETag and a stored file never changes.
+    Files expire ``ttl`` seconds after they were last stored; expired files
+    are no longer served and are removed by a sweep that runs at most every
+    ``sweep_interval`` seconds, triggered by writes.
+    """
+
+    def __init__(self, directory, ttl=3600, base_url='/results', sweep_interval=None):
+        self.directory = directory
+        self.ttl = max(1, int(ttl))
+        self.base_url = base_url.rstrip('/')
+        self.sweep_interval = sweep_interval if sweep_interval is not None else max(60, self.ttl // 4)
+
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._sweeping = False
+
+        self.stored = 0
+        self.evicted = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, default_dir=None):
+        """Store configured from RESULT_STORE_DIR, RESULT_STORE_TTL and RESULT_BASE_URL
+
+        Returns None when neither RESULT_STORE_DIR nor ``default_dir`` is set.
+        """
+        directory = os.environ.get('RESULT_STORE_DIR') or default_dir
+        if not directory:
+            return None
+        return cls(
+            directory,
+            ttl=int(os.environ.get('RESULT_STORE_TTL', '3600')),
+            base_url=os.environ.get('RESULT_BASE_URL', '/results')
+        )
+
+    def put(self, encoded):
+        """Store an encoded result dict (see EncoderPool); returns its name, URL and ETag"""
+        key = hashlib.sha256(encoded['data']).hexdigest()
+        name = f"{key}.{encoded['format']}"
+        path = self._path(name)
+
+        try:
+            # Identical result already stored: just restart its lifetime
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Write atomically so a reader never sees a truncated file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(encoded['data'])
+                os.replace(tmp_path, path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        with self._lock:
+            self.stored += 1
+        self._maybe_sweep()
+
+        return {'name': name, 'url': f"{self.base_url}/{name}", 'etag': key}
+
+    def lookup(self, name):
+        """Path, ETag, MIME type and remaining lifetime of a stored result, or None
+
+        Names that are not of the store's own form are rejected before the
+        file system is touched.
+        """
+        match = NAME_PATTERN.match(name)
+        if match is None:
+            return None
+
+        path = self._path(name)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except OSError:
+            return None
+        if age >= self.ttl:
+            return None
+
+        return {
+            'path': path,
+            'etag': match.group(1),
+            'mime_type': EXTENSIONS[match.group(2)],
+            'max_age': int(self.ttl - age)
+        }
+
+    def sweep(self):
+        """Remove expired results; returns the number removed"""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    # Stored again or removed by another process meanwhile
+                    pass
+
+        with self._lock:
+            self.evicted += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'ttl': self.ttl,
+                'stored': self.stored,
+                'evicted': self.evicted
+            }
+
+    def _path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def _maybe_sweep(self):
+        with self._lock:
+            if self._sweeping or time.monotonic() - self._last_sweep < self.sweep_interval:
+                return
+            self._sweeping = True
+
+        def run():
+            try:
+                self.sweep()
+            finally:
+                with self._lock:
+                    self._sweeping = False
+                    self._last_sweep = time.monotonic()
+
+        threading.Thread(target=run, name='result-store-sweep', daemon=True).start()
+
+
+def inline_result(encoded, data_url=False):
+    """Base64 of an encoded result, as a ``data:`` URL if ``data_url``"""
+    img_str = base64.b64encode(encoded['data']).decode()
+    if data_url:
+        return f"data:{encoded['mime_type']};base64,{img_str}"
+    return img_str
+
+
+def deliver_result(encoded, delivery, store=None, data_url=False):
+    """Response fields carrying an encoded result: a ``store`` URL and ETag, or the result inline"""
+    if delivery == 'url':
+        stored = store.put(encoded)
+        return {'result_url': stored['url'], 'result_etag': stored['etag']}
+    return {'result_image': inline_result(encoded, data_url=data_url)}
+
+
+def result_delivery(fields, default='url'):
+    """Delivery mode from a request's ``result_delivery`` field: ``url`` or ``inline`` base64"""
+    delivery = str((fields.get('result_delivery') if fields else None) or default).lower()
+    if delivery not in RESULT_DELIVERY_MODES:
+        raise ValueError(f"Unsupported result_delivery: {delivery} (expected one of {', '.join(RESULT_DELIVERY_MODES)})")
+    return delivery
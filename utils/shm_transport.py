@@ -0,0 +1,316 @@
+"""Shared-memory image transport between HTTP front-ends and inference workers
+
+Each front-end process owns a pool of fixed-size shared-memory slots. A
+slot holds the person image, the clothing image and the result as raw
+RGB pixels at the model's input sizes. A request writes its decoded
+images into a free slot and sends only a small message (the slot name and
+the request fields) to the inference workers over a queue. The worker
+reads the pixels in place, writes the result back into the same slot and
+replies with its shape. Pixels are never pickled or copied between
+processes.
+
+Results that do not fit the slot's result region are sent in a one-off
+block that the front-end unlinks once it has read it.
+"""
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from utils.admission import Cancelled, DeadlineExceeded, Overloaded
+
+
+def attach(name):
+    """Open an existing block without letting this process's resource tracker unlink it at exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers attached blocks with the tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def claim(name):
+    """Open a block this process will unlink
+
+    It stays registered with this process's resource tracker until
+    ``unlink()`` unregisters it, so it is still removed if this process
+    dies before reading it.
+    """
+    return shared_memory.SharedMemory(name=name)
+
+
+class SlotLayout:
+    """Byte layout of a slot: person and clothing at fixed sizes, then a result region
+
+    Sizes are (width, height); ``result_pixels`` is the capacity of the
+    result region in RGB pixels.
+    """
+
+    def __init__(self, person_size, clothing_size, result_pixels):
+        self.shapes = {
+            'person': (person_size[1], person_size[0], 3),
+            'clothing': (clothing_size[1], clothing_size[0], 3),
+            'result': (int(result_pixels) * 3,)
+        }
+        self.offsets = {}
+        offset = 0
+        for name, shape in self.shapes.items():
+            self.offsets[name] = offset
+            offset += int(np.prod(shape))
+        self.size = offset
+
+    def views(self, buffer):
+        """uint8 array views of each region of ``buffer``"""
+        return {
+            name: np.ndarray(shape, dtype=np.uint8, buffer=buffer, offset=self.offsets[name])
+            for name, shape in self.shapes.items()
+        }
+
+    def result_view(self, views, shape):
+        """The result region viewed as an image of ``shape``, or None if it does not fit"""
+        count = int(np.prod(shape))
+        if count > views['result'].size:
+            return None
+        return views['result'][:count].reshape(shape)
+
+
+class Slot:
+    """One shared-memory block laid out by a SlotLayout"""
+
+    def __init__(self, shm, layout):
+        self.shm = shm
+        self.name = shm.name
+        self.layout = layout
+        self.views = layout.views(shm.buf)
+
+    def close(self):
+        # Views must go before the mapping can be closed
+        self.views = None
+        self.shm.close()
+
+
+class SlotPool:
+    """Fixed set of slots created and owned by one front-end process"""
+
+    def __init__(self, layout, count):
+        self.layout = layout
+        self._slots = [
+            Slot(shared_memory.SharedMemory(create=True, size=layout.size), layout)
+            for _ in range(max(1, int(count)))
+        ]
+        self._free = queue.Queue()
+        for slot in self._slots:
+            self._free.put(slot)
+
+    def acquire(self, timeout=None):
+        """Take a free slot, waiting up to ``timeout`` seconds; without one, only if a slot is free now"""
+        try:
+            if timeout is None:
+                return self._free.get_nowait()
+            return self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise Overloaded("No free transport slot", retry_after=1)
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def close(self):
+        """Unmap and remove every slot"""
+        for slot in self._slots:
+            slot.close()
+            try:
+                slot.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SlotCache:
+    """Worker-side attachments to front-end slots, opened on first use"""
+
+    def __init__(self, layout):
+        self.layout = layout
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is None:
+                slot = self._slots[name] = Slot(attach(name), self.layout)
+            return slot
+
+    def close(self):
+        with self._lock:
+            for slot in self._slots.values():
+                slot.close()
+            self._slots.clear()
+
+
+def write_result(slot, image_array):
+    """Write a result array into ``slot``, or into a new block if it does not fit
+
+    Returns the reply fields describing where the result is.
+    """
+    view = slot.layout.result_view(slot.views, image_array.shape)
+    if view is not None:
+        np.copyto(view, image_array)
+        return {'shape': image_array.shape, 'overflow': None}
+
+    shm = shared_memory.SharedMemory(create=True, size=image_array.nbytes)
+    np.copyto(np.ndarray(image_array.shape, dtype=np.uint8, buffer=shm.buf), image_array)
+    # The front-end unlinks it once read, so this process must not
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    name = shm.name
+    shm.close()
+    return {'shape': image_array.shape, 'overflow': name}
+
+
+def error_reply(request_id, error):
+    """Reply describing ``error`` so the front-end can re-raise the same kind"""
+    if isinstance(error, Overloaded):
+        kind = 'overloaded'
+    elif isinstance(error, DeadlineExceeded):
+        kind = 'timeout'
+    elif isinstance(error, Cancelled):
+        kind = 'cancelled'
+    else:
+        kind = 'error'
+    return {
+        'id': request_id,
+        'error': str(error),
+        'kind': kind,
+        'retry_after': getattr(error, 'retry_after', None)
+    }
+
+
+def raise_reply_error(reply):
+    kind = reply['kind']
+    if kind == 'overloaded':
+        raise Overloaded(reply['error'], retry_after=reply['retry_after'] or 1)
+    if kind == 'timeout':
+        raise DeadlineExceeded(reply['error'])
+    if kind == 'cancelled':
+        raise Cancelled(reply['error'])
+    raise RuntimeError(reply['error'])
+
+
+class _Pending:
+    __slots__ = ('future', 'slot', 'abandoned')
+
+    def __init__(self, slot):
+        self.future = Future()
+        self.slot = slot
+        self.abandoned = False
+
+
+class InferenceClient:
+    """Front-end side of the transport: send requests, match replies, hand back results
+
+    ``request_queue`` is shared by every front-end and inference worker;
+    ``reply_queue`` belongs to this front-end, whose index is ``frontend_id``.
+    A slot stays reserved until the worker has replied, even if the caller
+    gave up waiting, so a late result never lands in a slot reused by
+    another request.
+    """
+
+    def __init__(self, request_queue, reply_queue, frontend_id, pool):
+        self.request_queue = request_queue
+        self.reply_queue = reply_queue
+        self.frontend_id = frontend_id
+        self.pool = pool
+
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._dispatcher = None
+
+    def start(self):
+        """Start the thread that matches replies to waiting requests"""
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch, name='reply-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def run(self, person, clothing=None, fields=None, timeout=None):
+        """Run one try-on; returns ``(result_array, details)``
+
+        ``person`` and ``clothing`` are RGB arrays at the layout's sizes
+        (``clothing`` may be None when ``fields`` names a garment_id).
+        The returned array is a private copy; the slot is free again when
+        this returns. ``timeout`` bounds the whole request, waiting for a
+        free slot included; without one, Overloaded is raised at once if
+        no slot is free.
+        """
+        self.start()
+        # Absolute, so time spent waiting for a slot or in the queue counts against it
+        deadline = time.time() + timeout if timeout is not None else None
+        slot = self.pool.acquire(timeout)
+        np.copyto(slot.views['person'], person)
+        if clothing is not None:
+            np.copyto(slot.views['clothing'], clothing)
+
+        request_id = next(self._ids)
+        pending = _Pending(slot)
+        with self._lock:
+            self._pending[request_id] = pending
+
+        self.request_queue.put({
+            'id': request_id,
+            'frontend': self.frontend_id,
+            'slot': slot.name,
+            'has_clothing': clothing is not None,
+            'deadline': deadline,
+            **(fields or {})
+        })
+
+        try:
+            reply = pending.future.result(None if deadline is None else max(0.0, deadline - time.time()))
+        except FutureTimeoutError:
+            with self._lock:
+                if request_id in self._pending:
+                    pending.abandoned = True
+                    raise DeadlineExceeded("Request deadline exceeded")
+            # The reply arrived while we were giving up
+            reply = pending.future.result()
+
+        try:
+            if 'error' in reply:
+                raise_reply_error(reply)
+            return self._read_result(slot, reply), reply['details']
+        finally:
+            self.pool.release(slot)
+
+    def _read_result(self, slot, reply):
+        shape = tuple(reply['shape'])
+        if reply['overflow'] is None:
+            return slot.layout.result_view(slot.views, shape).copy()
+
+        shm = claim(reply['overflow'])
+        try:
+            return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _dispatch(self):
+        while True:
+            reply = self.reply_queue.get()
+            with self._lock:
+                pending = self._pending.pop(reply['id'], None)
+                if pending is None:
+                    continue
+                if not pending.abandoned:
+                    pending.future.set_result(reply)
+                    continue
+
+            # Nobody is waiting any more: drop the result and free the slot
+            if reply.get('overflow'):
+                shm = claim(reply['overflow'])
+                shm.close()
+                shm.unlink()
+            self.pool.release(pending.slot)